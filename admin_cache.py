@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+
+ADMIN_TTL = float(os.getenv("ADMIN_CACHE_TTL", "600"))
+ADMIN_STATUSES = {"administrator", "creator"}
+
+
+class AdminCache:
+    """
+    Администраторы чатов с TTL. Промах — один getChatAdministrators на чат
+    (параллельные проверки ждут тот же запрос); апдейты chat_member правят
+    кэш сразу, не дожидаясь истечения TTL. Если Telegram недоступен,
+    используется устаревший список, если он есть.
+    """
+
+    def __init__(self, ttl: float = ADMIN_TTL) -> None:
+        self.ttl = ttl
+        self._admins: dict[int, tuple[float, set[int]]] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, chat_id: int) -> set[int] | None:
+        cached = self._admins.get(chat_id)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        return None
+
+    async def is_admin(self, bot, chat_id: int, user_id: int) -> bool:
+        admins = self._fresh(chat_id)
+        if admins is not None:
+            self.hits += 1
+            return user_id in admins
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            admins = self._fresh(chat_id)
+            if admins is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                try:
+                    members = await bot.get_chat_administrators(chat_id)
+                except Exception as exc:
+                    print(f"[WARN] Админы чата {chat_id}: {exc}")
+                    stale = self._admins.get(chat_id)
+                    return stale is not None and user_id in stale[1]
+                admins = {member.user.id for member in members}
+                self._admins[chat_id] = (time.monotonic(), admins)
+        return user_id in admins
+
+    def apply_chat_member(self, chat_id: int, user_id: int, status: str) -> None:
+        """Обновление из апдейта chat_member (повышение, понижение, выход)."""
+        cached = self._admins.get(chat_id)
+        if cached is None:
+            return
+        admins = set(cached[1])
+        if status in ADMIN_STATUSES:
+            admins.add(user_id)
+        else:
+            admins.discard(user_id)
+        self._admins[chat_id] = (cached[0], admins)
+
+    def invalidate(self, chat_id: int | None = None) -> None:
+        if chat_id is None:
+            self._admins.clear()
+        else:
+            self._admins.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "chats": len(self._admins),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_CACHE: AdminCache | None = None
+
+
+def get_admin_cache() -> AdminCache:
+    """Общий на процесс кэш: списки админов не зависят от того, какой бот спрашивает."""
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = AdminCache()
+    return _CACHE
@@ -1,12 +1,18 @@
 import json
 import os
+import urllib.error
 import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
 
 from datetime import datetime
+from pathlib import Path
 from typing import Optional
 
+from llm_router import LLMRouter, RateLimitError, parse_preferences
+from open_web_crawler import conditional_get, load_state, parse_feed, save_state
+from section_parser import AGENCY_SCHEMA, parse_sections
+
 try:
     from dotenv import load_dotenv
 
@@ -19,92 +25,102 @@ QUERY = "Peptides Longevity Biohacking"
 GOOGLE_NEWS_RSS = (
     "https://news.google.com/rss/search?q={query}&hl=en-US&gl=US&ceid=US:en"
 )
-
-
-def _fetch_url(url: str, timeout: int = 30) -> str:
-    request = urllib.request.Request(url, method="GET")
-    request.add_header("User-Agent", "Mozilla/5.0")
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        return response.read().decode("utf-8", errors="replace")
+STATE_FILE = Path(__file__).resolve().parent / ".agency_poster_state.json"
+MAX_SEEN = 2000
+# Запросы через ";", дополнительные RSS/Atom-фиды через ",".
+QUERIES = [q.strip() for q in os.getenv("AGENCY_QUERIES", QUERY).split(";") if q.strip()]
+EXTRA_FEEDS = [u.strip() for u in os.getenv("AGENCY_FEEDS", "").split(",") if u.strip()]
+MAX_POSTS = int(os.getenv("AGENCY_MAX_POSTS", "1"))
 
 
 def _parse_pub_date(value: str) -> datetime:
+    for fmt in ("%a, %d %b %Y %H:%M:%S %Z", "%a, %d %b %Y %H:%M:%S %z"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=None)
+        except Exception:
+            continue
     try:
-        return datetime.strptime(value, "%a, %d %b %Y %H:%M:%S %Z")
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
     except Exception:
         return datetime.min
 
 
-def _get_latest_news() -> dict:
-    url = GOOGLE_NEWS_RSS.format(query=urllib.parse.quote_plus(QUERY))
-    xml_text = _fetch_url(url)
-    root = ET.fromstring(xml_text)
-    channel = root.find("channel")
-    if channel is None:
-        raise RuntimeError("No channel found in RSS feed.")
+def _feed_urls() -> list[str]:
+    urls = [GOOGLE_NEWS_RSS.format(query=urllib.parse.quote_plus(q)) for q in QUERIES]
+    return urls + [url for url in EXTRA_FEEDS if url not in urls]
 
-    items = channel.findall("item")
-    if not items:
-        raise RuntimeError("No news items found.")
-
-    latest = None
-    latest_date = datetime.min
-    for item in items:
-        pub_date = item.findtext("pubDate", default="")
-        dt = _parse_pub_date(pub_date)
-        if dt > latest_date:
-            latest_date = dt
-            latest = item
-
-    if latest is None:
-        raise RuntimeError("No latest item found.")
-
-    title = latest.findtext("title", default="").strip()
-    link = latest.findtext("link", default="").strip()
-    description = latest.findtext("description", default="").strip()
-    source = latest.findtext("source", default="").strip()
-    return {
-        "title": title,
-        "link": link,
-        "description": description,
-        "source": source,
-        "published_at": latest_date.isoformat() if latest_date else "",
-    }
 
+def _item_keys(entry: dict) -> list[str]:
+    """Одна новость под разными запросами/фидами: guid, ссылка и заголовок."""
+    title = " ".join(entry.get("title", "").casefold().split())
+    keys = [f"id:{entry['id']}", f"url:{entry['url']}"]
+    if title:
+        keys.append(f"title:{title}")
+    return keys
 
-def _openai_generate(prompt: str, api_key: str, model: str) -> str:
-    payload = {
-        "model": model,
-        "temperature": 0.2,
-        "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "Ты — научный редактор. Пиши кратко, по делу, по-русски."
-                ),
-            },
-            {"role": "user", "content": prompt},
-        ],
-    }
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    request = urllib.request.Request(
-        "https://api.openai.com/v1/chat/completions", data=data, method="POST"
-    )
-    request.add_header("Content-Type", "application/json")
-    request.add_header("Authorization", f"Bearer {api_key}")
-    try:
-        with urllib.request.urlopen(request, timeout=60) as response:
-            body = response.read().decode("utf-8")
-    except urllib.error.HTTPError as exc:
-        body = exc.read().decode("utf-8", errors="replace").strip()
-        if body:
-            print(body)
-        raise
-    parsed = json.loads(body)
-    choices = parsed.get("choices", [])
-    if not choices:
-        return ""
-    return (choices[0].get("message") or {}).get("content", "").strip()
+
+def _poll_new_items(state: dict) -> list[dict]:
+    """
+    Условный GET каждого фида (ETag/Last-Modified); при 304 фид не
+    разбирается. Возвращает ещё не виденные новости, новые первыми.
+    """
+    feeds_state = state.setdefault("feeds", {})
+    seen = set(state.get("seen", []))
+    fresh: list[dict] = []
+    for url in _feed_urls():
+        feed_state = feeds_state.setdefault(url, {})
+        try:
+            body, validators = conditional_get(url, feed_state)
+        except Exception as exc:
+            print(f"[WARN] {url}: {exc}")
+            continue
+        if body is None:
+            print(f"Без изменений (304): {url}")
+            continue
+        try:
+            entries = parse_feed(body)
+        except ET.ParseError as exc:
+            print(f"[WARN] {url}: не удалось разобрать XML ({exc})")
+            continue
+        feed_state.update(validators)
+        for entry in entries:
+            keys = _item_keys(entry)
+            if any(key in seen for key in keys):
+                continue
+            seen.update(keys)
+            published = _parse_pub_date(entry.get("published", ""))
+            fresh.append(
+                {
+                    "title": entry["title"],
+                    "link": entry["url"],
+                    "description": entry["summary"],
+                    "source": entry.get("source", ""),
+                    "published_at": published.isoformat() if published != datetime.min else "",
+                    "keys": keys,
+                    "_published": published,
+                }
+            )
+    fresh.sort(key=lambda item: item["_published"], reverse=True)
+    return fresh
+
+
+def _mark_seen(state: dict, keys: list[str]) -> None:
+    previous = state.get("seen", [])
+    known = set(previous)
+    state["seen"] = ([key for key in keys if key not in known] + previous)[:MAX_SEEN]
+
+
+NEWS_SYSTEM_PROMPT = "Ты — научный редактор. Пиши кратко, по делу, по-русски."
+_ROUTER: Optional[LLMRouter] = None
+
+
+def _get_router() -> LLMRouter:
+    global _ROUTER
+    if _ROUTER is None:
+        model = os.getenv("NEWS_MODEL", "gpt-4o-mini")
+        preferences = os.getenv("NEWS_LLM_PROVIDERS", f"openai:{model},gemini:gemini-flash-latest")
+        _ROUTER = LLMRouter(parse_preferences(preferences), timeout=60)
+    return _ROUTER
 
 
 def _openai_generate_image(title: str, api_key: str) -> Optional[str]:
@@ -146,37 +162,6 @@ def _openai_generate_image(title: str, api_key: str) -> Optional[str]:
     return url
 
 
-def _gemini_generate(prompt: str, api_key: str, model: str) -> str:
-    payload = {
-        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-        "generationConfig": {"temperature": 0.2},
-    }
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    endpoint = (
-        "https://generativelanguage.googleapis.com/v1beta/models/"
-        f"{model}:generateContent?key={api_key}"
-    )
-    request = urllib.request.Request(endpoint, data=data, method="POST")
-    request.add_header("Content-Type", "application/json")
-    try:
-        with urllib.request.urlopen(request, timeout=60) as response:
-            body = response.read().decode("utf-8")
-    except urllib.error.HTTPError as exc:
-        body = exc.read().decode("utf-8", errors="replace").strip()
-        if body:
-            print(body)
-        raise
-    parsed = json.loads(body)
-    candidates = parsed.get("candidates", [])
-    if not candidates:
-        return ""
-    content = candidates[0].get("content", {})
-    parts = content.get("parts", [])
-    if not parts:
-        return ""
-    return parts[0].get("text", "").strip()
-
-
 def _safe_filename(value: str) -> str:
     cleaned = []
     for ch in value.lower():
@@ -189,18 +174,14 @@ def _safe_filename(value: str) -> str:
 
 
 def _split_variants(text: str) -> tuple[str, str]:
-    if "===POST===" in text and "===SCIENCE===" in text:
-        post = text.split("===POST===", 1)[1].split("===SCIENCE===", 1)[0].strip()
-        science = text.split("===SCIENCE===", 1)[1].strip()
-        return post, science
-    return text.strip(), ""
+    parsed = parse_sections(text, AGENCY_SCHEMA)
+    if parsed.ok:
+        return parsed.get("post"), parsed.get("science")
+    print(f"[WARN] Ответ LLM не по формату: {'; '.join(parsed.errors)}")
+    return parsed.get("post") or parsed.preamble or text.strip(), parsed.get("science")
 
 
 def _generate_posts(article: dict) -> tuple[str, str]:
-    openai_key = os.getenv("OPENAI_API_KEY")
-    gemini_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    model = os.getenv("NEWS_MODEL", "gpt-4o-mini")
-
     prompt = (
         "Сформируй два текста для Telegram на основе новости.\n"
         f"Заголовок: {article['title']}\n"
@@ -220,18 +201,11 @@ def _generate_posts(article: dict) -> tuple[str, str]:
         "Обязательно укажи ссылку.\n"
     )
 
-    if openai_key:
-        try:
-            raw = _openai_generate(prompt, openai_key, model)
-            return _split_variants(raw)
-        except urllib.error.HTTPError:
-            pass
-    if gemini_key:
-        try:
-            raw = _gemini_generate(prompt, gemini_key, "gemini-flash-latest")
-            return _split_variants(raw)
-        except urllib.error.HTTPError:
-            pass
+    try:
+        response = _get_router().generate(prompt, system=NEWS_SYSTEM_PROMPT)
+        return _split_variants(response.text)
+    except (urllib.error.URLError, RuntimeError, RateLimitError) as exc:
+        print(f"LLM недоступен: {exc}")
 
     # Fallback без LLM
     title = article["title"] or "Новая статья"
@@ -279,8 +253,7 @@ def _send_telegram(
     urllib.request.urlopen(request, timeout=30)
 
 
-def test_run() -> None:
-    article = _get_latest_news()
+def _publish(article: dict) -> None:
     post_text, science_text = _generate_posts(article)
 
     # Генерируем картинку на основе заголовка статьи
@@ -301,7 +274,31 @@ def test_run() -> None:
     file_path = os.path.join(db_dir, filename)
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(science_text.strip() + "\n")
-    print("Test Run: пост отправлен.")
+
+
+def test_run(max_posts: int = MAX_POSTS) -> None:
+    """
+    Один тик cron: новые новости из всех фидов, до max_posts публикаций
+    (самые свежие). Остальные новые отмечаются виденными без генерации;
+    уже опубликованное никогда не уходит в LLM и DALL·E повторно.
+    """
+    state = load_state(STATE_FILE)
+    fresh = _poll_new_items(state)
+    if not fresh:
+        save_state(state, STATE_FILE)
+        print("Новых новостей нет.")
+        return
+
+    posted = 0
+    for article in fresh:
+        if posted < max_posts:
+            _publish(article)
+            posted += 1
+            print(f"Опубликовано: {article['title']}")
+        _mark_seen(state, article["keys"])
+        # После каждой публикации — чтобы сбой дальше не повторил пост.
+        save_state(state, STATE_FILE)
+    print(f"Test Run: новых {len(fresh)}, опубликовано {posted}.")
 
 
 if __name__ == "__main__":
@@ -1,46 +1,51 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
+import signal
 import sys
-import time
 import urllib.error
 import urllib.parse
 import urllib.request
 from typing import Any
 
+import metrics
+from embedding_cache import get_embedder
+from hybrid_search import HybridRetriever, query_terms
 from supabase_client import get_supabase_client, load_env
+from vector_index import get_local_index
 
 
 DEFAULT_MATCH_FN = "match_documents"
 EMBEDDING_MODEL = "text-embedding-3-small"
+ANALYTIC_WORKERS = int(os.getenv("ANALYTIC_WORKERS", "8"))
+# Меньше таймаута urllib в _telegram_request (30 с).
+POLL_TIMEOUT = 25
+# Пока ранний апдейт в работе, getUpdates сразу отдаёт уже полученные —
+# между такими опросами ждём завершения задачи не дольше этого.
+REDELIVERY_WAIT = 1.0
+# 1 — сначала локальный ANN-индекс (vector_index.py), RPC только при промахе.
+LOCAL_INDEX_FIRST = os.getenv("ANALYTIC_LOCAL_INDEX_FIRST", "0") == "1"
 
 
 def _telegram_request(token: str, method: str, payload: dict) -> dict:
-    url = f"https://api.telegram.org/bot{token}/{method}"
+    # TELEGRAM_API_BASE — локальный fake_bot_api.py для нагрузочных тестов.
+    api_base = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+    url = f"{api_base}/bot{token}/{method}"
     data = urllib.parse.urlencode(payload).encode("utf-8")
     request = urllib.request.Request(url, data=data, method="POST")
     request.add_header("Content-Type", "application/x-www-form-urlencoded")
-    with urllib.request.urlopen(request, timeout=30) as response:
-        body = response.read().decode("utf-8")
+    with metrics.timer("outbound_seconds", target="telegram", method=method):
+        with urllib.request.urlopen(request, timeout=30) as response:
+            body = response.read().decode("utf-8")
     return json.loads(body)
 
 
 def _openai_embed(text: str) -> list[float]:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY for vector search.")
-    payload = {"model": EMBEDDING_MODEL, "input": text}
-    data = json.dumps(payload).encode("utf-8")
-    request = urllib.request.Request(
-        "https://api.openai.com/v1/embeddings", data=data, method="POST"
-    )
-    request.add_header("Content-Type", "application/json")
-    request.add_header("Authorization", f"Bearer {api_key}")
-    with urllib.request.urlopen(request, timeout=30) as response:
-        body = response.read().decode("utf-8")
-    parsed = json.loads(body)
-    return parsed["data"][0]["embedding"]
+    # Кэш по нормализованному тексту; одновременные промахи
+    # собираются в один запрос /v1/embeddings.
+    return get_embedder(EMBEDDING_MODEL).embed(text)
 
 
 def _vector_search(query: str, limit: int = 3) -> list[dict]:
@@ -48,14 +53,15 @@ def _vector_search(query: str, limit: int = 3) -> list[dict]:
     embedding = _openai_embed(query)
     supabase = get_supabase_client()
     try:
-        response = supabase.rpc(
-            match_fn,
-            {
-                "query_embedding": embedding,
-                "match_count": limit,
-                "match_threshold": 0.0,
-            },
-        ).execute()
+        with metrics.timer("outbound_seconds", target="supabase", method=match_fn):
+            response = supabase.rpc(
+                match_fn,
+                {
+                    "query_embedding": embedding,
+                    "match_count": limit,
+                    "match_threshold": 0.0,
+                },
+            ).execute()
     except Exception:
         return []
     if getattr(response, "error", None):
@@ -63,6 +69,17 @@ def _vector_search(query: str, limit: int = 3) -> list[dict]:
     return response.data or []
 
 
+def _local_vector_search(query: str, limit: int = 3) -> list[dict]:
+    # Пусто, если numpy не установлен или индекс ещё не собран.
+    index = get_local_index()
+    if index is None:
+        return []
+    embedding = _openai_embed(query)
+    with metrics.timer("outbound_seconds", target="local_index", method="search"):
+        hits = index.search(embedding, k=limit)
+    return [dict(row, similarity=score) for row, score in hits]
+
+
 def _text_search(query: str, limit: int = 5) -> list[dict]:
     supabase = get_supabase_client()
     response = (
@@ -93,14 +110,58 @@ def _latest_article() -> dict | None:
     return items[0] if items else None
 
 
-def _find_best_article(query: str) -> dict | None:
+def _fulltext_search(query: str, limit: int = 20) -> list[dict]:
+    # Полнотекстовый поиск Postgres (websearch, конфигурация simple — RU и EN);
+    # при ошибке (нет прав/индекса) — прежний ilike.
+    terms = [term.replace('"', "") for term in query_terms(query)]
+    if not terms:
+        return _text_search(query, limit=limit)
+    expression = '"' + " or ".join(terms) + '"'
+    supabase = get_supabase_client()
     try:
-        vector_hits = _vector_search(query, limit=3)
+        with metrics.timer("outbound_seconds", target="supabase", method="fulltext"):
+            response = (
+                supabase.table("news_articles")
+                .select("id,title,url,content,summary,created_at")
+                .or_(
+                    f"title.wfts(simple).{expression},"
+                    f"summary.wfts(simple).{expression},"
+                    f"content.wfts(simple).{expression}"
+                )
+                .order("created_at", desc=True)
+                .limit(limit)
+                .execute()
+            )
     except Exception:
-        vector_hits = []
-    if vector_hits:
-        return vector_hits[0]
-    hits = _text_search(query, limit=5)
+        return _text_search(query, limit=limit)
+    if getattr(response, "error", None):
+        return _text_search(query, limit=limit)
+    return response.data or []
+
+
+def _semantic_search(query: str, limit: int = 20) -> list[dict]:
+    searches = [_vector_search, _local_vector_search]
+    if LOCAL_INDEX_FIRST:
+        searches.reverse()
+    for search in searches:
+        try:
+            hits = search(query, limit=limit)
+        except Exception:
+            hits = []
+        if hits:
+            return hits
+    return []
+
+
+_RETRIEVER = HybridRetriever(_fulltext_search, _semantic_search)
+
+
+def get_retriever() -> HybridRetriever:
+    return _RETRIEVER
+
+
+def _find_best_article(query: str) -> dict | None:
+    hits = _RETRIEVER.search(query, limit=3)
     if hits:
         return hits[0]
     return _latest_article()
@@ -151,6 +212,7 @@ def _compose_answer(query: str, article: dict) -> str:
     return f"{body}\n\n{citation}".strip()
 
 
+@metrics.timed("handler_seconds", bot="analytic")
 def _handle_update(token: str, update: dict, allowed_chat_ids: set[str] | None) -> None:
     message = update.get("message") or update.get("edited_message")
     if not message:
@@ -177,6 +239,111 @@ def _handle_update(token: str, update: dict, allowed_chat_ids: set[str] | None)
     _telegram_request(token, "sendMessage", payload)
 
 
+def _chat_key(update: dict) -> str:
+    # Порядок держим в пределах собеседника в чате: в обсуждении канала
+    # все пишут в один чат, и строгий порядок по чату убил бы параллельность.
+    message = update.get("message") or update.get("edited_message") or {}
+    chat_id = (message.get("chat") or {}).get("id")
+    sender_id = (message.get("from") or {}).get("id")
+    return f"{chat_id}:{sender_id}"
+
+
+async def _poll_loop(
+    token: str, allowed_chat_ids: set[str] | None, workers: int = ANALYTIC_WORKERS
+) -> None:
+    """
+    Long polling с параллельной обработкой: до `workers` апдейтов одновременно,
+    но сообщения одного собеседника в чате обрабатываются строго по порядку.
+    offset подтверждает Telegram только апдейты ниже самого раннего
+    незавершённого — при падении или перезапуске необработанные придут снова.
+    Пока он в работе, Telegram повторно отдаёт уже полученные апдейты: они
+    пропускаются, а если нового нет, цикл ждёт завершения задачи (не дольше
+    REDELIVERY_WAIT) вместо холостого опроса. Если в работе больше
+    workers * 4 апдейтов, новые не запрашиваются, пока часть не закончится.
+    При отмене дожидается начатых апдейтов и подтверждает их.
+    """
+    semaphore = asyncio.Semaphore(workers)
+    chat_locks: dict[str, asyncio.Lock] = {}
+    chat_pending: dict[str, int] = {}
+    in_flight: dict[int, asyncio.Task] = {}
+    max_in_flight = workers * 4
+    next_id = 0  # все апдейты ниже уже получены
+
+    async def process(update_id: int, update: dict, chat_key: str) -> None:
+        try:
+            async with chat_locks[chat_key]:
+                async with semaphore:
+                    await asyncio.to_thread(_handle_update, token, update, allowed_chat_ids)
+        except Exception as exc:
+            print(f"[ERROR] update {update_id}: {exc}")
+        finally:
+            chat_pending[chat_key] -= 1
+            if not chat_pending[chat_key]:
+                del chat_pending[chat_key]
+                del chat_locks[chat_key]
+
+    try:
+        while True:
+            if len(in_flight) >= max_in_flight:
+                await asyncio.wait(set(in_flight.values()), return_when=asyncio.FIRST_COMPLETED)
+            offset = min(in_flight, default=next_id)
+            payload: dict[str, Any] = {"timeout": POLL_TIMEOUT, "offset": offset}
+            try:
+                data = await asyncio.to_thread(_telegram_request, token, "getUpdates", payload)
+            except urllib.error.HTTPError as exc:
+                body = exc.read().decode("utf-8").strip()
+                print(body or f"HTTP {exc.code}")
+                await asyncio.sleep(2)
+                continue
+            except urllib.error.URLError as exc:
+                print(f"getUpdates: {exc}")
+                await asyncio.sleep(2)
+                continue
+
+            if not data.get("ok"):
+                await asyncio.sleep(1)
+                continue
+
+            fresh = 0
+            for update in data.get("result", []):
+                update_id = update.get("update_id", 0)
+                if update_id < next_id:
+                    continue  # ещё в работе или уже обработан
+                next_id = update_id + 1
+                fresh += 1
+                chat_key = _chat_key(update)
+                chat_locks.setdefault(chat_key, asyncio.Lock())
+                chat_pending[chat_key] = chat_pending.get(chat_key, 0) + 1
+                task = asyncio.create_task(process(update_id, update, chat_key))
+                in_flight[update_id] = task
+                task.add_done_callback(lambda _task, done_id=update_id: in_flight.pop(done_id, None))
+            if not fresh and in_flight:
+                await asyncio.wait(
+                    set(in_flight.values()), timeout=REDELIVERY_WAIT, return_when=asyncio.FIRST_COMPLETED
+                )
+    finally:
+        if in_flight:
+            print(f"Дожидаюсь {len(in_flight)} апдейт(ов) в работе...")
+            await asyncio.gather(*in_flight.values(), return_exceptions=True)
+        if next_id:
+            try:
+                await asyncio.to_thread(
+                    _telegram_request, token, "getUpdates", {"offset": next_id, "timeout": 0, "limit": 1}
+                )
+            except urllib.error.URLError as exc:
+                print(f"getUpdates (подтверждение offset): {exc}")
+
+
+def allowed_chat_ids() -> set[str] | None:
+    allowed = os.getenv("TELEGRAM_ALLOWED_CHAT_IDS")
+    discussion = os.getenv("TELEGRAM_DISCUSSION_CHAT_ID")
+    if discussion:
+        return {discussion.strip()}
+    if allowed:
+        return {item.strip() for item in allowed.split(",") if item.strip()}
+    return None
+
+
 def run_polling() -> None:
     load_env()
     token = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -184,34 +351,21 @@ def run_polling() -> None:
         print("Missing TELEGRAM_BOT_TOKEN in .env")
         sys.exit(1)
 
-    allowed = os.getenv("TELEGRAM_ALLOWED_CHAT_IDS")
-    discussion = os.getenv("TELEGRAM_DISCUSSION_CHAT_ID")
-    if discussion:
-        allowed_chat_ids = {discussion.strip()}
-    elif allowed:
-        allowed_chat_ids = {item.strip() for item in allowed.split(",") if item.strip()}
-    else:
-        allowed_chat_ids = None
+    metrics.start_json_dumps()
 
-    offset = 0
-    while True:
-        payload: dict[str, Any] = {"timeout": 30, "offset": offset}
+    async def serve() -> None:
+        # SIGTERM — как Ctrl+C: отмена цикла, начатые апдейты дорабатываются.
+        main_task = asyncio.current_task()
         try:
-            data = _telegram_request(token, "getUpdates", payload)
-        except urllib.error.HTTPError as exc:
-            body = exc.read().decode("utf-8").strip()
-            print(body or f"HTTP {exc.code}")
-            time.sleep(2)
-            continue
-
-        if not data.get("ok"):
-            time.sleep(1)
-            continue
-
-        updates = data.get("result", [])
-        for update in updates:
-            offset = max(offset, update.get("update_id", 0) + 1)
-            _handle_update(token, update, allowed_chat_ids)
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows
+        await _poll_loop(token, allowed_chat_ids())
+
+    try:
+        asyncio.run(serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
 
 
 if __name__ == "__main__":
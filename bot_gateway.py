@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+import urllib.error
+
+from telegram import Update
+
+import biopeptide_analytic
+import comment_handler
+import dr_drag_bot
+import metrics
+from supabase_client import load_env
+
+
+GATEWAY_HOST = os.getenv("GATEWAY_HOST", "127.0.0.1")
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", "8080"))
+MAX_BODY_BYTES = 1_000_000
+POLL_TIMEOUT = 25
+ALLOWED_UPDATES = ["message", "edited_message", "chat_member"]
+# JSONL входящих апдейтов для replay_updates.py (пусто — не записывать).
+RECORD_FILE = os.getenv("GATEWAY_RECORD_FILE", "")
+
+
+class KeyedRunner:
+    """
+    Не больше `workers` задач одновременно; задачи с одинаковым ключом
+    (собеседник в чате) выполняются строго по порядку поступления.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self._semaphore = asyncio.Semaphore(workers)
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._pending: dict[str, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, key: str, func, *args) -> None:
+        self._locks.setdefault(key, asyncio.Lock())
+        self._pending[key] = self._pending.get(key, 0) + 1
+        task = asyncio.create_task(self._run(key, func, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: str, func, *args) -> None:
+        try:
+            async with self._locks[key]:
+                async with self._semaphore:
+                    await asyncio.to_thread(func, *args)
+        except Exception as exc:
+            print(f"[ERROR] {key}: {exc}")
+        finally:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._locks[key]
+
+
+class BotGateway:
+    """
+    Один процесс и один event loop для всех ботов: Арбитр и Dr. Drag
+    (python-telegram-bot Application без собственного updater) и аналитик
+    (синхронный обработчик в пуле потоков). Апдейты приходят вебхуками на
+    /webhook/<имя бота> или, для локальной отладки, через getUpdates — путь
+    обработки один. Индекс research_db, кэш ответов, движок модерации и
+    кэш эмбеддингов общие для всех ботов, потому что живут в одном процессе.
+    """
+
+    def __init__(self) -> None:
+        self.routes: dict[str, dict] = {}
+        self.apps: list = []
+        self.analytic = KeyedRunner(biopeptide_analytic.ANALYTIC_WORKERS)
+        self.analytic_chat_ids = biopeptide_analytic.allowed_chat_ids()
+        self.stats: dict[str, int] = {}
+        self.started_at = time.time()
+        self._record = open(RECORD_FILE, "a", encoding="utf-8") if RECORD_FILE else None
+
+    def add_ptb_bot(self, name: str, token: str, app) -> None:
+        self._route(name, token)["apps"].append(app)
+        self.apps.append(app)
+
+    def add_analytic_bot(self, name: str, token: str) -> None:
+        self._route(name, token)["analytic"] = True
+
+    def _route(self, name: str, token: str) -> dict:
+        # Один токен может обслуживать несколько обработчиков
+        # (TELEGRAM_BOT_TOKEN по умолчанию совпадает с DR_DRAG_TOKEN).
+        for route in self.routes.values():
+            if route["token"] == token:
+                route["names"].append(name)
+                return route
+        route = {
+            "token": token,
+            "names": [name],
+            "apps": [],
+            "analytic": False,
+            "secret": os.getenv("GATEWAY_WEBHOOK_SECRET")
+            or hashlib.sha256(token.encode("utf-8")).hexdigest()[:32],
+        }
+        self.routes[name] = route
+        return route
+
+    async def dispatch(self, route: dict, data: dict) -> None:
+        for name in route["names"]:
+            self.stats[name] = self.stats.get(name, 0) + 1
+            metrics.inc("updates_total", bot=name)
+        if self._record is not None:
+            self._record.write(
+                json.dumps({"bot": route["names"][0], "update": data}, ensure_ascii=False) + "\n"
+            )
+            self._record.flush()
+        for app in route["apps"]:
+            await app.update_queue.put(Update.de_json(data, app.bot))
+        if route["analytic"]:
+            self.analytic.submit(
+                biopeptide_analytic._chat_key(data),
+                biopeptide_analytic._handle_update,
+                route["token"],
+                data,
+                self.analytic_chat_ids,
+            )
+
+    async def start(self) -> None:
+        for app in self.apps:
+            await app.initialize()
+            await app.start()
+
+    async def stop(self) -> None:
+        for app in self.apps:
+            await app.stop()
+            await app.shutdown()
+
+    # --- webhook ---------------------------------------------------------
+
+    async def set_webhooks(self, base_url: str) -> None:
+        for name, route in self.routes.items():
+            url = f"{base_url.rstrip('/')}/webhook/{name}"
+            result = await asyncio.to_thread(
+                biopeptide_analytic._telegram_request,
+                route["token"],
+                "setWebhook",
+                {
+                    "url": url,
+                    "secret_token": route["secret"],
+                    "allowed_updates": json.dumps(ALLOWED_UPDATES),
+                    "max_connections": 40,
+                },
+            )
+            print(f"Webhook {name}: {url} -> {result.get('description', result.get('ok'))}")
+
+    async def _respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: str,
+        body: bytes = b"",
+        content_type: str = "application/json",
+    ) -> None:
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+            + body
+        )
+        await writer.drain()
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers: dict[str, str] = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            if method == "GET" and path == "/healthz":
+                body = json.dumps(
+                    {"uptime": round(time.time() - self.started_at), "updates": self.stats}
+                ).encode("utf-8")
+                await self._respond(writer, "200 OK", body)
+                return
+            if method == "GET" and path == "/metrics":
+                body = metrics.REGISTRY.render_prometheus().encode("utf-8")
+                await self._respond(writer, "200 OK", body, "text/plain; version=0.0.4")
+                return
+
+            route = self.routes.get(path.rsplit("/", 1)[-1]) if path.startswith("/webhook/") else None
+            if method != "POST" or route is None:
+                await self._respond(writer, "404 Not Found")
+                return
+            if headers.get("x-telegram-bot-api-secret-token") != route["secret"]:
+                await self._respond(writer, "403 Forbidden")
+                return
+            length = int(headers.get("content-length", "0"))
+            if length > MAX_BODY_BYTES:
+                await self._respond(writer, "413 Payload Too Large")
+                return
+            data = json.loads(await reader.readexactly(length))
+            # Telegram ждёт быстрый 200; обработка идёт уже после ответа.
+            await self._respond(writer, "200 OK")
+            await self.dispatch(route, data)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as exc:
+            print(f"[WARN] Webhook: некорректный запрос: {exc}")
+            try:
+                await self._respond(writer, "400 Bad Request")
+            except ConnectionError:
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve_webhooks(
+        self, base_url: str, host: str = GATEWAY_HOST, port: int = GATEWAY_PORT
+    ) -> None:
+        await self.set_webhooks(base_url)
+        server = await asyncio.start_server(self.handle_http, host, port)
+        print(f"Gateway: вебхуки на http://{host}:{port}/webhook/<bot>, боты: {', '.join(self.routes)}")
+        async with server:
+            await server.serve_forever()
+
+    # --- polling (локальная отладка) ---------------------------------------
+
+    async def _poll(self, name: str, route: dict) -> None:
+        token = route["token"]
+        await asyncio.to_thread(
+            biopeptide_analytic._telegram_request, token, "deleteWebhook", {}
+        )
+        offset = 0
+        while True:
+            payload = {
+                "timeout": POLL_TIMEOUT,
+                "offset": offset,
+                "allowed_updates": json.dumps(ALLOWED_UPDATES),
+            }
+            try:
+                data = await asyncio.to_thread(
+                    biopeptide_analytic._telegram_request, token, "getUpdates", payload
+                )
+            except (urllib.error.URLError, OSError) as exc:
+                print(f"getUpdates {name}: {exc}")
+                await asyncio.sleep(2)
+                continue
+            if not data.get("ok"):
+                await asyncio.sleep(1)
+                continue
+            for update in data.get("result", []):
+                offset = max(offset, update.get("update_id", 0) + 1)
+                await self.dispatch(route, update)
+
+    async def serve_polling(self) -> None:
+        print(f"Gateway: polling, боты: {', '.join(self.routes)}")
+        await asyncio.gather(*(self._poll(name, route) for name, route in self.routes.items()))
+
+
+def build_gateway() -> BotGateway:
+    gateway = BotGateway()
+    arbiter_token = os.getenv("ARBITER_TOKEN")
+    if arbiter_token:
+        comment_handler.warm_caches()
+        gateway.add_ptb_bot("arbiter", arbiter_token, comment_handler.build_application(arbiter_token))
+    drag_token = os.getenv("DR_DRAG_TOKEN")
+    if drag_token:
+        gateway.add_ptb_bot("drdrag", drag_token, dr_drag_bot.build_application(drag_token))
+    # Аналитик — только явно (GATEWAY_ANALYTIC=1): run_bots.py подставляет
+    # в TELEGRAM_BOT_TOKEN токен Dr. Drag, и бот отвечал бы во всех чатах.
+    analytic_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if analytic_token and os.getenv("GATEWAY_ANALYTIC", "0") == "1":
+        if analytic_token in (arbiter_token, drag_token):
+            print("[WARN] TELEGRAM_BOT_TOKEN совпадает с токеном другого бота — аналитик не запущен.")
+        else:
+            gateway.add_analytic_bot("analytic", analytic_token)
+    return gateway
+
+
+async def run(mode: str, webhook_url: str = "") -> None:
+    gateway = build_gateway()
+    if not gateway.routes:
+        print("Missing ARBITER_TOKEN / DR_DRAG_TOKEN / TELEGRAM_BOT_TOKEN in .env")
+        return
+    metrics.start_json_dumps()
+    await gateway.start()
+    try:
+        if mode == "webhook":
+            await gateway.serve_webhooks(webhook_url)
+        else:
+            await gateway.serve_polling()
+    finally:
+        await gateway.stop()
+
+
+def main() -> int:
+    load_env()
+    # Публичный HTTPS-адрес (TLS завершает nginx/Caddy), например https://bot.example.com
+    webhook_url = os.getenv("GATEWAY_WEBHOOK_URL", "")
+    parser = argparse.ArgumentParser(description="Single process gateway for all Telegram bots.")
+    parser.add_argument(
+        "--mode",
+        choices=["webhook", "polling"],
+        default=os.getenv("GATEWAY_MODE") or ("webhook" if webhook_url else "polling"),
+    )
+    args = parser.parse_args()
+    if args.mode == "webhook" and not webhook_url:
+        print("Missing GATEWAY_WEBHOOK_URL for webhook mode")
+        return 1
+    try:
+        asyncio.run(run(args.mode, webhook_url))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,45 @@
+import argparse
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
 from supabase import create_client, Client
 
+from supabase_bulk import chunk_rows, is_missing_function_error, write_chunks
+
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "").strip()
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "").strip()
 
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    raise ValueError("Missing SUPABASE_URL or SUPABASE_ANON_KEY")
+TABLE = "research_posts"
+# Только то, что нужно классификатору: без content_lite, image_url и т.п.
+SELECT_COLUMNS = "id,title,content,category"
+CHECKPOINT_FILE = Path(__file__).resolve().parent / ".bulk_update_metadata_state.json"
+RPC_NAME = "bulk_classify_research_posts"
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+# Выполнить один раз в SQL Editor Supabase: python bulk_update_metadata.py --print-sql
+# Типы берутся из самой таблицы (jsonb_populate_recordset), поэтому функция
+# не зависит от того, uuid или bigint в id и text[] или jsonb в biological_targets.
+BULK_CLASSIFY_SQL = """
+create or replace function public.bulk_classify_research_posts(items jsonb)
+returns integer
+language sql
+as $$
+  with updated as (
+    update public.research_posts p
+    set biological_targets = i.biological_targets,
+        category = i.category,
+        evidence_level = i.evidence_level
+    from jsonb_populate_recordset(null::public.research_posts, items) as i
+    where p.id = i.id
+    returning 1
+  )
+  select count(*)::integer from updated;
+$$;
+"""
 
 MAPPING = {
     "biological_targets": {
@@ -51,56 +82,221 @@ MAPPING = {
 }
 
 
-def analyze_and_update_optimized(batch_size: int = 100) -> None:
-    while True:
-        response = (
-            supabase.table("research_posts")
-            .select("*")
-            .or_("evidence_level.is.null,biological_targets.is.null")
-            .limit(batch_size)
-            .execute()
-        )
-        posts = response.data or []
-        if not posts:
-            print("Все записи уже обработаны или база пуста.")
-            return
-
-        for post in posts:
-            text = (post.get("title", "") + " " + post.get("content", "")).lower()
-
-            targets = list(
-                {
-                    value
-                    for key, value in MAPPING["biological_targets"].items()
-                    if key in text
-                }
+def classify(post: dict) -> dict:
+    """Строка research_posts -> {id, biological_targets, category, evidence_level}."""
+    text = ((post.get("title") or "") + " " + (post.get("content") or "")).lower()
+
+    targets = sorted(
+        {value for key, value in MAPPING["biological_targets"].items() if key in text}
+    )
+
+    category = post.get("category")
+    for key, value in MAPPING["categories"].items():
+        if key in text:
+            category = value
+            break
+
+    evidence = "review"
+    for key, value in MAPPING["evidence"].items():
+        if key in text:
+            evidence = value
+            break
+
+    return {
+        "id": post["id"],
+        "biological_targets": targets if targets else ["longevity"],
+        "category": category if category else "peptide",
+        "evidence_level": evidence,
+    }
+
+
+def load_checkpoint() -> dict:
+    try:
+        return json.loads(CHECKPOINT_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(state: dict) -> None:
+    tmp_path = CHECKPOINT_FILE.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+
+def fetch_page(supabase: Client, after_id, page_size: int, only_missing: bool) -> list[dict]:
+    """Keyset-страница по id: строки строго после after_id, по возрастанию id."""
+    query = supabase.table(TABLE).select(SELECT_COLUMNS)
+    if only_missing:
+        query = query.or_("evidence_level.is.null,biological_targets.is.null")
+    if after_id is not None:
+        query = query.gt("id", after_id)
+    response = query.order("id").limit(page_size).execute()
+    return response.data or []
+
+
+def _rpc_chunk(supabase: Client, chunk: list[dict]) -> int:
+    response = supabase.rpc(RPC_NAME, {"items": chunk}).execute()
+    return int(response.data or 0)
+
+
+def _update_row(supabase: Client, item: dict) -> int:
+    fields = {key: value for key, value in item.items() if key != "id"}
+    supabase.table(TABLE).update(fields).eq("id", item["id"]).execute()
+    return 1
+
+
+class Writer:
+    """
+    Запись результатов: RPC с массивом строк, чанками параллельно.
+    Если функции в базе нет — параллельные update по id (медленнее,
+    но без изменения схемы) с подсказкой установить RPC. Прочие ошибки
+    RPC повторяются для упавших чанков и после попыток пробрасываются.
+    """
+
+    def __init__(self, supabase: Client, workers: int, chunk_size: int) -> None:
+        self.supabase = supabase
+        self.chunk_size = chunk_size
+        self.use_rpc = True
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def write(self, items: list[dict]) -> int:
+        written = 0
+        if self.use_rpc:
+            written, pending, error = write_chunks(
+                self._pool,
+                lambda chunk: _rpc_chunk(self.supabase, chunk),
+                chunk_rows(items, max_rows=self.chunk_size),
+                label=f"RPC {RPC_NAME}",
+                give_up=is_missing_function_error,
+            )
+            if error is None:
+                return written
+            if not is_missing_function_error(error):
+                raise error
+            print(
+                f"[WARN] RPC {RPC_NAME} недоступна ({error}); "
+                "перехожу на update по строкам. Установите функцию: --print-sql"
             )
+            self.use_rpc = False
+            items = [item for chunk in pending for item in chunk]
+        return written + sum(self._pool.map(lambda item: _update_row(self.supabase, item), items))
+
+    def close(self) -> None:
+        self._pool.shutdown()
 
-            category = post.get("category")
-            for key, value in MAPPING["categories"].items():
-                if key in text:
-                    category = value
-                    break
-
-            evidence = "review"
-            for key, value in MAPPING["evidence"].items():
-                if key in text:
-                    evidence = value
-                    break
-
-            supabase.table("research_posts").update(
-                {
-                    "biological_targets": targets if targets else ["longevity"],
-                    "category": category if category else "peptide",
-                    "evidence_level": evidence,
-                }
-            ).eq("id", post["id"]).execute()
 
+def analyze_and_update_optimized(
+    supabase: Client,
+    page_size: int = 1000,
+    workers: int = 4,
+    write_workers: int = 4,
+    chunk_size: int = 500,
+    only_missing: bool = True,
+    resume: bool = True,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Проходит research_posts keyset-страницами по id (без повторов и без
+    бесконечного цикла на строках, которые не удалось обновить),
+    классифицирует страницу в пуле процессов и пишет её одной пачкой,
+    пока в фоне уже загружается следующая. После каждой страницы
+    сохраняется last_id — прерванный прогон продолжается с него.
+    """
+    mode = "missing" if only_missing else "all"
+    state = load_checkpoint() if resume else {}
+    if state.get("mode") != mode or state.get("done"):
+        state = {"mode": mode, "last_id": None, "rows": 0}
+    if state["last_id"] is not None:
+        print(f"Продолжаю после id={state['last_id']} ({state['rows']} строк уже обработано).")
+
+    writer = Writer(supabase, write_workers, chunk_size)
+    classifier = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    fetcher = ThreadPoolExecutor(max_workers=1)
+    started = time.monotonic()
+    processed = 0
+    written = 0
+    try:
+        next_page = fetcher.submit(fetch_page, supabase, state["last_id"], page_size, only_missing)
+        while True:
+            posts = next_page.result()
+            if not posts:
+                break
+            last_id = posts[-1]["id"]
+            next_page = fetcher.submit(fetch_page, supabase, last_id, page_size, only_missing)
+
+            if classifier is not None:
+                chunksize = max(1, len(posts) // (workers * 4))
+                items = list(classifier.map(classify, posts, chunksize=chunksize))
+            else:
+                items = [classify(post) for post in posts]
+            if not dry_run:
+                written += writer.write(items)
+
+            processed += len(posts)
+            state.update(last_id=last_id, rows=state["rows"] + len(posts))
+            if not dry_run:
+                save_checkpoint(state)
+            elapsed = time.monotonic() - started
             print(
-                f"Обновлена статья: {post.get('title','')} -> "
-                f"{targets}, {category}, {evidence}"
+                f"[BULK] {processed} строк (последний id={last_id}), "
+                f"{processed / elapsed:.1f} rows/sec"
             )
+    finally:
+        fetcher.shutdown(wait=False)
+        writer.close()
+        if classifier is not None:
+            classifier.shutdown()
+
+    seconds = time.monotonic() - started
+    if not dry_run:
+        state["done"] = True
+        save_checkpoint(state)
+    stats = {
+        "rows": processed,
+        "written": written,
+        "seconds": round(seconds, 2),
+        "rows_per_sec": round(processed / seconds, 1) if seconds > 0 else float(processed),
+    }
+    if processed:
+        print(
+            f"Готово: {processed} строк, записано {written}, "
+            f"{stats['rows_per_sec']} rows/sec за {stats['seconds']} с."
+        )
+    else:
+        print("Все записи уже обработаны или база пуста.")
+    return stats
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Classify research_posts metadata in bulk.")
+    parser.add_argument("--all", action="store_true", help="Reclassify every row, not only rows with NULL metadata")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Classifier processes")
+    parser.add_argument("--write-workers", type=int, default=4, help="Concurrent write requests")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Rows per RPC call")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="Classify without writing")
+    parser.add_argument("--print-sql", action="store_true", help="Print the bulk RPC DDL and exit")
+    args = parser.parse_args(argv)
+
+    if args.print_sql:
+        print(BULK_CLASSIFY_SQL)
+        return
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "").strip() or SUPABASE_ANON_KEY
+    if not SUPABASE_URL or not key:
+        raise ValueError("Missing SUPABASE_URL or SUPABASE_ANON_KEY")
+    supabase: Client = create_client(SUPABASE_URL, key)
+    analyze_and_update_optimized(
+        supabase,
+        page_size=args.page_size,
+        workers=args.workers,
+        write_workers=args.write_workers,
+        chunk_size=args.chunk_size,
+        only_missing=not args.all,
+        resume=not args.restart,
+        dry_run=args.dry_run,
+    )
 
 
 if __name__ == "__main__":
-    analyze_and_update_optimized()
+    main()
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+
+RING_SIZE = int(os.getenv("CLEANUP_RING_SIZE", "1000"))
+BATCH_SIZE = 100  # предел deleteMessages
+# Telegram не даёт ботам удалять сообщения старше 48 часов.
+MAX_AGE_SECONDS = 48 * 3600
+MAX_FLOOD_RETRIES = 5
+
+
+class MessageRing:
+    """Кольцевой буфер id сообщений, которые бот видел в каждом чате."""
+
+    def __init__(self, size: int = RING_SIZE) -> None:
+        self.size = size
+        self._chats: dict[int, deque[tuple[int, float]]] = {}
+
+    def record(self, chat_id: int, message_id: int, sent_at: float | None = None) -> None:
+        ring = self._chats.get(chat_id)
+        if ring is None:
+            ring = deque(maxlen=self.size)
+            self._chats[chat_id] = ring
+        ring.append((message_id, sent_at or time.time()))
+
+    def recent(self, chat_id: int, limit: int) -> list[int]:
+        """Последние `limit` id (новые первыми), которые ещё можно удалить."""
+        cutoff = time.time() - MAX_AGE_SECONDS
+        seen: list[int] = []
+        for message_id, sent_at in reversed(self._chats.get(chat_id, ())):
+            if sent_at < cutoff or message_id in seen:
+                continue
+            seen.append(message_id)
+            if len(seen) >= limit:
+                break
+        return seen
+
+    def forget(self, chat_id: int, message_ids: set[int]) -> None:
+        ring = self._chats.get(chat_id)
+        if ring is not None:
+            kept = [item for item in ring if item[0] not in message_ids]
+            ring.clear()
+            ring.extend(kept)
+
+
+def _retry_seconds(exc: RetryAfter) -> float:
+    value = exc.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+async def delete_batch(bot, chat_id: int, message_ids: list[int]) -> bool:
+    """Один вызов deleteMessages; при flood wait ждёт и повторяет."""
+    for _ in range(MAX_FLOOD_RETRIES):
+        try:
+            return bool(await bot.delete_messages(chat_id=chat_id, message_ids=message_ids))
+        except RetryAfter as exc:
+            wait = _retry_seconds(exc)
+            print(f"[CLEAR] flood wait {wait:.0f} с для чата {chat_id}")
+            await asyncio.sleep(wait + 0.5)
+    return False
+
+
+async def clear_chat(
+    bot,
+    chat_id: int,
+    message_ids: list[int],
+    progress: Callable[[int, int], Awaitable[None]] | None = None,
+) -> dict:
+    """
+    Удаляет message_ids пачками по BATCH_SIZE. Возвращает статистику:
+    deleted — id из успешных пачек (уже удалённые Telegram пропускает молча),
+    failed — id из пачек, которые Telegram отклонил.
+    """
+    started = time.monotonic()
+    deleted = failed = calls = 0
+    for start in range(0, len(message_ids), BATCH_SIZE):
+        batch = message_ids[start:start + BATCH_SIZE]
+        calls += 1
+        try:
+            ok = await delete_batch(bot, chat_id, batch)
+        except BadRequest as exc:
+            print(f"[CLEAR] чат {chat_id}: пачка из {len(batch)} отклонена: {exc}")
+            ok = False
+        except TelegramError as exc:
+            print(f"[CLEAR] чат {chat_id}: ошибка Telegram: {exc}")
+            ok = False
+        if ok:
+            deleted += len(batch)
+        else:
+            failed += len(batch)
+        if progress is not None:
+            await progress(deleted + failed, len(message_ids))
+    return {
+        "requested": len(message_ids),
+        "deleted": deleted,
+        "failed": failed,
+        "calls": calls,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+
+class ChatCleaner:
+    """
+    Фоновые задачи /clear: не больше одной на чат, прогресс — правкой
+    служебного сообщения, итог удаляется через `notice_ttl` секунд.
+    """
+
+    def __init__(self, ring: MessageRing | None = None, notice_ttl: float = 5) -> None:
+        self.ring = ring or MessageRing()
+        self.notice_ttl = notice_ttl
+        self._jobs: dict[int, asyncio.Task] = {}
+
+    def is_running(self, chat_id: int) -> bool:
+        job = self._jobs.get(chat_id)
+        return job is not None and not job.done()
+
+    def start(
+        self,
+        bot,
+        chat_id: int,
+        command_message_id: int,
+        limit: int = BATCH_SIZE,
+        fill_gaps: bool = False,
+    ) -> bool:
+        """
+        Удаляет только id из буфера (и саму команду). fill_gaps=True — явный
+        запрос для случая после перезапуска, когда буфер пуст: недостающие до
+        `limit` id добираются подряд ниже команды, это видно в прогрессе и итоге.
+        """
+        if self.is_running(chat_id):
+            return False
+        ids = self.ring.recent(chat_id, limit)
+        if command_message_id not in ids:
+            ids.insert(0, command_message_id)
+        guessed = 0
+        if fill_gaps and len(ids) < limit:
+            known = set(ids)
+            for message_id in range(command_message_id - 1, 0, -1):
+                if len(ids) >= limit:
+                    break
+                if message_id not in known:
+                    ids.append(message_id)
+                    guessed += 1
+        task = asyncio.create_task(self._run(bot, chat_id, ids[:limit], guessed))
+        self._jobs[chat_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(chat_id, None))
+        return True
+
+    async def _run(self, bot, chat_id: int, message_ids: list[int], guessed: int = 0) -> None:
+        status = None
+        note = f" (ещё {guessed} id подряд ниже команды, бот их не видел)" if guessed else ""
+        try:
+            status = await bot.send_message(chat_id=chat_id, text=f"🧹 Очищаю чат…{note}")
+
+            async def report(done: int, total: int) -> None:
+                if total > BATCH_SIZE:
+                    try:
+                        await bot.edit_message_text(
+                            chat_id=chat_id,
+                            message_id=status.message_id,
+                            text=f"🧹 Очищаю чат… {done}/{total}{note}",
+                        )
+                    except TelegramError:
+                        pass
+
+            stats = await clear_chat(bot, chat_id, message_ids, report)
+            self.ring.forget(chat_id, set(message_ids))
+            print(f"[CLEAR] чат {chat_id}: {stats}")
+            text = f"🧹 Чат очищен: {stats['deleted']} сообщений за {stats['calls']} запрос(а)"
+            if guessed:
+                text += f", из них {guessed} id не из буфера"
+            if stats["failed"]:
+                text += f", не удалось: {stats['failed']}"
+            await bot.edit_message_text(chat_id=chat_id, message_id=status.message_id, text=text)
+            await asyncio.sleep(self.notice_ttl)
+        except Exception as exc:
+            print(f"[CLEAR] чат {chat_id}: задача прервана: {exc}")
+        finally:
+            if status is not None:
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=status.message_id)
+                except TelegramError:
+                    pass
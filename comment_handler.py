@@ -8,7 +8,20 @@ import sys
 
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
+from telegram.ext import (
+    ApplicationBuilder,
+    ChatMemberHandler,
+    ContextTypes,
+    MessageHandler,
+    filters,
+)
+
+import metrics
+from admin_cache import get_admin_cache
+from chat_cleanup import BATCH_SIZE, ChatCleaner
+from moderation import get_engine
+from render_cache import FileRenderCache
+from research_index import get_index
 
 load_dotenv()
 
@@ -16,9 +29,11 @@ load_dotenv()
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(PROJECT_ROOT, "research_db")
 
-URL_REGEX = re.compile(r"(https?://|www\.)\S+", re.IGNORECASE)
-MENTION_REGEX = re.compile(r"@\w+", re.IGNORECASE)
+DATE_REGEX = re.compile(r"\b\d{4}[-/.]\d{2}[-/.]\d{2}\b")
+LONG_NUMBER_REGEX = re.compile(r"\b\d{8,}\b")
 
+# Список по умолчанию; рабочая версия — "banned" в moderation_lists.json
+# (перечитывается без перезапуска бота).
 BANNED_PHRASES = [
     "купить здесь",
     "в личку",
@@ -31,6 +46,12 @@ BANNED_PHRASES = [
     "ублюдок",
     "ненавижу",
 ]
+MODERATION = get_engine()
+MODERATION.register("banned", BANNED_PHRASES)
+
+# id сообщений, которые видел бот, — для /clear через deleteMessages.
+CLEANER = ChatCleaner()
+MAX_CLEAR = 1000
 
 WARNING_TEXT = (
     "❌ Нарушение правил BioPeptidePlus. Реклама, спам и попытки переманивания "
@@ -38,46 +59,8 @@ WARNING_TEXT = (
 )
 
 
-def _scan_db_files(db_dir: str) -> dict[str, str]:
-    """
-    Возвращает словарь: базовый_нейм_файла (lowercase) -> полное_имя_файла
-    """
-    if not os.path.isdir(db_dir):
-        return {}
-    files = [
-        f
-        for f in os.listdir(db_dir)
-        if f.lower().endswith(".txt") and os.path.isfile(os.path.join(db_dir, f))
-    ]
-    # Ключ — нормализованное имя файла (без .txt), значение — имя файла
-    return {_normalize_token(os.path.splitext(f)[0]): f for f in files}
-
-
-def _normalize_token(text: str) -> str:
-    lowered = text.lower()
-    return re.sub(r"[-\s]+", "", lowered)
-
-
-def _normalize_keyword(word: str) -> str:
-    lowered = word.lower()
-    ru_map = {
-        "тирзепатид": "tirzepatide",
-        "семакс": "semax",
-        "селанк": "selank",
-        "бпк157": "bpc157",
-        "тб500": "tb500",
-    }
-    mapped = ru_map.get(lowered, lowered)
-    return _normalize_token(mapped)
-
-
 def _is_violation(text: str) -> bool:
-    lowered = text.lower()
-    if URL_REGEX.search(text):
-        return True
-    if MENTION_REGEX.search(text):
-        return True
-    return any(phrase in lowered for phrase in BANNED_PHRASES)
+    return MODERATION.is_violation(text, "banned")
 
 
 async def _delete_warning_later(
@@ -101,16 +84,22 @@ async def _delete_notice_later(
 
 
 async def _is_admin(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> bool:
-    try:
-        admins = await context.bot.get_chat_administrators(chat_id)
-    except Exception:
-        return False
-    return any(admin.user.id == user_id for admin in admins)
+    # Кэш с TTL, общий для всех ботов процесса; правится апдейтами chat_member.
+    return await get_admin_cache().is_admin(context.bot, chat_id, user_id)
+
+
+async def _on_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    member = update.chat_member
+    if member is not None:
+        get_admin_cache().apply_chat_member(
+            member.chat.id, member.new_chat_member.user.id, member.new_chat_member.status
+        )
 
 def get_peptide_info(query: str, db_dir: str = DB_PATH) -> str:
     """
-    Ищет файл {название}.txt по запросу пользователя.
-    Нормализует дефисы и пробелы, поддерживает русский ввод.
+    Ищет в research_db файл, лучше всего отвечающий запросу пользователя.
+    Поиск идёт по локальному индексу (research_index): имена файлов и текст,
+    русские названия, транслитерация и опечатки.
     """
     print(f"[ЛОГ] Получено сообщение: {query!r}")
 
@@ -118,58 +107,20 @@ def get_peptide_info(query: str, db_dir: str = DB_PATH) -> str:
         print(f"[ЛОГ] research_db не найдена: {db_dir}")
         return "⚖️ В моей базе пока нет данных по этим ключевым словам, но я могу поискать их в сети. Найти?"
 
-    files_map = _scan_db_files(db_dir)
-    current_files = sorted(files_map.values())
-
-    raw_lower = query.lower().strip()
-    stop_words = {"протокол", "инфо", "справка"}
-    for word in stop_words:
-        raw_lower = raw_lower.replace(word, " ")
-    raw_lower = " ".join(raw_lower.split())
-    MAPPING = {
-        "тирзепатид": "tirzepatide",
-        "семакс": "semax",
-        "селанк": "selank",
-        "эпиталон": "epitalon",
-        "бпк157": "bpc157",
-        "тб500": "tb500",
-    }
-
-    if raw_lower in MAPPING:
-        normalized = MAPPING[raw_lower]
-    else:
-        normalized = " ".join(query.lower().split())
-    normalized = _normalize_token(normalized)
-    if "motsc" in normalized:
-        normalized = "mots-c"
-
-    words = re.findall(r"\w+", normalized)
-    name = _normalize_keyword(words[0]) if words else _normalize_keyword(normalized)
-    normalized_name = _normalize_token(name)
-
-    resolved = files_map.get(normalized_name)
-    file_name = resolved or f"{normalized_name}.txt"
-    file_path = os.path.join(db_dir, file_name)
-
-    print(f"DEBUG: Ищу файл {file_name} по пути {file_path}")
-    print(f"АРБИТР ИЩЕТ ТУТ: {file_path}")
-
-    if not os.path.isfile(file_path):
-        print(f"DEBUG: Не нашел {file_name} в {db_dir}")
-        print(f"DEBUG: В папке сейчас лежат файлы: {current_files}")
+    index = get_index(db_dir)
+    file_name = index.best_match(query)
+    if not file_name:
+        print(f"DEBUG: Совпадений нет, в индексе файлов: {len(index.files)}")
         return "В базе BioPeptidePlus пока нет данных по этому запросу"
+    file_path = os.path.join(db_dir, file_name)
+    print(f"DEBUG: Индекс выбрал {file_name}")
 
     print("DEBUG: Файл найден, отправляю данные")
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            file_contents = f.read()
-
-        cleaned = _clean_text(file_contents)
-        peptide_name = os.path.splitext(file_name)[0]
-        if not cleaned.strip():
-            return "Файл найден, но данных внутри пока нет"
-
-        return f"🔬 **Экспертный анализ BioPeptidePlus: {peptide_name}**\n\n{cleaned.strip()}"
+        reply = REPLY_CACHE.get(file_path)
+        stats = REPLY_CACHE.stats()
+        print(f"DEBUG: Кэш ответов: hit_rate={stats['hit_rate']}, size={stats['size']}")
+        return reply
     except Exception as e:
         print(f"[ОШИБКА] Ошибка при чтении файла: {e}")
         return f"⚖️ Произошла ошибка при чтении файла базы знаний. ({e})"
@@ -187,9 +138,9 @@ def _clean_text(text: str) -> str:
             continue
         if "AUTO ENTRY" in line or "DATA ENTRY" in line:
             continue
-        if re.search(r"\b\d{4}[-/.]\d{2}[-/.]\d{2}\b", line):
+        if DATE_REGEX.search(line):
             continue
-        if re.search(r"\b\d{8,}\b", line):
+        if LONG_NUMBER_REGEX.search(line):
             continue
         if line.startswith("⚖️"):
             continue
@@ -197,8 +148,21 @@ def _clean_text(text: str) -> str:
     return "\n".join(lines)
 
 
+def _render_reply(file_path: str, file_contents: str) -> str:
+    cleaned = _clean_text(file_contents)
+    peptide_name = os.path.splitext(os.path.basename(file_path))[0]
+    if not cleaned.strip():
+        return "Файл найден, но данных внутри пока нет"
+    return f"🔬 **Экспертный анализ BioPeptidePlus: {peptide_name}**\n\n{cleaned.strip()}"
 
 
+# Готовые ответы по файлам research_db; ключ — (mtime, size) файла.
+REPLY_CACHE = FileRenderCache(
+    _render_reply, maxsize=int(os.getenv("ARBITER_REPLY_CACHE_SIZE", "256"))
+)
+
+
+@metrics.timed("handler_seconds", bot="arbiter")
 async def _handle_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Обрабатывает сообщение Telegram и отправляет ответ.
@@ -219,6 +183,7 @@ async def _handle_update(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             except Exception:
                 return
             warning = await update.message.reply_text(WARNING_TEXT)
+            CLEANER.ring.record(chat_id, warning.message_id)
             asyncio.create_task(
                 _delete_warning_later(context, chat_id, warning.message_id)
             )
@@ -229,46 +194,69 @@ async def _handle_update(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             user_id = update.message.from_user.id if update.message.from_user else None
             if user_id is None or not await _is_admin(context, chat_id, user_id):
                 return
-            try:
-                await context.bot.delete_message(
-                    chat_id=chat_id, message_id=update.message.message_id
+            # "/clear" — последние 100 сообщений, которые видел бот, "/clear 300" — больше;
+            # "/clear 300 all" — добрать и невиденные id ниже команды (после перезапуска).
+            parts = text.split()
+            limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else BATCH_SIZE
+            fill_gaps = "all" in (part.lower() for part in parts[1:])
+            # Фоновая задача: пачки deleteMessages, прогресс и итог в чате.
+            if not CLEANER.start(
+                context.bot, chat_id, update.message.message_id, min(limit, MAX_CLEAR), fill_gaps
+            ):
+                notice = await context.bot.send_message(
+                    chat_id=chat_id, text="🧹 Очистка уже идёт"
                 )
-            except Exception:
-                pass
-            # Удаляем последние 100 сообщений, начиная с текущего
-            current_id = update.message.message_id
-            for msg_id in range(current_id, max(current_id - 100, 0), -1):
-                try:
-                    print(f"DEBUG: Удаляю сообщение ID={msg_id}")
-                    await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                except Exception:
-                    continue
-                await asyncio.sleep(0.1)
-            notice = await context.bot.send_message(
-                chat_id=chat_id,
-                text="🧹 Чат очищен (насколько позволили лимиты Telegram)",
-            )
-            asyncio.create_task(_delete_notice_later(context, chat_id, notice.message_id))
+                asyncio.create_task(_delete_notice_later(context, chat_id, notice.message_id))
             return
 
         # 3) Поиск по базе
         reply_text = get_peptide_info(text)
-        await update.message.reply_text(reply_text, parse_mode="Markdown")
+        reply = await update.message.reply_text(reply_text, parse_mode="Markdown")
+        CLEANER.ring.record(chat_id, reply.message_id)
     except Exception as e:
+        metrics.inc("handler_errors_total", bot="arbiter")
         print(f"[ОШИБКА] При обработке сообщения: {e}")
     finally:
         print("DEBUG: Бот готов к следующему запросу")
 
+def warm_caches() -> None:
+    print(f"Путь к базе: {DB_PATH}")
+    index = get_index(DB_PATH)
+    warmed = REPLY_CACHE.warm(os.path.join(DB_PATH, name) for name in index.files)
+    print(f"Файлов в индексе: {len(index.files)}, ответов в кэше: {warmed}")
+
+
+async def _remember_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if message is not None:
+        CLEANER.ring.record(message.chat_id, message.message_id, message.date.timestamp())
+
+
+def build_application(token: str):
+    builder = ApplicationBuilder().token(token)
+    api_base = os.getenv("TELEGRAM_API_BASE")
+    if api_base:
+        builder = builder.base_url(f"{api_base}/bot")
+    app = builder.build()
+    # Группа -1 выполняется до основной и видит все сообщения, не только текст.
+    app.add_handler(MessageHandler(filters.ALL, _remember_message), group=-1)
+    app.add_handler(MessageHandler(filters.TEXT, _handle_update))
+    app.add_handler(ChatMemberHandler(_on_chat_member, ChatMemberHandler.CHAT_MEMBER))
+    return app
+
+
 def run_polling() -> None:
     token = os.getenv("ARBITER_TOKEN")
     if not token:
         print("Missing ARBITER_TOKEN in .env")
         sys.exit(1)
 
-    print(f"Путь к базе: {DB_PATH}")
-    app = ApplicationBuilder().token(token).build()
-    app.add_handler(MessageHandler(filters.TEXT, _handle_update))
-    app.run_polling(drop_pending_updates=True)
+    warm_caches()
+    metrics.start_json_dumps()
+    # chat_member приходит только если запрошен явно.
+    build_application(token).run_polling(
+        drop_pending_updates=True, allowed_updates=Update.ALL_TYPES
+    )
 
 if __name__ == "__main__":
     run_polling()
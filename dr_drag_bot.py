@@ -4,6 +4,9 @@ from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
 
+import metrics
+from moderation import get_engine
+
 # 1. Загрузка настроек
 load_dotenv()
 TOKEN = os.getenv("DR_DRAG_TOKEN")
@@ -11,6 +14,12 @@ TOKEN = os.getenv("DR_DRAG_TOKEN")
 # Настройка логирования, чтобы видеть ошибки в терминале
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
+# Триггеры ответа; рабочая версия — "dr_drag_dosage" в moderation_lists.json
+DOSAGE_KEYWORDS = ["дозировка", "расчет", "сколько", "мкг", "мг"]
+MODERATION = get_engine()
+MODERATION.register("dr_drag_dosage", DOSAGE_KEYWORDS)
+
+@metrics.timed("handler_seconds", bot="drdrag")
 async def drag_logic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         text = update.message.text
@@ -19,9 +28,7 @@ async def drag_logic(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"От: @{user} | В чате: {chat_id} | Текст: {text}")
 
         # Реакция только на запросы по дозировкам/расчетам
-        lower_text = text.lower()
-        keywords = ["дозировка", "расчет", "сколько", "мкг", "мг"]
-        if not any(word in lower_text for word in keywords):
+        if not MODERATION.contains("dr_drag_dosage", text):
             return
 
         response = (
@@ -34,16 +41,24 @@ async def drag_logic(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(response)
             print("[v] Ответ отправлен успешно!")
         except Exception as e:
+            metrics.inc("handler_errors_total", bot="drdrag")
             print(f"[x] ОШИБКА ОТПРАВКИ: {e}")
 
+def build_application(token: str):
+    builder = ApplicationBuilder().token(token)
+    api_base = os.getenv("TELEGRAM_API_BASE")
+    if api_base:
+        builder = builder.base_url(f"{api_base}/bot")
+    app = builder.build()
+    # Слушаем ВСЕ текстовые сообщения в группах и личке
+    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), drag_logic))
+    return app
+
 if __name__ == '__main__':
     if not TOKEN:
         print("❌ Ключ DR_DRAG_TOKEN не найден!")
     else:
-        app = ApplicationBuilder().token(TOKEN).build()
-        # Слушаем ВСЕ текстовые сообщения в группах и личке
-        app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), drag_logic))
-        
+        app = build_application(TOKEN)
+        metrics.start_json_dumps()
         print("✅ Двигатель запущен. Жду сообщений в Telegram...")
         app.run_polling(drop_pending_updates=True)
-        
\ No newline at end of file
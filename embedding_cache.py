@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.request
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable
+
+import metrics
+
+
+CACHE_DB_FILE = Path(
+    os.getenv(
+        "EMBEDDING_CACHE_FILE",
+        str(Path(__file__).resolve().parent / ".embedding_cache.sqlite3"),
+    )
+)
+MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY", "1024"))
+DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK", "50000"))
+BATCH_WINDOW = float(os.getenv("EMBEDDING_BATCH_WINDOW", "0.02"))
+MAX_BATCH = 2048
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Ключ кэша: регистр, пробелы и пунктуация по краям не важны."""
+    return _SPACE_RE.sub(" ", text.casefold()).strip(" \t\n?!.,;:")
+
+
+def openai_embed_batch(texts: list[str], model: str, timeout: int = 60) -> list[list[float]]:
+    """Один запрос /v1/embeddings со списком input; порядок ответа = порядку texts."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing OPENAI_API_KEY for embeddings.")
+    payload = {"model": model, "input": texts}
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(
+        "https://api.openai.com/v1/embeddings", data=data, method="POST"
+    )
+    request.add_header("Content-Type", "application/json")
+    request.add_header("Authorization", f"Bearer {api_key}")
+    # Только сам вызов API: попадания в кэш не искажают outbound_seconds.
+    with metrics.timer("outbound_seconds", target="openai", method="embeddings"):
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read().decode("utf-8")
+    items = sorted(json.loads(body)["data"], key=lambda item: item["index"])
+    return [item["embedding"] for item in items]
+
+
+class EmbeddingCache:
+    """
+    Двухуровневый кэш эмбеддингов одной модели: LRU в памяти и SQLite
+    на диске (float32). Размер SQLite ограничен: самые давно
+    использованные записи удаляются.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        path: Path | None = CACHE_DB_FILE,
+        memory_size: int = MEMORY_SIZE,
+        disk_size: int = DISK_SIZE,
+    ) -> None:
+        self.model = model
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "create table if not exists embeddings ("
+                "model text not null, key text not null, vector blob not null, "
+                "last_used real not null, primary key (model, key))"
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> list[float] | None:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute(
+                    "select vector from embeddings where model = ? and key = ?",
+                    (self.model, key),
+                ).fetchone()
+                if row is not None:
+                    vector = array("f", row[0]).tolist()
+                    self._db.execute(
+                        "update embeddings set last_used = ? where model = ? and key = ?",
+                        (time.time(), self.model, key),
+                    )
+                    self._db.commit()
+                    self._remember(key, vector)
+                    self.hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            if self._db is None:
+                return
+            now = time.time()
+            self._db.executemany(
+                "insert or replace into embeddings (model, key, vector, last_used) "
+                "values (?, ?, ?, ?)",
+                [
+                    (self.model, key, array("f", vector).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+            (count,) = self._db.execute("select count(*) from embeddings").fetchone()
+            if count > self.disk_size:
+                self._db.execute(
+                    "delete from embeddings where rowid in ("
+                    "select rowid from embeddings order by last_used limit ?)",
+                    (count - self.disk_size,),
+                )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "memory": len(self._memory),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class EmbeddingBatcher:
+    """
+    Эмбеддинги запросов через кэш. Промахи, пришедшие из разных потоков
+    в течение `window` секунд, уходят одним запросом со списком input;
+    одинаковые запросы в окне ждут один и тот же результат.
+    """
+
+    def __init__(
+        self,
+        cache: EmbeddingCache,
+        embed_many: Callable[[list[str]], list[list[float]]] | None = None,
+        window: float = BATCH_WINDOW,
+        max_batch: int = MAX_BATCH,
+    ) -> None:
+        self.cache = cache
+        self.embed_many = embed_many or (
+            lambda texts: openai_embed_batch(texts, cache.model)
+        )
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: list[str] = []
+        # Ключ (нормализованный запрос) — только для кэша и слияния дублей;
+        # в модель уходит исходный текст первого запроса с этим ключом.
+        self._texts: dict[str, str] = {}
+        self._waiting: dict[str, Future] = {}
+        self._timer: threading.Timer | None = None
+        self.requests = 0
+
+    def embed(self, text: str, timeout: float = 60) -> list[float]:
+        key = normalize_query(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        flush_now = False
+        with self._lock:
+            future = self._waiting.get(key)
+            if future is None:
+                future = Future()
+                self._waiting[key] = future
+                self._texts[key] = text
+                self._pending.append(key)
+                if len(self._pending) >= self.max_batch:
+                    flush_now = True
+                elif self._timer is None:
+                    self._timer = threading.Timer(self.window, self._flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if flush_now:
+            self._flush()
+        return future.result(timeout=timeout)
+
+    def _flush(self) -> None:
+        with self._lock:
+            keys = self._pending
+            self._pending = []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            futures = {key: self._waiting[key] for key in keys}
+            texts = [self._texts.pop(key) for key in keys]
+        if not keys:
+            return
+
+        self.requests += 1
+        try:
+            vectors = self.embed_many(texts)
+            if len(vectors) != len(keys):
+                raise RuntimeError(f"embeddings: ожидалось {len(keys)} векторов, получено {len(vectors)}")
+            results = dict(zip(keys, vectors))
+        except BaseException as exc:
+            # Ни один ожидающий поток не должен висеть до своего таймаута.
+            self._release(keys)
+            for future in futures.values():
+                future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+            return
+
+        try:
+            self.cache.put_many(results)
+        except Exception as exc:
+            print(f"[WARN] Кэш эмбеддингов не записан: {exc}")
+        self._release(keys)
+        for key, future in futures.items():
+            future.set_result(results[key])
+
+    def _release(self, keys: list[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._waiting.pop(key, None)
+
+
+_BATCHERS: dict[str, EmbeddingBatcher] = {}
+_BATCHERS_LOCK = threading.Lock()
+
+
+def get_embedder(model: str) -> EmbeddingBatcher:
+    """Общий на процесс батчер с кэшем для модели `model`."""
+    with _BATCHERS_LOCK:
+        batcher = _BATCHERS.get(model)
+        if batcher is None:
+            batcher = EmbeddingBatcher(EmbeddingCache(model))
+            _BATCHERS[model] = batcher
+        return batcher
@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import time
+import urllib.error
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_cache import openai_embed_batch
+from supabase_bulk import bulk_upsert
+from supabase_client import get_supabase_client, load_env
+
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDINGS_TABLE = "embeddings"
+ON_CONFLICT = "source,source_id,chunk_index,model"
+# ~500 токенов на чанк (≈4 символа на токен) с перекрытием окна.
+CHUNK_CHARS = int(os.getenv("EMBEDDING_CHUNK_CHARS", "2000"))
+CHUNK_OVERLAP = 200
+MAX_INPUTS = 2048
+# Лимит OpenAI ~300k токенов на запрос; держим запас по символам.
+MAX_REQUEST_CHARS = 900_000
+EMBED_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "4"))
+EMBED_RETRIES = 4
+PAGE_SIZE = 500
+
+# Схема совпадает с docs/data-model.md (embeddings) плюс поля чанка.
+# Выполнить один раз в SQL Editor Supabase: python embedding_pipeline.py --print-sql
+EMBEDDINGS_SQL = """
+create extension if not exists vector;
+
+create table if not exists public.embeddings (
+  id uuid primary key default gen_random_uuid(),
+  document_id uuid,
+  source text not null,
+  source_id text not null,
+  chunk_index int not null,
+  title text,
+  url text,
+  content text not null,
+  content_hash text not null,
+  embedding vector(1536) not null,
+  model text not null,
+  created_at timestamptz not null default now(),
+  updated_at timestamptz not null default now(),
+  unique (source, source_id, chunk_index, model)
+);
+
+-- Для таблиц, созданных до появления updated_at.
+alter table public.embeddings add column if not exists updated_at timestamptz not null default now();
+
+-- Upsert перезаписывает чанк на месте: updated_at сдвигается, и vector_index.py
+-- подтягивает изменение при инкрементальной синхронизации.
+create or replace function public.embeddings_touch_updated_at()
+returns trigger language plpgsql as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists embeddings_touch_updated_at on public.embeddings;
+create trigger embeddings_touch_updated_at
+  before update on public.embeddings
+  for each row execute function public.embeddings_touch_updated_at();
+
+create index if not exists embeddings_model_updated_at_idx
+  on public.embeddings (model, updated_at);
+
+create index if not exists embeddings_embedding_idx
+  on public.embeddings using hnsw (embedding vector_cosine_ops);
+
+create or replace function public.match_documents(
+  query_embedding vector(1536),
+  match_count int default 3,
+  match_threshold float default 0
+)
+returns table (
+  id uuid, source text, source_id text, title text, url text,
+  content text, summary text, created_at timestamptz, similarity float
+)
+language sql stable as $$
+  select e.id, e.source, e.source_id, e.title, e.url,
+         e.content, e.content as summary, e.created_at,
+         1 - (e.embedding <=> query_embedding) as similarity
+  from public.embeddings e
+  where 1 - (e.embedding <=> query_embedding) > match_threshold
+  order by e.embedding <=> query_embedding
+  limit match_count;
+$$;
+""".strip()
+
+_SECTION_RE = re.compile(r"(?m)^(?=SOURCE_JOURNAL:|#{2,3} )")
+_SOURCE_URL_RE = re.compile(r"(?m)^SOURCE_URL:\s*(\S+)")
+_SPACE_RE = re.compile(r"[ \t]+")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{text}".encode("utf-8")).hexdigest()
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """
+    Делит текст по разделам (блоки SOURCE_JOURNAL в research_db, заголовки ##/###),
+    мелкие разделы склеивает, длинные режет окном max_chars с перекрытием.
+    """
+    sections = [
+        _SPACE_RE.sub(" ", part).strip() for part in _SECTION_RE.split(text or "")
+    ]
+    chunks: list[str] = []
+    buffer = ""
+    for section in filter(None, sections):
+        if len(section) > max_chars:
+            if buffer:
+                chunks.append(buffer)
+                buffer = ""
+            start = 0
+            while start < len(section):
+                end = min(len(section), start + max_chars)
+                if end < len(section):
+                    # Режем по границе абзаца или предложения, если она есть рядом.
+                    cut = max(section.rfind("\n\n", start, end), section.rfind(". ", start, end))
+                    if cut > start + max_chars // 2:
+                        end = cut + 1
+                chunks.append(section[start:end].strip())
+                if end >= len(section):
+                    break
+                start = max(end - overlap, start + 1)
+            continue
+        if buffer and len(buffer) + len(section) + 2 > max_chars:
+            chunks.append(buffer)
+            buffer = ""
+        buffer = f"{buffer}\n\n{section}" if buffer else section
+    if buffer:
+        chunks.append(buffer)
+    return [chunk for chunk in chunks if chunk]
+
+
+def _news_documents() -> list[dict]:
+    supabase = get_supabase_client()
+    documents: list[dict] = []
+    offset = 0
+    while True:
+        response = (
+            supabase.table("news_articles")
+            .select("id,title,url,summary,content")
+            .order("id")
+            .range(offset, offset + PAGE_SIZE - 1)
+            .execute()
+        )
+        if getattr(response, "error", None):
+            raise RuntimeError(str(response.error))
+        page = response.data or []
+        for item in page:
+            title = str(item.get("title") or "").strip()
+            body = "\n\n".join(
+                part for part in (item.get("summary"), item.get("content")) if part
+            )
+            documents.append(
+                {
+                    "source": "news_articles",
+                    "source_id": str(item.get("id")),
+                    "title": title,
+                    "url": item.get("url"),
+                    "text": f"{title}\n\n{body}".strip(),
+                }
+            )
+        if len(page) < PAGE_SIZE:
+            return documents
+        offset += PAGE_SIZE
+
+
+def _research_documents(db_dir: str) -> list[dict]:
+    documents: list[dict] = []
+    for file_name in sorted(os.listdir(db_dir)):
+        if not file_name.lower().endswith(".txt"):
+            continue
+        path = os.path.join(db_dir, file_name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as exc:
+            print(f"[WARN] Не удалось прочитать {file_name}: {exc}")
+            continue
+        url_match = _SOURCE_URL_RE.search(text)
+        documents.append(
+            {
+                "source": "research_db",
+                "source_id": file_name,
+                "title": os.path.splitext(file_name)[0].replace("_", " "),
+                "url": url_match.group(1) if url_match else None,
+                "text": text,
+            }
+        )
+    return documents
+
+
+def _existing_hashes(source: str) -> dict[tuple[str, int], str]:
+    supabase = get_supabase_client()
+    hashes: dict[tuple[str, int], str] = {}
+    offset = 0
+    while True:
+        response = (
+            supabase.table(EMBEDDINGS_TABLE)
+            .select("source_id,chunk_index,content_hash")
+            .eq("source", source)
+            .eq("model", EMBEDDING_MODEL)
+            .order("id")
+            .range(offset, offset + PAGE_SIZE - 1)
+            .execute()
+        )
+        if getattr(response, "error", None):
+            raise RuntimeError(str(response.error))
+        page = response.data or []
+        for item in page:
+            hashes[(str(item["source_id"]), int(item["chunk_index"]))] = item["content_hash"]
+        if len(page) < PAGE_SIZE:
+            return hashes
+        offset += PAGE_SIZE
+
+
+def _batches(chunks: list[dict]) -> list[list[dict]]:
+    batches: list[list[dict]] = []
+    current: list[dict] = []
+    size = 0
+    for chunk in chunks:
+        length = len(chunk["content"])
+        if current and (len(current) >= MAX_INPUTS or size + length > MAX_REQUEST_CHARS):
+            batches.append(current)
+            current, size = [], 0
+        current.append(chunk)
+        size += length
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_batch(batch: list[dict]) -> list[dict]:
+    texts = [chunk["content"] for chunk in batch]
+    for attempt in range(EMBED_RETRIES):
+        try:
+            vectors = openai_embed_batch(texts, EMBEDDING_MODEL, timeout=120)
+            break
+        except urllib.error.HTTPError as exc:
+            if exc.code not in {429, 500, 502, 503} or attempt == EMBED_RETRIES - 1:
+                raise
+            time.sleep(2 ** (attempt + 1))
+    return [dict(chunk, embedding=vector) for chunk, vector in zip(batch, vectors)]
+
+
+def _delete_stale(source: str, source_id: str, keep: int) -> None:
+    supabase = get_supabase_client()
+    (
+        supabase.table(EMBEDDINGS_TABLE)
+        .delete()
+        .eq("source", source)
+        .eq("source_id", source_id)
+        .eq("model", EMBEDDING_MODEL)
+        .gte("chunk_index", keep)
+        .execute()
+    )
+
+
+def ingest(documents: list[dict], source: str, dry_run: bool = False) -> dict:
+    """Эмбеддит только новые/изменённые чанки документов одного источника."""
+    started = time.monotonic()
+    existing = _existing_hashes(source)
+    stored_counts = Counter(source_id for source_id, _ in existing)
+    pending: list[dict] = []
+    total_chunks = 0
+    stale: list[tuple[str, int]] = []
+    for document in documents:
+        chunks = chunk_text(document["text"])
+        total_chunks += len(chunks)
+        for index, text in enumerate(chunks):
+            digest = content_hash(text)
+            if existing.get((document["source_id"], index)) == digest:
+                continue
+            pending.append(
+                {
+                    "source": source,
+                    "source_id": document["source_id"],
+                    "chunk_index": index,
+                    "title": document["title"],
+                    "url": document["url"],
+                    "content": text,
+                    "content_hash": digest,
+                    "model": EMBEDDING_MODEL,
+                }
+            )
+        if stored_counts[document["source_id"]] > len(chunks):
+            stale.append((document["source_id"], len(chunks)))
+
+    # Документы, которых больше нет в источнике, удаляются целиком.
+    current_ids = {document["source_id"] for document in documents}
+    stale.extend((source_id, 0) for source_id in stored_counts if source_id not in current_ids)
+
+    print(
+        f"[EMBED] {source}: документов {len(documents)}, чанков {total_chunks}, "
+        f"к эмбеддингу {len(pending)}, без изменений {total_chunks - len(pending)}"
+    )
+    if dry_run or not (pending or stale):
+        return {"chunks": 0, "skipped": total_chunks - len(pending), "seconds": 0.0}
+
+    batches = _batches(pending)
+    embedded = 0
+    supabase = get_supabase_client()
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as pool:
+        for rows in pool.map(_embed_batch, batches):
+            bulk_upsert(supabase, EMBEDDINGS_TABLE, rows, on_conflict=ON_CONFLICT, report=False)
+            embedded += len(rows)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            print(f"[EMBED] {source}: {embedded}/{len(pending)} ({embedded / elapsed:.1f} chunks/s)")
+    for source_id, keep in stale:
+        _delete_stale(source, source_id, keep)
+
+    seconds = time.monotonic() - started
+    stats = {
+        "chunks": embedded,
+        "skipped": total_chunks - len(pending),
+        "requests": len(batches),
+        "stale_documents": len(stale),
+        "seconds": round(seconds, 2),
+        "chunks_per_sec": round(embedded / seconds, 2) if seconds else 0.0,
+    }
+    print(
+        f"[EMBED] {source}: {stats['chunks']} чанков за {stats['seconds']} с "
+        f"({stats['chunks_per_sec']} chunks/s), запросов {stats['requests']}, "
+        f"пропущено {stats['skipped']}"
+    )
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Incremental embeddings for news_articles and research_db.")
+    parser.add_argument("--source", choices=["all", "news", "research"], default="all")
+    parser.add_argument("--db-dir", default="research_db")
+    parser.add_argument("--dry-run", action="store_true", help="Only count changed chunks")
+    parser.add_argument("--print-sql", action="store_true", help="Print table/RPC DDL and exit")
+    args = parser.parse_args()
+
+    if args.print_sql:
+        print(EMBEDDINGS_SQL)
+        return
+    load_env()
+    if not args.dry_run and not os.getenv("OPENAI_API_KEY"):
+        raise SystemExit("Missing OPENAI_API_KEY in .env")
+
+    if args.source in {"all", "news"}:
+        ingest(_news_documents(), "news_articles", dry_run=args.dry_run)
+    if args.source in {"all", "research"}:
+        ingest(_research_documents(args.db_dir), "research_db", dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
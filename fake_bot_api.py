@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_PORT = 8081
+
+
+class FakeTelegram:
+    """
+    Состояние поддельного Bot API: очереди апдейтов по токенам, счётчики
+    message_id по чатам и журнал всех вызовов (метод, параметры, время).
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._updates: dict[str, list[dict]] = {}
+        self._next_update_id: dict[str, int] = {}
+        self._next_message_id: dict[int, int] = {}
+        self.calls: list[dict] = []
+        self.admins: dict[int, list[int]] = {}
+
+    # --- сторона теста -----------------------------------------------------
+
+    def inject(self, token: str, update: dict) -> int:
+        with self._cond:
+            update_id = self._next_update_id.get(token, 0) + 1
+            self._next_update_id[token] = update_id
+            self._updates.setdefault(token, []).append(dict(update, update_id=update_id))
+            self._cond.notify_all()
+            return update_id
+
+    def make_message(self, chat_id: int, user_id: int, text: str) -> dict:
+        with self._cond:
+            message_id = self._next_message_id.get(chat_id, 0) + 1
+            self._next_message_id[chat_id] = message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "load test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        }
+
+    def calls_since(self, index: int) -> list[dict]:
+        with self._cond:
+            return self.calls[index:]
+
+    # --- сторона бота ------------------------------------------------------
+
+    def _record(self, token: str, method: str, params: dict) -> None:
+        with self._cond:
+            self.calls.append(
+                {"token": token, "method": method, "params": params, "at": time.perf_counter()}
+            )
+
+    def _sent_message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        message = self.make_message(chat_id, 0, str(params.get("text", "")))
+        message["from"] = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        return message
+
+    def get_updates(self, token: str, params: dict) -> list[dict]:
+        offset = int(params.get("offset", 0) or 0)
+        timeout = min(float(params.get("timeout", 0) or 0), 50)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                queue = self._updates.setdefault(token, [])
+                # Подтверждённые (id < offset) апдейты удаляются, как в Telegram.
+                queue[:] = [update for update in queue if update["update_id"] >= offset]
+                if queue:
+                    return list(queue[:100])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+    def call(self, token: str, method: str, params: dict):
+        if method != "getUpdates":
+            self._record(token, method, params)
+        if method == "getUpdates":
+            return self.get_updates(token, params)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if method in {"sendMessage", "sendPhoto", "editMessageText"}:
+            return self._sent_message(params)
+        if method == "getChatAdministrators":
+            chat_id = int(params.get("chat_id", 0))
+            return [
+                {"status": "administrator", "user": {"id": user_id, "is_bot": False, "first_name": "admin"}}
+                for user_id in self.admins.get(chat_id, [])
+            ]
+        # deleteMessage(s), setWebhook, deleteWebhook и прочее — успех.
+        return True
+
+
+def _parse_params(handler: BaseHTTPRequestHandler) -> dict:
+    params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(handler.path).query))
+    length = int(handler.headers.get("Content-Length", "0") or 0)
+    if not length:
+        return params
+    body = handler.rfile.read(length).decode("utf-8")
+    content_type = handler.headers.get("Content-Type", "")
+    if "json" in content_type:
+        params.update(json.loads(body or "{}"))
+    else:
+        params.update(dict(urllib.parse.parse_qsl(body)))
+    for key, value in list(params.items()):
+        # Вложенные поля (reply_markup, message_ids) приходят JSON-строкой.
+        if isinstance(value, str) and value[:1] in "[{":
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+
+def make_server(fake: FakeTelegram, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _reply(self, status: int, payload) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _dispatch(self) -> None:
+            path = urllib.parse.urlsplit(self.path).path
+            try:
+                params = _parse_params(self)
+            except ValueError as exc:
+                self._reply(400, {"ok": False, "error_code": 400, "description": str(exc)})
+                return
+            if path == "/_fake/calls":
+                self._reply(200, {"ok": True, "result": fake.calls_since(int(params.get("since", 0)))})
+                return
+            if path == "/_fake/inject":
+                update_id = fake.inject(str(params["token"]), params["update"])
+                self._reply(200, {"ok": True, "result": update_id})
+                return
+            parts = path.strip("/").split("/")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            token, method = parts[0][3:], parts[1]
+            self._reply(200, {"ok": True, "result": fake.call(token, method, params)})
+
+        do_GET = _dispatch
+        do_POST = _dispatch
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(fake: FakeTelegram, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Запускает сервер в фоне; port=0 — свободный порт (server.server_address)."""
+    server = make_server(fake, host, port)
+    threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    server = make_server(FakeTelegram(), args.host, args.port)
+    print(f"Fake Bot API: http://{args.host}:{args.port} (TELEGRAM_API_BASE для ботов)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
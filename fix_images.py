@@ -1,28 +1,17 @@
 import argparse
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from urllib import request
+from typing import Optional
+from urllib import parse, request
 from urllib.error import HTTPError
 
 import research_auto_ai as r
-
-
-def _parse_post_id(text: str) -> str:
-    for line in text.splitlines():
-        if line.startswith("POST_ID:"):
-            return line.split(":", 1)[1].strip()
-    return ""
-
-
-def _list_recent_files(db_path: str, limit: int) -> list[str]:
-    entries = [
-        os.path.join(db_path, f)
-        for f in os.listdir(db_path)
-        if f.endswith(".txt") and os.path.isfile(os.path.join(db_path, f))
-    ]
-    entries.sort(key=lambda p: os.path.getmtime(p), reverse=True)
-    return entries[:limit]
+from migration_runner import RestClient
+from posts_index import REPAIR_STATUSES, PostsIndex, get_posts_index
+from rate_limiter import get_limiter
 
 
 def _pretty_topic_from_path(path: str) -> str:
@@ -32,6 +21,11 @@ def _pretty_topic_from_path(path: str) -> str:
     return r._pretty_name(name)
 
 
+def _image_prompt(topic: str) -> str:
+    """Тема картинки — случайная на каждый пост; кэш ассетов срабатывает только на совпавший промпт."""
+    return r._build_image_prompt(topic)
+
+
 def _update_lovable_image(post_id: str, image_url: str) -> dict:
     payload = {"post_id": post_id, "image_url": image_url}
     data = json.dumps(payload).encode("utf-8")
@@ -54,40 +48,83 @@ def _update_lovable_image(post_id: str, image_url: str) -> dict:
         raise
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Backfill Lovable images")
-    parser.add_argument("--limit", type=int, default=5, help="How many recent files to scan")
-    args = parser.parse_args()
-
-    db_path = os.path.join(os.getcwd(), "research_db")
-    if not os.path.exists(db_path):
-        print("research_db not found.")
-        return 1
-
-    files = _list_recent_files(db_path, args.limit)
-    if not files:
-        print("No research_db files found.")
-        return 1
-
-    for path in files:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read()
-        post_id = _parse_post_id(content)
-        topic = _pretty_topic_from_path(path)
-        if not post_id:
-            print(f"Skipping {os.path.basename(path)}: POST_ID missing")
-            continue
-        prompt = r._build_image_prompt(topic)
-        image_url = r._generate_image_url(prompt)
-        if not image_url:
-            print(f"Skipping {post_id}: image generation failed")
+def _existing_images(client: RestClient, post_ids: list[str], chunk_size: int = 100) -> dict[str, str]:
+    """post_id -> image_url для постов, у которых картинка в research_posts уже есть."""
+    found: dict[str, str] = {}
+    for start in range(0, len(post_ids), chunk_size):
+        chunk = post_ids[start : start + chunk_size]
+        query = parse.urlencode(
+            {"select": "id,image_url", "id": f"in.({','.join(chunk)})", "image_url": "not.is.null"},
+            safe="*.,()",
+        )
+        for row in client.request("GET", f"/rest/v1/research_posts?{query}") or []:
+            if row.get("image_url"):
+                found[str(row["id"])] = row["image_url"]
+    return found
+
+
+def _skip_existing(index: PostsIndex, posts: list[dict], limited: bool) -> Optional[list[dict]]:
+    """
+    Посты unknown сверяются с research_posts: у кого картинка уже есть,
+    помечаются ok и не перегенерируются. Без ключей Supabase проверить
+    нельзя — тогда unknown чиним только с явным --limit (иначе None).
+    """
+    unknown = [post["post_id"] for post in posts if post["image_status"] == "unknown"]
+    if not unknown:
+        return posts
+    url = os.getenv("SUPABASE_URL", "").strip()
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "").strip() or os.getenv("SUPABASE_ANON_KEY", "").strip()
+    if not url or not key:
+        if limited:
+            print(f"[WARN] Нет SUPABASE_URL/ключа: {len(unknown)} постов unknown не проверены в research_posts.")
+            return posts
+        print(
+            f"Нет SUPABASE_URL/ключа для проверки {len(unknown)} постов unknown в research_posts: "
+            "задайте их или ограничьте прогон --limit / --post-id."
+        )
+        return None
+    existing = _existing_images(RestClient(url, key), unknown)
+    for post_id, image_url in existing.items():
+        index.set_status(post_id, "ok", image_url=image_url)
+    if existing:
+        print(f"Картинка уже есть у {len(existing)} постов unknown — пропускаю.")
+    return [post for post in posts if post["post_id"] not in existing]
+
+
+def _generate(index: PostsIndex, prompt: str, images_per_minute: float) -> tuple[str, Optional[str], bool]:
+    """(промпт, image_url, взят ли из кэша ассетов)."""
+    cached = index.cached_asset(prompt)
+    if cached:
+        return prompt, cached, True
+    get_limiter("openai-images", images_per_minute / 60.0).acquire()
+    image_url = r._generate_image_url(prompt)
+    if image_url:
+        index.store_asset(prompt, image_url)
+    return prompt, image_url, False
+
+
+def _flush(index: PostsIndex, pool: ThreadPoolExecutor, batch: list[tuple[dict, str]]) -> int:
+    """PATCH пачки постов параллельно; статус ok/failed пишется в индекс по каждому."""
+    futures = {
+        pool.submit(_update_lovable_image, post["post_id"], image_url): (post, image_url)
+        for post, image_url in batch
+    }
+    patched = 0
+    for future in as_completed(futures):
+        post, image_url = futures[future]
+        try:
+            response = future.result()
+        except Exception as exc:
+            index.set_status(post["post_id"], "failed", error=f"patch: {exc}")
+            print(f"[ERROR] PATCH {post['post_id']}: {exc}")
             continue
-        response = _update_lovable_image(post_id, image_url)
+        index.set_status(post["post_id"], "ok", image_url=image_url)
+        patched += 1
         print(
             json.dumps(
                 {
-                    "post_id": post_id,
-                    "topic": topic,
+                    "post_id": post["post_id"],
+                    "topic": post["topic"],
                     "image_url": image_url,
                     "response": response,
                     "updated_at": datetime.utcnow().isoformat(),
@@ -95,7 +132,114 @@ def main() -> int:
                 ensure_ascii=False,
             )
         )
-    return 0
+    batch.clear()
+    return patched
+
+
+def backfill(
+    index: PostsIndex,
+    posts: list[dict],
+    workers: int = 4,
+    images_per_minute: float = 5.0,
+    batch_size: int = 20,
+) -> dict:
+    """
+    Генерирует картинки параллельно (общий лимит images_per_minute),
+    одинаковые промпты берёт из кэша ассетов, отправляет в Lovable
+    пачками по batch_size. Статус каждого поста сразу пишется в индекс,
+    поэтому прерванный прогон продолжается с оставшихся.
+    """
+    started = time.monotonic()
+    stats = {"posts": len(posts), "generated": 0, "cached": 0, "patched": 0, "failed": 0}
+    batch: list[tuple[dict, str]] = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as generators, ThreadPoolExecutor(
+        max_workers=max(1, min(workers, batch_size))
+    ) as patchers:
+        # Одинаковые промпты генерируются один раз на все посты группы.
+        groups: dict[str, list[dict]] = {}
+        for post in posts:
+            groups.setdefault(_image_prompt(post["topic"]), []).append(post)
+        futures = {
+            generators.submit(_generate, index, prompt, images_per_minute): prompt
+            for prompt in groups
+        }
+        done = 0
+        for future in as_completed(futures):
+            group = groups[futures[future]]
+            done += len(group)
+            try:
+                _, image_url, from_cache = future.result()
+            except Exception as exc:
+                print(f"[ERROR] генерация: {exc}")
+                image_url, from_cache = None, False
+            for position, post in enumerate(group):
+                if not image_url:
+                    index.set_status(post["post_id"], "failed", error="image generation failed")
+                    print(f"Skipping {post['post_id']}: image generation failed")
+                    stats["failed"] += 1
+                    continue
+                stats["cached" if from_cache or position else "generated"] += 1
+                index.set_status(post["post_id"], "generated", image_url=image_url)
+                batch.append((post, image_url))
+                if len(batch) >= batch_size:
+                    stats["patched"] += _flush(index, patchers, batch)
+            elapsed = time.monotonic() - started
+            print(f"[PROGRESS] {done}/{len(posts)}, {done / elapsed * 60:.1f} постов/мин")
+        if batch:
+            stats["patched"] += _flush(index, patchers, batch)
+    stats["failed"] += stats["generated"] + stats["cached"] - stats["patched"]
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    return stats
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Backfill Lovable images")
+    parser.add_argument("--limit", type=int, default=0, help="Max posts to repair (0 = all pending)")
+    parser.add_argument(
+        "--status",
+        default=",".join(REPAIR_STATUSES),
+        help=(
+            "Image statuses to repair, comma-separated; 'unknown' (posts seen only in research_db) "
+            "is opt-in and checked against research_posts first, 'ok' regenerates everything"
+        ),
+    )
+    parser.add_argument("--post-id", action="append", default=[], help="Repair only these posts")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent image generations")
+    parser.add_argument("--ipm", type=float, default=5.0, help="Images per minute (DALL·E limit)")
+    parser.add_argument("--batch-size", type=int, default=20, help="Lovable PATCH batch size")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would be repaired")
+    args = parser.parse_args()
+
+    db_path = os.path.join(os.getcwd(), "research_db")
+    index = get_posts_index()
+    if os.path.exists(db_path):
+        added = index.sync_research_db(db_path, _pretty_topic_from_path)
+        if added:
+            print(f"Индекс постов: добавлено {added} из research_db.")
+    print(f"Индекс постов: {index.counts()}")
+
+    statuses = tuple(s.strip() for s in args.status.split(",") if s.strip())
+    posts = index.pending(statuses, args.limit, post_ids=tuple(args.post_id))
+    posts = _skip_existing(index, posts, limited=bool(args.limit or args.post_id))
+    if posts is None:
+        return 1
+    if not posts:
+        print("Нет постов для починки картинок.")
+        return 0
+
+    if args.dry_run:
+        to_generate = 0
+        for post in posts:
+            cached = index.cached_asset(_image_prompt(post["topic"]))
+            to_generate += not cached
+            print(f"{post['post_id']} [{post['image_status']}] {post['topic']}: {'cache' if cached else 'generate'}")
+        minutes = to_generate / args.ipm
+        print(f"Dry run: {len(posts)} постов, около {minutes:.1f} мин при {args.ipm:g} картинок/мин.")
+        return 0
+
+    stats = backfill(index, posts, args.workers, args.ipm, args.batch_size)
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0 if not stats["failed"] else 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable
+
+from research_index import ALIASES, STOP_WORDS, tokenize
+from telegram_publisher import TOP_PRIORITY_DOMAINS
+
+
+RRF_K = 60
+CANDIDATE_DEPTH = int(os.getenv("HYBRID_DEPTH", "20"))
+LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Уровни доказательности как в research_auto_ai._detect_evidence_level.
+EVIDENCE_BOOSTS = {
+    "meta-analysis": 1.25,
+    "clinical": 1.2,
+    "preclinical": 1.0,
+    "in vitro": 0.95,
+    "unknown": 1.0,
+}
+RECENCY_HALF_LIFE_DAYS = 365
+RECENCY_WEIGHT = 0.15
+TOP_SOURCE_BOOST = 1.15
+# Название пептида из запроса в заголовке: точные запросы не проигрывают
+# «похожим по смыслу» статьям.
+TITLE_MATCH_BOOST = 1.3
+
+QUESTIONS_FILE = "retrieval_questions.jsonl"
+
+_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid")
+
+Retriever = Callable[[str, int], list[dict]]
+
+
+def query_terms(query: str) -> list[str]:
+    terms = []
+    for term in tokenize(query):
+        term = ALIASES.get(term, term)
+        if term in STOP_WORDS or (len(term) < 3 and not term.isdigit()):
+            continue
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def document_key(item: dict) -> str:
+    """Чанки из embeddings и строки news_articles сводятся к одному документу."""
+    if item.get("source") and item.get("source_id"):
+        return f"{item['source']}:{item['source_id']}"
+    return f"news_articles:{item.get('id')}"
+
+
+def _document_text(item: dict) -> str:
+    return " ".join(
+        str(item.get(field) or "") for field in ("title", "summary", "content")
+    )
+
+
+def bm25_rank(query: str, items: list[dict]) -> list[tuple[dict, float]]:
+    """BM25 по кандидатам полнотекстового поиска (статистика — по этому пулу)."""
+    terms = query_terms(query)
+    docs = [Counter(tokenize(_document_text(item))) for item in items]
+    if not docs or not terms:
+        return [(item, 0.0) for item in items]
+    avg_len = sum(sum(doc.values()) for doc in docs) / len(docs) or 1.0
+    total = len(docs)
+    scored = []
+    for item, doc in zip(items, docs):
+        length = sum(doc.values())
+        score = 0.0
+        for term in terms:
+            freq = doc.get(term, 0)
+            if not freq:
+                continue
+            doc_freq = sum(1 for other in docs if term in other)
+            idf = math.log(1 + (total - doc_freq + 0.5) / (doc_freq + 0.5))
+            norm = freq + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+            score += idf * freq * (BM25_K1 + 1) / norm
+        scored.append((item, round(score, 4)))
+    scored.sort(key=lambda pair: -pair[1])
+    return scored
+
+
+def detect_evidence_level(item: dict) -> str:
+    level = str(item.get("evidence_level") or "").strip().lower()
+    if level in EVIDENCE_BOOSTS:
+        return level
+    lower = _document_text(item).lower()
+    if any(token in lower for token in ("meta-analysis", "systematic review", "мета-анализ", "систематический обзор")):
+        return "meta-analysis"
+    if any(token in lower for token in ("clinical trial", "randomized", "double-blind", "clinicaltrials.gov", "patients", "пациент", "клиничес")):
+        return "clinical"
+    if any(token in lower for token in ("in vitro", "cell culture", "клеточ")):
+        return "in vitro"
+    if any(token in lower for token in ("mice", "rats", "murine", "in vivo", "preclinical", "мыш", "крыс")):
+        return "preclinical"
+    return "unknown"
+
+
+def _age_days(item: dict, now: datetime) -> float | None:
+    raw = item.get("published_at") or item.get("created_at")
+    if not raw:
+        return None
+    try:
+        created = datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return max((now - created).total_seconds() / 86400, 0.0)
+
+
+def metadata_boosts(query: str, item: dict, now: datetime | None = None) -> dict[str, float]:
+    now = now or datetime.now(timezone.utc)
+    boosts = {"evidence": EVIDENCE_BOOSTS[detect_evidence_level(item)]}
+    age = _age_days(item, now)
+    boosts["recency"] = (
+        1.0 + RECENCY_WEIGHT * 0.5 ** (age / RECENCY_HALF_LIFE_DAYS) if age is not None else 1.0
+    )
+    url = str(item.get("url") or "").lower()
+    boosts["source"] = TOP_SOURCE_BOOST if any(domain in url for domain in TOP_PRIORITY_DOMAINS) else 1.0
+    title_terms = set(tokenize(str(item.get("title") or "")))
+    named = [term for term in query_terms(query) if not term.isdigit() and term in title_terms]
+    boosts["title"] = TITLE_MATCH_BOOST if named else 1.0
+    return boosts
+
+
+def fuse(
+    query: str,
+    lexical_hits: list[dict],
+    vector_hits: list[dict],
+    limit: int = 5,
+    now: datetime | None = None,
+) -> list[dict]:
+    """
+    Reciprocal rank fusion (k=RRF_K) лексического и векторного списков,
+    затем умножение на метаданные-бусты. Возвращает копии документов
+    с полями score и score_details.
+    """
+    entries: dict[str, dict] = {}
+    for name, hits, weight in (
+        ("lexical", lexical_hits, LEXICAL_WEIGHT),
+        ("vector", vector_hits, VECTOR_WEIGHT),
+    ):
+        seen: set[str] = set()
+        for item in hits:
+            key = document_key(item)
+            # Несколько чанков одного документа: учитывается лучший.
+            if key in seen:
+                continue
+            seen.add(key)
+            rank = len(seen)
+            entry = entries.setdefault(key, {"item": dict(item), "rrf": 0.0, "ranks": {}})
+            for field, value in item.items():
+                entry["item"].setdefault(field, value)
+            entry["rrf"] += weight / (RRF_K + rank)
+            entry["ranks"][name] = rank
+
+    results = []
+    for entry in entries.values():
+        boosts = metadata_boosts(query, entry["item"], now)
+        score = entry["rrf"] * math.prod(boosts.values())
+        result = entry["item"]
+        result["score"] = round(score, 6)
+        result["score_details"] = {
+            "rrf": round(entry["rrf"], 6),
+            "ranks": entry["ranks"],
+            "boosts": {name: round(value, 3) for name, value in boosts.items()},
+        }
+        results.append(result)
+    results.sort(key=lambda item: -item["score"])
+    return results[:limit]
+
+
+class HybridRetriever:
+    """Параллельно вызывает лексический и векторный поиск и сливает их через RRF."""
+
+    def __init__(self, lexical: Retriever, vector: Retriever, depth: int = CANDIDATE_DEPTH) -> None:
+        self.lexical = lexical
+        self.vector = vector
+        self.depth = depth
+
+    def _run(self, name: str, retriever: Retriever, query: str) -> list[dict]:
+        try:
+            return retriever(query, self.depth) or []
+        except Exception as exc:
+            print(f"[WARN] Гибридный поиск: {name} недоступен: {exc}")
+            return []
+
+    def candidates(self, query: str) -> tuple[list[dict], list[dict]]:
+        lexical = _POOL.submit(self._run, "lexical", self.lexical, query)
+        vector = _POOL.submit(self._run, "vector", self.vector, query)
+        # Кандидаты без единого термина запроса (score 0) в слияние не идут.
+        lexical_hits = [item for item, score in bm25_rank(query, lexical.result()) if score > 0]
+        return lexical_hits, vector.result()
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        lexical_hits, vector_hits = self.candidates(query)
+        return fuse(query, lexical_hits, vector_hits, limit=limit)
+
+
+def _is_relevant(item: dict, labels: list[str]) -> bool:
+    haystack = " ".join(
+        str(item.get(field) or "") for field in ("id", "source_id", "url", "title")
+    ).casefold()
+    return any(label.casefold() in haystack for label in labels)
+
+
+def evaluate(rankings: list[tuple[list[dict], list[str]]], k: int) -> dict:
+    """MRR@k, Hit@k и nDCG@k по списку (ранжирование, метки релевантности)."""
+    mrr = hit = ndcg = 0.0
+    for ranked, labels in rankings:
+        relevant = sum(1 for item in ranked if _is_relevant(item, labels))
+        gains = [1.0 if _is_relevant(item, labels) else 0.0 for item in ranked[:k]]
+        first = next((index for index, gain in enumerate(gains) if gain), None)
+        if first is not None:
+            mrr += 1.0 / (first + 1)
+            hit += 1.0
+        dcg = sum(gain / math.log2(index + 2) for index, gain in enumerate(gains))
+        ideal = sum(1.0 / math.log2(index + 2) for index in range(min(max(relevant, 1), k)))
+        ndcg += dcg / ideal if ideal else 0.0
+    count = max(len(rankings), 1)
+    return {
+        f"mrr@{k}": round(mrr / count, 4),
+        f"hit@{k}": round(hit / count, 4),
+        f"ndcg@{k}": round(ndcg / count, 4),
+    }
+
+
+def benchmark(questions_path: str, k: int = 5, record: str = "", replay: str = "") -> dict:
+    """
+    Сравнивает lexical / vector / hybrid на размеченных вопросах (JSONL:
+    {"question": ..., "relevant": [id, url, фрагмент заголовка, ...]}).
+    --record сохраняет кандидатов обоих поисков, --replay прогоняет
+    слияние по ним без сети — для подбора весов и бустов.
+    """
+    with open(questions_path, "r", encoding="utf-8") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+
+    recorded: dict[str, dict] = {}
+    if replay:
+        with open(replay, "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+        retriever = None
+    else:
+        import biopeptide_analytic
+
+        retriever = biopeptide_analytic.get_retriever()
+
+    runs: dict[str, list] = {"lexical": [], "vector": [], "hybrid": []}
+    for entry in questions:
+        question = entry["question"]
+        labels = [str(label) for label in entry.get("relevant", [])]
+        if retriever is not None:
+            lexical_hits, vector_hits = retriever.candidates(question)
+            recorded[question] = {"lexical": lexical_hits, "vector": vector_hits}
+        else:
+            cached = recorded.get(question, {})
+            lexical_hits, vector_hits = cached.get("lexical", []), cached.get("vector", [])
+        runs["lexical"].append((lexical_hits, labels))
+        runs["vector"].append((vector_hits, labels))
+        runs["hybrid"].append((fuse(question, lexical_hits, vector_hits, limit=k), labels))
+
+    if record:
+        with open(record, "w", encoding="utf-8") as f:
+            json.dump(recorded, f, ensure_ascii=False, indent=2)
+    report = {mode: evaluate(rankings, k) for mode, rankings in runs.items()}
+    report["questions"] = len(questions)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline relevance benchmark for hybrid retrieval.")
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--record", default="", help="Save retrieved candidates to JSON")
+    parser.add_argument("--replay", default="", help="Score saved candidates without network")
+    args = parser.parse_args()
+    if not args.replay:
+        from supabase_client import load_env
+
+        load_env()
+    benchmark(args.questions, k=args.k, record=args.record, replay=args.replay)
+
+
+if __name__ == "__main__":
+    main()
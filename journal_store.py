@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировок, как раньше
+    fcntl = None
+
+
+DATA_DIR = Path(__file__).resolve().parent / "legal-guard-regtech-master" / "frontend" / "src" / "data"
+# Источник правды: одна статья — одна строка, публикация дописывает в конец.
+STORE_FILE = Path(os.getenv("JOURNAL_STORE_FILE", str(DATA_DIR / "journal.jsonl")))
+# Генерируется из STORE_FILE: python journal_store.py build
+MODULE_FILE = Path(os.getenv("JOURNAL_MODULE_FILE", str(DATA_DIR / "journalData.ts")))
+
+MODULE_HEADER = (
+    "// Файл генерируется из journal.jsonl: python journal_store.py build\n"
+    "// Не редактируйте вручную — правки будут перезаписаны.\n\n"
+    "export type JournalArticle = {\n"
+    "  id: string\n"
+    "  title: string\n"
+    "  quote: string\n"
+    "  essence: string\n"
+    "  benefits: string[]\n"
+    "  recommendation: string\n"
+    "  date: string\n"
+    "  expert_view: string\n"
+    "  lite_view: string\n"
+    "  description: string\n"
+    "}\n\n"
+)
+ARRAY_MARKER = "export const journalData: JournalArticle[] = ["
+
+
+def _lock(f, exclusive: bool) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def _unlock(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _parse_module(text: str) -> list[dict]:
+    """Статьи из старого journalData.ts (JSON-объекты внутри массива)."""
+    start = text.find(ARRAY_MARKER)
+    if start < 0:
+        return []
+    decoder = json.JSONDecoder()
+    pos = start + len(ARRAY_MARKER)
+    articles: list[dict] = []
+    while pos < len(text):
+        char = text[pos]
+        if char in " \t\r\n,":
+            pos += 1
+            continue
+        if char != "{":
+            break
+        article, pos = decoder.raw_decode(text, pos)
+        articles.append(article)
+    return articles
+
+
+def _import_module(store: Path, module: Path) -> None:
+    """Одноразовый перенос статей из journalData.ts, если хранилища ещё нет."""
+    if store.exists() or not module.exists():
+        return
+    articles = _parse_module(module.read_text(encoding="utf-8"))
+    store.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = store.with_name(f"{store.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        # В модуле новые статьи сверху, в хранилище — в порядке публикации.
+        for article in reversed(articles):
+            f.write(json.dumps(article, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, store)
+
+
+def append_article(article: dict, store: Path = STORE_FILE, module: Path = MODULE_FILE) -> Path:
+    """
+    Дописывает статью одной строкой в конец хранилища под эксклюзивной
+    блокировкой: время не зависит от размера журнала, параллельные
+    публикации не теряют друг друга. Повторная публикация того же id
+    заменяет статью при сборке модуля.
+    """
+    if not article.get("id"):
+        raise ValueError("У статьи нет id.")
+    _import_module(store, module)
+    line = (json.dumps(article, ensure_ascii=False) + "\n").encode("utf-8")
+    store.parent.mkdir(parents=True, exist_ok=True)
+    with store.open("a+b") as f:
+        _lock(f, exclusive=True)
+        try:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                # Прерванная запись оставила строку без \n — не склеиваемся с ней.
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            _unlock(f)
+    return store
+
+
+def iter_articles(store: Path = STORE_FILE) -> Iterator[dict]:
+    """Статьи в порядке публикации; битые строки пропускаются."""
+    if not store.exists():
+        return
+    with store.open("r", encoding="utf-8") as f:
+        _lock(f, exclusive=False)
+        try:
+            lines = f.readlines()
+        finally:
+            _unlock(f)
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            article = json.loads(line)
+        except ValueError:
+            print(f"[WARN] {store.name}:{number}: пропускаю повреждённую строку.")
+            continue
+        if isinstance(article, dict) and article.get("id"):
+            yield article
+
+
+def load_articles(store: Path = STORE_FILE) -> list[dict]:
+    """Актуальные статьи, новые первыми (последняя публикация id побеждает)."""
+    latest: dict[str, dict] = {}
+    for article in iter_articles(store):
+        latest.pop(article["id"], None)
+        latest[article["id"]] = article
+    return list(reversed(latest.values()))
+
+
+def render_module(articles: list[dict]) -> str:
+    items = []
+    for article in articles:
+        article_json = json.dumps(article, ensure_ascii=False, indent=2)
+        items.append("\n".join(f"  {line}" for line in article_json.splitlines()) + ",\n")
+    return MODULE_HEADER + ARRAY_MARKER + "\n" + "".join(items) + "]\n"
+
+
+def build_module(store: Path = STORE_FILE, module: Path = MODULE_FILE, force: bool = False) -> Optional[Path]:
+    """
+    Собирает journalData.ts из хранилища (атомарно: tmp + os.replace).
+    Если модуль новее хранилища, ничего не делает и возвращает None.
+    """
+    _import_module(store, module)
+    if not store.exists():
+        return None
+    if not force and module.exists() and module.stat().st_mtime_ns >= store.stat().st_mtime_ns:
+        return None
+    content = render_module(load_articles(store))
+    module.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = module.with_name(f"{module.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(content, encoding="utf-8")
+    os.replace(tmp_path, module)
+    return module
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Journal articles store for the site.")
+    parser.add_argument("command", choices=["build", "stats"])
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the module is up to date")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        path = build_module(force=args.force)
+        print(f"Собран {path}" if path else f"{MODULE_FILE.name} актуален.")
+        return
+    lines = sum(1 for _ in iter_articles())
+    print(f"{STORE_FILE.name}: {lines} записей, {len(load_articles())} статей.")
+
+
+if __name__ == "__main__":
+    main()
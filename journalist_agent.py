@@ -1,12 +1,14 @@
-import json
+import argparse
 import os
 import re
-import shutil
 from datetime import datetime
 from typing import Optional
 
 from dotenv import load_dotenv
 
+import journal_store
+from section_parser import JOURNALIST_SCHEMA, parse_sections
+
 try:
     from openai import OpenAI
 except ImportError:
@@ -29,14 +31,7 @@ BP_PLUS_PROMPT = """Ты — Ведущий научный обозревате
 Остальное (вступление, детали, научный контекст) пиши обычным текстом между блоками.
 Список BENEFITS обязательно 3-4 пункта, каждый начинается с символа 🔸."""
 
-DATA_FILE_PATH = os.path.join(
-    os.getcwd(),
-    "legal-guard-regtech-master",
-    "frontend",
-    "src",
-    "data",
-    "journalData.ts",
-)
+DATA_FILE_PATH = str(journal_store.MODULE_FILE)
 
 
 def _generate_with_openai(prompt: str, user_input: str) -> Optional[str]:
@@ -109,40 +104,6 @@ def save_post(content: str, filename: str) -> str:
     return path
 
 
-def _extract_title(text: str) -> str:
-    match = re.search(r"^###\s*TITLE:\s*(.+)$", text, flags=re.MULTILINE)
-    return match.group(1).strip() if match else ""
-
-
-def _extract_quote(text: str) -> str:
-    match = re.search(r"^###\s*QUOTE:\s*(.+)$", text, flags=re.MULTILINE)
-    return match.group(1).strip() if match else ""
-
-
-def _extract_essence(text: str) -> str:
-    match = re.search(r"^###\s*ESSENCE:\s*(.+)$", text, flags=re.MULTILINE)
-    return match.group(1).strip() if match else ""
-
-
-def _extract_benefits(text: str) -> list[str]:
-    match = re.search(
-        r"^###\s*BENEFITS:\s*(.*?)(?=^###\s*RECOMMENDATION:|\Z)",
-        text,
-        flags=re.MULTILINE | re.DOTALL,
-    )
-    if not match:
-        return []
-    block = match.group(1).strip()
-    raw_items = re.split(r"🔸", block)
-    items = [item.strip(" -\n\t\r") for item in raw_items if item.strip(" -\n\t\r")]
-    return items
-
-
-def _extract_recommendation(text: str) -> str:
-    match = re.search(r"^###\s*RECOMMENDATION:\s*(.+)$", text, flags=re.MULTILINE)
-    return match.group(1).strip() if match else ""
-
-
 def _build_description(title: str, intro: str, quote: str, essence: str, benefits: list[str], recommendation: str) -> str:
     parts = []
     if title:
@@ -164,11 +125,14 @@ def _build_description(title: str, intro: str, quote: str, essence: str, benefit
 
 
 def parse_markdown_to_article(content: str) -> dict:
-    title = _extract_title(content)
-    quote = _extract_quote(content)
-    essence = _extract_essence(content)
-    benefits = _extract_benefits(content)
-    recommendation = _extract_recommendation(content)
+    parsed = parse_sections(content, JOURNALIST_SCHEMA)
+    if not parsed.ok:
+        print(f"[WARN] Черновик не по формату: {'; '.join(parsed.errors)}")
+    title = parsed.get("title")
+    quote = parsed.get("quote")
+    essence = parsed.get("essence")
+    benefits = parsed.items.get("benefits", [])
+    recommendation = parsed.get("recommendation")
     date_value = datetime.now().strftime("%Y-%m-%d")
     expert_view = essence or "Краткий разбор механизма и ключевых эффектов."
     lite_view = f"{title}. {benefits[0]}" if title and benefits else "Короткая выжимка для быстрого чтения."
@@ -188,54 +152,23 @@ def parse_markdown_to_article(content: str) -> dict:
     }
 
 
-def _ensure_data_file() -> None:
-    if os.path.exists(DATA_FILE_PATH):
-        return
-    os.makedirs(os.path.dirname(DATA_FILE_PATH), exist_ok=True)
-    template = (
-        "export type JournalArticle = {\n"
-        "  id: string\n"
-        "  title: string\n"
-        "  quote: string\n"
-        "  essence: string\n"
-        "  benefits: string[]\n"
-        "  recommendation: string\n"
-        "  date: string\n"
-        "  expert_view: string\n"
-        "  lite_view: string\n"
-        "  description: string\n"
-        "}\n\n"
-        "export const journalData: JournalArticle[] = [\n"
-        "]\n"
-    )
-    with open(DATA_FILE_PATH, "w", encoding="utf-8") as f:
-        f.write(template)
-
-
 def publish_to_site(article_object: dict) -> str:
-    _ensure_data_file()
-    backup_path = DATA_FILE_PATH + ".bak"
-    shutil.copyfile(DATA_FILE_PATH, backup_path)
-
-    with open(DATA_FILE_PATH, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    marker = "export const journalData: JournalArticle[] = ["
-    if marker not in content:
-        raise ValueError("Не найден массив journalData в файле.")
-
-    insert_pos = content.find(marker) + len(marker)
-    article_json = json.dumps(article_object, ensure_ascii=False, indent=2)
-    indented = "\n".join(f"  {line}" if line.strip() else line for line in article_json.splitlines())
-    new_content = content[:insert_pos] + "\n" + indented + ",\n" + content[insert_pos:]
-
-    with open(DATA_FILE_PATH, "w", encoding="utf-8") as f:
-        f.write(new_content)
-
-    return DATA_FILE_PATH
-
-
-def main() -> None:
+    """
+    Дописывает статью в journal.jsonl: время не растёт с размером журнала.
+    journalData.ts собирается отдельно — journal_store.build_module()
+    (или python journal_store.py build) один раз после публикаций.
+    """
+    return str(journal_store.append_article(article_object))
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Draft and publish a BP+ journal article.")
+    parser.add_argument(
+        "--build",
+        action="store_true",
+        help="Rebuild journalData.ts after publishing (otherwise: python journal_store.py build)",
+    )
+    args = parser.parse_args(argv)
     load_dotenv()
     topic = "Пептиды для иммунитета"
     raw_data = (
@@ -247,8 +180,13 @@ def main() -> None:
     saved_path = save_post(content, "bp_plus_immunity")
     print(f"Готово. Файл сохранен: {saved_path}")
     article_object = parse_markdown_to_article(content)
-    data_path = publish_to_site(article_object)
-    print(f"Статья добавлена в данные сайта: {data_path}")
+    store_path = publish_to_site(article_object)
+    print(f"Статья добавлена в журнал: {store_path}")
+    # Пересборка читает весь журнал — по умолчанию это отдельный шаг перед сборкой фронтенда.
+    if not args.build:
+        print("Для сайта соберите данные: python journal_store.py build")
+    elif journal_store.build_module():
+        print(f"Данные сайта пересобраны: {DATA_FILE_PATH}")
 
 
 if __name__ == "__main__":
@@ -1,3 +1,6 @@
+// Файл генерируется из journal.jsonl: python journal_store.py build
+// Не редактируйте вручную — правки будут перезаписаны.
+
 export type JournalArticle = {
   id: string
   title: string
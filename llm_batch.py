@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+import urllib.request
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+import llm_router
+
+
+BATCH_DIR = Path(
+    os.getenv("LLM_BATCH_DIR", str(Path(__file__).resolve().parent / ".llm_batches"))
+)
+JOBS_FILE = BATCH_DIR / "jobs.json"
+OPENAI_BASE = "https://api.openai.com/v1"
+CHAT_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# Batch API принимает до 50 000 строк и 200 МБ на файл.
+MAX_REQUESTS = 50_000
+
+
+def chat_request(
+    custom_id: str, prompt: str, model: str, system: str = "", temperature: float = 0.2
+) -> dict:
+    """Строка входного JSONL в формате OpenAI Batch API (chat completions)."""
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_ENDPOINT,
+        "body": {"model": model, "temperature": temperature, "messages": messages},
+    }
+
+
+def write_batch_file(requests: list[dict], path: Path) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        for item in requests:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def _completion_text(body: dict) -> str:
+    choices = body.get("choices") or []
+    if not choices:
+        return ""
+    return ((choices[0].get("message") or {}).get("content") or "").strip()
+
+
+def parse_output(lines: list[dict]) -> tuple[dict[str, str], dict[str, str]]:
+    """Выходной JSONL батча -> ({custom_id: текст}, {custom_id: ошибка})."""
+    texts: dict[str, str] = {}
+    errors: dict[str, str] = {}
+    for item in lines:
+        custom_id = item.get("custom_id")
+        if not custom_id:
+            continue
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            error = item.get("error") or (response.get("body") or {}).get("error") or response
+            errors[custom_id] = json.dumps(error, ensure_ascii=False)[:500]
+            continue
+        text = _completion_text(response.get("body") or {})
+        if text:
+            texts[custom_id] = text
+        else:
+            errors[custom_id] = "empty response"
+    return texts, errors
+
+
+# --- исполнители --------------------------------------------------------------
+
+
+class OpenAIBatchBackend:
+    """Files API + Batch API: загрузка JSONL, создание батча, статус, выгрузка."""
+
+    name = "openai"
+
+    def _request(self, method: str, path: str, data: Optional[bytes] = None, content_type: str = "application/json") -> bytes:
+        request = urllib.request.Request(f"{OPENAI_BASE}{path}", data=data, method=method)
+        request.add_header("Authorization", f"Bearer {llm_router.api_key('openai')}")
+        if data is not None:
+            request.add_header("Content-Type", content_type)
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.read()
+
+    def _upload(self, path: Path) -> str:
+        boundary = uuid.uuid4().hex
+        head = (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="purpose"\r\n\r\nbatch\r\n'
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{path.name}"\r\n'
+            "Content-Type: application/jsonl\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        body = self._request(
+            "POST", "/files", head + path.read_bytes() + tail, f"multipart/form-data; boundary={boundary}"
+        )
+        return json.loads(body)["id"]
+
+    def submit(self, path: Path) -> str:
+        file_id = self._upload(path)
+        payload = {"input_file_id": file_id, "endpoint": CHAT_ENDPOINT, "completion_window": "24h"}
+        body = self._request("POST", "/batches", json.dumps(payload).encode("utf-8"))
+        return json.loads(body)["id"]
+
+    def status(self, batch_id: str) -> dict:
+        return json.loads(self._request("GET", f"/batches/{batch_id}"))
+
+    def results(self, status: dict) -> list[dict]:
+        lines: list[dict] = []
+        for key in ("output_file_id", "error_file_id"):
+            file_id = status.get(key)
+            if not file_id:
+                continue
+            raw = self._request("GET", f"/files/{file_id}/content").decode("utf-8")
+            lines.extend(json.loads(line) for line in raw.splitlines() if line.strip())
+        return lines
+
+    def cancel(self, batch_id: str) -> None:
+        self._request("POST", f"/batches/{batch_id}/cancel", b"{}")
+
+
+def _interactive_complete(body: dict) -> dict:
+    """Обычный chat completion вместо батча: тело ответа как у Batch API."""
+    messages = body.get("messages", [])
+    system = "\n".join(m["content"] for m in messages if m.get("role") == "system")
+    prompt = "\n".join(m["content"] for m in messages if m.get("role") == "user")
+    text = llm_router.PROVIDERS["openai"](
+        prompt, system, body.get("model", ""), body.get("temperature", 0.2), 90
+    )
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]}
+
+
+class LocalBatchBackend:
+    """
+    Локальная замена Batch API с тем же контрактом: submit() сразу
+    выполняет строки через complete(body) и пишет выходной JSONL в формате
+    OpenAI. Для тестов complete подменяется; по умолчанию — обычные вызовы.
+    """
+
+    name = "local"
+
+    def __init__(self, complete: Optional[Callable[[dict], dict]] = None) -> None:
+        self.complete = complete or _interactive_complete
+
+    def submit(self, path: Path) -> str:
+        batch_id = f"local_{uuid.uuid4().hex[:12]}"
+        output_path = BATCH_DIR / f"{batch_id}.output.jsonl"
+        counts = {"total": 0, "completed": 0, "failed": 0}
+        with path.open("r", encoding="utf-8") as src, output_path.open("w", encoding="utf-8") as out:
+            for line in src:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                counts["total"] += 1
+                result = {"id": f"req_{uuid.uuid4().hex[:12]}", "custom_id": item["custom_id"], "error": None}
+                try:
+                    body = self.complete(item["body"])
+                    result["response"] = {"status_code": 200, "body": body}
+                    counts["completed"] += 1
+                except Exception as exc:
+                    result["response"] = None
+                    result["error"] = {"code": type(exc).__name__, "message": str(exc)}
+                    counts["failed"] += 1
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        status = {"id": batch_id, "status": "completed", "output_file": str(output_path), "request_counts": counts}
+        (BATCH_DIR / f"{batch_id}.status.json").write_text(json.dumps(status), encoding="utf-8")
+        return batch_id
+
+    def status(self, batch_id: str) -> dict:
+        return json.loads((BATCH_DIR / f"{batch_id}.status.json").read_text(encoding="utf-8"))
+
+    def results(self, status: dict) -> list[dict]:
+        with open(status["output_file"], "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def cancel(self, batch_id: str) -> None:
+        pass
+
+
+BACKENDS = {"openai": OpenAIBatchBackend, "local": LocalBatchBackend}
+
+
+# --- задания ----------------------------------------------------------------
+
+
+def load_jobs() -> dict:
+    try:
+        with JOBS_FILE.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_jobs(jobs: dict) -> None:
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = JOBS_FILE.with_suffix(".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(jobs, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, JOBS_FILE)
+
+
+def _update_job(job: str, **fields) -> None:
+    jobs = load_jobs()
+    jobs.setdefault(job, {}).update(fields)
+    _save_jobs(jobs)
+
+
+def run_batch(
+    job: str,
+    requests: list[dict],
+    backend=None,
+    poll_interval: float = 60.0,
+    timeout: Optional[float] = None,
+) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    Отправляет requests одним батчем и ждёт результата. Незавершённый
+    батч с тем же именем задания (процесс прервали во время ожидания)
+    не отправляется заново — опрашивается уже существующий.
+    Возвращает ({custom_id: текст}, {custom_id: ошибка}).
+    """
+    backend = backend or OpenAIBatchBackend()
+    if len(requests) > MAX_REQUESTS:
+        raise ValueError(f"Batch API: не больше {MAX_REQUESTS} запросов в батче.")
+    current = load_jobs().get(job) or {}
+    if current.get("batch_id") and current.get("backend") == backend.name and current.get("status") != "collected":
+        batch_id = current["batch_id"]
+        print(f"[BATCH] {job}: продолжаю ожидание батча {batch_id}")
+    else:
+        if not requests:
+            return {}, {}
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        input_path = write_batch_file(requests, BATCH_DIR / f"{job}_{stamp}.jsonl")
+        batch_id = backend.submit(input_path)
+        _update_job(
+            job,
+            batch_id=batch_id,
+            backend=backend.name,
+            input_file=str(input_path),
+            requests=len(requests),
+            submitted_at=time.time(),
+            status="submitted",
+        )
+        print(f"[BATCH] {job}: отправлено {len(requests)} запросов, батч {batch_id}")
+
+    started = time.monotonic()
+    while True:
+        status = backend.status(batch_id)
+        state = status.get("status", "")
+        counts = status.get("request_counts") or {}
+        print(
+            f"[BATCH] {batch_id}: {state}, "
+            f"{counts.get('completed', 0)}/{counts.get('total', '?')} (ошибок {counts.get('failed', 0)})"
+        )
+        if state in TERMINAL_STATUSES:
+            break
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Батч {batch_id} не завершился за {int(timeout)} с; повторите запуск позже.")
+        time.sleep(poll_interval)
+
+    texts, errors = parse_output(backend.results(status))
+    _update_job(job, status="collected", batch_status=state, collected_at=time.time())
+    return texts, errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI Batch API jobs.")
+    parser.add_argument("command", choices=["status", "cancel"])
+    parser.add_argument("job", nargs="?", default="")
+    args = parser.parse_args()
+
+    jobs = load_jobs()
+    if args.command == "status":
+        for name, info in jobs.items():
+            if args.job and name != args.job:
+                continue
+            line = f"{name}: {info.get('batch_id')} [{info.get('backend')}] {info.get('status')}"
+            if info.get("status") != "collected" and info.get("backend") in BACKENDS:
+                status = BACKENDS[info["backend"]]().status(info["batch_id"])
+                line += f" -> {status.get('status')} {status.get('request_counts')}"
+            print(line)
+        return
+    info = jobs.get(args.job)
+    if not info:
+        raise SystemExit(f"Нет задания {args.job}")
+    BACKENDS[info["backend"]]().cancel(info["batch_id"])
+    print(f"Отменён батч {info['batch_id']}")
+
+
+if __name__ == "__main__":
+    main()
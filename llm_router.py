@@ -0,0 +1,430 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import metrics
+from rate_limiter import get_limiter
+
+
+MODELS_CACHE_FILE = Path(
+    os.getenv(
+        "LLM_MODELS_CACHE_FILE",
+        str(Path(__file__).resolve().parent / ".llm_models_cache.json"),
+    )
+)
+MODELS_CACHE_TTL = float(os.getenv("LLM_MODELS_CACHE_TTL", str(24 * 3600)))
+# Хеджирование (второй провайдер параллельно медленному) удваивает расход
+# на медленных запросах, поэтому включается явно: LLM_HEDGE=1 или hedge=True.
+HEDGE_BY_DEFAULT = os.getenv("LLM_HEDGE", "0") == "1"
+# Пока замеров мало, второй провайдер стартует через столько секунд.
+DEFAULT_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "20"))
+MIN_SAMPLES = 5
+# Провайдер с такой долей ошибок в окне уходит в конец очереди.
+UNHEALTHY_ERROR_RATE = 0.5
+RATE_LIMIT_PAUSE = 5.0
+
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "gemini": "gemini-flash-latest",
+}
+# Запасные модели, если предпочтённой нет в списке провайдера.
+FALLBACK_MODELS = {
+    "openai": ["gpt-4o-mini", "gpt-4o"],
+    "gemini": [
+        "gemini-flash-latest",
+        "gemini-pro-latest",
+        "gemini-2.5-flash",
+        "gemini-2.5-pro",
+        "gemini-2.0-flash",
+        "gemini-2.0-flash-001",
+        "gemini-2.0-flash-lite",
+        "gemini-2.5-flash-lite",
+        "gemini-1.5-pro",
+        "gemini-pro",
+    ],
+}
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after: Optional[float] = None) -> None:
+        super().__init__("Rate limit exceeded")
+        self.retry_after = retry_after
+
+
+class LLMResponse(NamedTuple):
+    text: str
+    provider: str
+    model: str
+    seconds: float
+
+
+def api_key(provider: str) -> Optional[str]:
+    if provider == "openai":
+        return os.getenv("OPENAI_API_KEY")
+    if provider == "gemini":
+        return os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    return None
+
+
+def parse_preferences(value: str) -> list[tuple[str, str]]:
+    """'openai:gpt-4o,gemini' -> [("openai", "gpt-4o"), ("gemini", <модель по умолчанию>)]."""
+    preferences = []
+    for item in value.split(","):
+        provider, _, model = item.strip().partition(":")
+        if provider:
+            preferences.append((provider, model or DEFAULT_MODELS.get(provider, "")))
+    return preferences
+
+
+# --- HTTP к провайдерам ----------------------------------------------------
+
+
+def _read_error(exc: urllib.error.HTTPError) -> str:
+    body = exc.read().decode("utf-8", errors="replace").strip()
+    if body:
+        print(body)
+    return body
+
+
+def _openai_call(prompt: str, system: str, model: str, temperature: float, timeout: float) -> str:
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    payload = {"model": model, "temperature": temperature, "messages": messages}
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(
+        "https://api.openai.com/v1/chat/completions", data=data, method="POST"
+    )
+    request.add_header("Content-Type", "application/json")
+    request.add_header("Authorization", f"Bearer {api_key('openai')}")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read().decode("utf-8")
+    except urllib.error.HTTPError as exc:
+        _read_error(exc)
+        if exc.code == 429:
+            retry_after = exc.headers.get("Retry-After") if exc.headers else None
+            try:
+                delay = float(retry_after) if retry_after else None
+            except ValueError:
+                delay = None
+            raise RateLimitError(delay) from exc
+        raise
+    choices = json.loads(body).get("choices", [])
+    if not choices:
+        return ""
+    return (choices[0].get("message") or {}).get("content", "").strip()
+
+
+def _gemini_call(prompt: str, system: str, model: str, temperature: float, timeout: float) -> str:
+    text = f"{system}\n\n{prompt}" if system else prompt
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": text}]}],
+        "generationConfig": {"temperature": temperature},
+    }
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    endpoint = (
+        "https://generativelanguage.googleapis.com/v1beta/models/"
+        f"{model}:generateContent?key={api_key('gemini')}"
+    )
+    request = urllib.request.Request(endpoint, data=data, method="POST")
+    request.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read().decode("utf-8")
+    except urllib.error.HTTPError as exc:
+        error_body = _read_error(exc)
+        if exc.code == 429:
+            retry_after = None
+            try:
+                details = json.loads(error_body).get("error", {}).get("details", [])
+                for item in details:
+                    if item.get("@type") == "type.googleapis.com/google.rpc.RetryInfo":
+                        delay = item.get("retryDelay")
+                        if isinstance(delay, str) and delay.endswith("s"):
+                            retry_after = float(delay[:-1])
+            except (json.JSONDecodeError, ValueError, AttributeError):
+                pass
+            raise RateLimitError(retry_after=retry_after) from exc
+        raise
+    candidates = json.loads(body).get("candidates", [])
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    if not parts:
+        return ""
+    return parts[0].get("text", "").strip()
+
+
+PROVIDERS = {
+    "openai": _openai_call,
+    "gemini": _gemini_call,
+}
+
+
+# --- список моделей ---------------------------------------------------------
+
+
+def _fetch_models(provider: str) -> list[str]:
+    if provider == "openai":
+        request = urllib.request.Request("https://api.openai.com/v1/models", method="GET")
+        request.add_header("Authorization", f"Bearer {api_key('openai')}")
+        with urllib.request.urlopen(request, timeout=30) as response:
+            parsed = json.loads(response.read().decode("utf-8"))
+        return sorted(item["id"] for item in parsed.get("data", []) if item.get("id"))
+    if provider == "gemini":
+        endpoint = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key('gemini')}"
+        with urllib.request.urlopen(urllib.request.Request(endpoint, method="GET"), timeout=30) as response:
+            parsed = json.loads(response.read().decode("utf-8"))
+        models = []
+        for item in parsed.get("models", []):
+            name = item.get("name")
+            methods = item.get("supportedGenerationMethods") or []
+            if isinstance(name, str) and "generateContent" in methods:
+                models.append(name.replace("models/", ""))
+        return models
+    return []
+
+
+_MODELS_LOCK = threading.Lock()
+_MODELS_MEMO: dict[str, dict] = {}
+
+
+def _load_models_cache() -> dict:
+    try:
+        with MODELS_CACHE_FILE.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_models_cache(data: dict) -> None:
+    tmp_path = MODELS_CACHE_FILE.with_suffix(".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MODELS_CACHE_FILE)
+
+
+def available_models(provider: str, refresh: bool = False) -> Optional[list[str]]:
+    """
+    Модели провайдера из кэша (.llm_models_cache.json, TTL сутки); запрос
+    к API — только если кэш устарел. None, если список получить не удалось.
+    """
+    with _MODELS_LOCK:
+        if not _MODELS_MEMO:
+            _MODELS_MEMO.update(_load_models_cache())
+        entry = _MODELS_MEMO.get(provider)
+        if entry and not refresh and time.time() - entry.get("at", 0) < MODELS_CACHE_TTL:
+            return entry.get("models")
+        try:
+            models = _fetch_models(provider)
+        except (urllib.error.URLError, OSError, ValueError) as exc:
+            print(f"[LLM] {provider}: список моделей недоступен: {exc}")
+            return entry.get("models") if entry else None
+        _MODELS_MEMO[provider] = {"at": time.time(), "models": models}
+        try:
+            _save_models_cache(_MODELS_MEMO)
+        except OSError:
+            pass
+        return models
+
+
+def resolve_model(provider: str, preferred: str) -> str:
+    models = available_models(provider)
+    if not models or preferred in models:
+        return preferred
+    for candidate in FALLBACK_MODELS.get(provider, []):
+        if candidate in models:
+            print(f"[LLM] {provider}: модели {preferred} нет, использую {candidate}.")
+            return candidate
+    return preferred
+
+
+# --- статистика и маршрутизация --------------------------------------------
+
+
+class ProviderStats:
+    """Скользящее окно задержек и исходов вызовов одного провайдера."""
+
+    def __init__(self, window: int = 100) -> None:
+        self._lock = threading.Lock()
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(seconds)
+            else:
+                self.errors += 1
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if len(self.outcomes) < MIN_SAMPLES:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def summary(self) -> dict:
+        p95 = self.p95()
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 3),
+            "p95_seconds": round(p95, 2) if p95 is not None else None,
+        }
+
+
+class LLMRouter:
+    """
+    Один вход generate() для нескольких провайдеров. Порядок — список
+    предпочтений, нездоровые провайдеры уходят в конец. Ошибка провайдера
+    сразу запускает следующего; с hedge=True следующий стартует и тогда,
+    когда текущий отвечает дольше своего p95, — берётся первый непустой ответ,
+    ещё не начатые запросы отменяются. Без хеджирования вызов идёт в потоке
+    вызывающего; пул на workers потоков нужен только для параллельных попыток.
+    """
+
+    def __init__(
+        self,
+        preferences: list[tuple[str, str]],
+        hedge: bool = HEDGE_BY_DEFAULT,
+        rates: Optional[dict[str, float]] = None,
+        burst: int = 1,
+        timeout: float = 90,
+        workers: int = 8,
+    ) -> None:
+        self.preferences = [(p, m) for p, m in preferences if p in PROVIDERS]
+        self.hedge = hedge
+        self.timeout = timeout
+        self.stats = {provider: ProviderStats() for provider, _ in self.preferences}
+        self.limiters = {
+            provider: get_limiter(f"llm:{provider}", (rates or {}).get(provider, 0.0), burst)
+            for provider, _ in self.preferences
+        }
+        self._resolved: dict[tuple[str, str], str] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="llm-router")
+
+    def candidates(self) -> list[tuple[str, str]]:
+        configured = [(p, m) for p, m in self.preferences if api_key(p)]
+        healthy = [c for c in configured if self.stats[c[0]].error_rate() < UNHEALTHY_ERROR_RATE]
+        return healthy + [c for c in configured if c not in healthy]
+
+    def _model(self, provider: str, model: str) -> str:
+        key = (provider, model)
+        if key not in self._resolved:
+            self._resolved[key] = resolve_model(provider, model)
+        return self._resolved[key]
+
+    def _call(self, provider: str, model: str, prompt: str, system: str, temperature: float) -> LLMResponse:
+        self.limiters[provider].acquire()
+        started = time.perf_counter()
+        try:
+            text = PROVIDERS[provider](prompt, system, model, temperature, self.timeout)
+        except RateLimitError as exc:
+            self.limiters[provider].pause(exc.retry_after or RATE_LIMIT_PAUSE)
+            self.stats[provider].record(time.perf_counter() - started, False)
+            metrics.inc("llm_errors_total", provider=provider, kind="rate_limit")
+            raise
+        except Exception:
+            self.stats[provider].record(time.perf_counter() - started, False)
+            metrics.inc("llm_errors_total", provider=provider, kind="error")
+            raise
+        seconds = time.perf_counter() - started
+        metrics.observe("outbound_seconds", seconds, target=provider, method="generate")
+        if not text.strip():
+            self.stats[provider].record(seconds, False)
+            raise RuntimeError(f"{provider}: пустой ответ")
+        self.stats[provider].record(seconds, True)
+        return LLMResponse(text, provider, model, seconds)
+
+    def _hedge_after(self, provider: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        return self.stats[provider].p95() or DEFAULT_HEDGE_AFTER
+
+    def generate(self, prompt: str, system: str = "", temperature: float = 0.2) -> LLMResponse:
+        """
+        Первый удачный ответ. Если все провайдеры упали, пробрасывает
+        последнюю ошибку (RateLimitError — если упали все по лимиту).
+        """
+        queue = self.candidates()
+        if not queue:
+            raise RuntimeError("Нет настроенных LLM-провайдеров (OPENAI_API_KEY / GEMINI_API_KEY).")
+        errors: list[Exception] = []
+        if not self.hedge or len(queue) == 1:
+            for provider, model in queue:
+                try:
+                    return self._call(provider, self._model(provider, model), prompt, system, temperature)
+                except Exception as exc:
+                    print(f"[LLM] {type(exc).__name__}: {exc}")
+                    errors.append(exc)
+            raise self._final_error(errors)
+
+        running: dict[Future, str] = {}
+
+        def launch() -> None:
+            provider, model = queue.pop(0)
+            model = self._model(provider, model)
+            future = self._pool.submit(self._call, provider, model, prompt, system, temperature)
+            running[future] = provider
+
+        launch()
+        while running:
+            newest = list(running.values())[-1]
+            timeout = self._hedge_after(newest) if queue else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Текущий провайдер медленнее обычного — подключаем следующего.
+                metrics.inc("llm_hedges_total", provider=newest)
+                launch()
+                continue
+            for future in done:
+                running.pop(future)
+                try:
+                    response = future.result()
+                except Exception as exc:
+                    print(f"[LLM] {type(exc).__name__}: {exc}")
+                    errors.append(exc)
+                    continue
+                # Уже идущий HTTP-запрос не прервать, но ждущий в пуле — снимаем.
+                for other in running:
+                    other.cancel()
+                return response
+            if not running and queue:
+                launch()
+        raise self._final_error(errors)
+
+    @staticmethod
+    def _final_error(errors: list[Exception]) -> Exception:
+        if errors and all(isinstance(exc, RateLimitError) for exc in errors):
+            delays = [exc.retry_after for exc in errors if exc.retry_after]
+            return RateLimitError(min(delays) if delays else None)
+        return errors[-1]
+
+    def pause(self, seconds: float) -> None:
+        for limiter in self.limiters.values():
+            limiter.pause(seconds)
+
+    def report(self) -> dict:
+        return {provider: stats.summary() for provider, stats in self.stats.items()}
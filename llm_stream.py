@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from typing import Callable, Iterator, Optional
+from urllib import request
+
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+# Оценка для отчёта, пока нет usage от завершённых генераций (русский текст в JSON).
+CHARS_PER_TOKEN = 3.0
+
+
+class GenerationAborted(Exception):
+    """Генерация прервана проверкой check: reason — почему, text — что успели получить."""
+
+    def __init__(self, reason: str, text: str, seconds: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.text = text
+        self.seconds = seconds
+
+
+class JsonFieldWatcher:
+    """
+    Инкрементальный разбор верхнего уровня JSON-объекта из потока кусков.
+    feed() возвращает ключи, значения которых закрылись в этом куске;
+    значения копятся в fields. Каждый символ просматривается один раз,
+    вложенные объекты и массивы декодируются целиком при закрытии.
+    Текст до первой '{' (например, ```json) пропускается.
+    """
+
+    def __init__(self) -> None:
+        self.fields: dict = {}
+        self.done = False
+        self._depth = 0
+        self._phase = "start"  # key | key_str | colon | value | after
+        self._in_string = False
+        self._escape = False
+        self._key: list[str] = []
+        self._value: list[str] = []
+
+    def _close(self, closed: list[str]) -> None:
+        key = json.loads('"' + "".join(self._key) + '"')
+        raw = "".join(self._value).strip()
+        try:
+            self.fields[key] = json.loads(raw)
+        except ValueError:
+            self.fields[key] = raw
+        self._value = []
+        self._phase = "after"
+        closed.append(key)
+
+    def feed(self, chunk: str) -> list[str]:
+        closed: list[str] = []
+        for ch in chunk:
+            if self.done:
+                break
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._phase = "key"
+                continue
+            if self._phase == "key_str":
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._phase = "colon"
+                    continue
+                self._key.append(ch)
+                continue
+            if self._phase == "value":
+                if self._in_string:
+                    self._value.append(ch)
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                        if self._depth == 1:
+                            self._close(closed)
+                    continue
+                if ch == '"':
+                    self._in_string = True
+                    self._value.append(ch)
+                elif ch in "{[":
+                    self._depth += 1
+                    self._value.append(ch)
+                elif ch in "}]":
+                    if self._depth == 1:
+                        # Конец всего объекта сразу после скалярного значения.
+                        if self._value:
+                            self._close(closed)
+                        self._depth = 0
+                        self.done = True
+                        continue
+                    self._depth -= 1
+                    self._value.append(ch)
+                    if self._depth == 1:
+                        self._close(closed)
+                elif self._depth == 1 and (ch == "," or ch.isspace()):
+                    if self._value:
+                        self._close(closed)
+                        if ch == ",":
+                            self._phase = "key"
+                else:
+                    self._value.append(ch)
+                continue
+            # key / colon / after: между полями верхнего уровня.
+            if ch == '"' and self._phase == "key":
+                self._phase = "key_str"
+                self._key = []
+            elif ch == ":" and self._phase == "colon":
+                self._phase = "value"
+                self._value = []
+            elif ch == "," and self._phase == "after":
+                self._phase = "key"
+            elif ch == "}":
+                self._depth = 0
+                self.done = True
+        return closed
+
+
+class StreamStats:
+    """Сколько генераций прервано и сколько символов/секунд/токенов на этом сэкономлено."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.completed_chars = 0
+        self.completed_seconds = 0.0
+        self.completed_tokens = 0
+        self.aborted = 0
+        self.aborted_chars = 0
+        self.aborted_seconds = 0.0
+
+    def record_completed(self, chars: int, seconds: float, tokens: int = 0) -> None:
+        with self._lock:
+            self.completed += 1
+            self.completed_chars += chars
+            self.completed_seconds += seconds
+            self.completed_tokens += tokens
+
+    def record_aborted(self, chars: int, seconds: float) -> None:
+        with self._lock:
+            self.aborted += 1
+            self.aborted_chars += chars
+            self.aborted_seconds += seconds
+
+    def savings(self) -> dict:
+        """Экономия относительно средней полной генерации в этом запуске."""
+        with self._lock:
+            if not self.aborted or not self.completed:
+                return {"aborted": self.aborted, "chars": 0, "tokens": 0, "seconds": 0.0}
+            avg_chars = self.completed_chars / self.completed
+            avg_seconds = self.completed_seconds / self.completed
+            chars_per_token = (
+                self.completed_chars / self.completed_tokens if self.completed_tokens else CHARS_PER_TOKEN
+            )
+            chars = max(0.0, avg_chars * self.aborted - self.aborted_chars)
+            return {
+                "aborted": self.aborted,
+                "chars": int(chars),
+                "tokens": int(chars / chars_per_token),
+                "seconds": round(max(0.0, avg_seconds * self.aborted - self.aborted_seconds), 1),
+            }
+
+    def report(self) -> str:
+        saved = self.savings()
+        if not self.aborted:
+            return f"Стриминг: {self.completed} генераций, прерванных нет."
+        if not self.completed:
+            return f"Стриминг: прервано {self.aborted} генераций (экономию не с чем сравнить)."
+        return (
+            f"Стриминг: прервано {saved['aborted']} из {self.aborted + self.completed} генераций, "
+            f"сэкономлено ~{saved['tokens']} токенов ответа и ~{saved['seconds']} с."
+        )
+
+
+STATS = StreamStats()
+
+
+def iter_sse(response) -> Iterator[str]:
+    """Поле data каждого события Server-Sent Events."""
+    for raw_line in response:
+        line = raw_line.decode("utf-8").rstrip("\r\n")
+        if line.startswith("data:"):
+            yield line[len("data:"):].strip()
+
+
+def stream_chat(
+    payload: dict,
+    api_key: str,
+    check: Optional[Callable[[dict], Optional[str]]] = None,
+    timeout: float = 90.0,
+    url: str = OPENAI_CHAT_URL,
+) -> str:
+    """
+    Chat completion со stream=true. Ответ модели (JSON-объект) разбирается
+    по мере прихода; после закрытия каждого поля верхнего уровня вызывается
+    check(fields). Непустой результат — причина отказа: соединение
+    закрывается (генерация на стороне API останавливается) и поднимается
+    GenerationAborted. Иначе возвращается полный текст, как без стриминга.
+    """
+    body = dict(payload, stream=True, stream_options={"include_usage": True})
+    req = request.Request(url, data=json.dumps(body, ensure_ascii=False).encode("utf-8"), method="POST")
+    req.add_header("Content-Type", "application/json")
+    req.add_header("Authorization", f"Bearer {api_key}")
+    watcher = JsonFieldWatcher()
+    parts: list[str] = []
+    tokens = 0
+    started = time.monotonic()
+    with request.urlopen(req, timeout=timeout) as response:
+        for data in iter_sse(response):
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            usage = event.get("usage") or {}
+            tokens = usage.get("completion_tokens", tokens)
+            choices = event.get("choices") or []
+            delta = ((choices[0].get("delta") or {}).get("content") or "") if choices else ""
+            if not delta:
+                continue
+            parts.append(delta)
+            if check is None or watcher.done or not watcher.feed(delta):
+                continue
+            reason = check(watcher.fields)
+            if reason:
+                seconds = time.monotonic() - started
+                text = "".join(parts)
+                STATS.record_aborted(len(text), seconds)
+                raise GenerationAborted(reason, text, seconds)
+    text = "".join(parts).strip()
+    STATS.record_completed(len(text), time.monotonic() - started, tokens)
+    return text
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import metrics
+from fake_bot_api import FakeTelegram, start_in_thread
+from replay_updates import SYNTHETIC_TEXTS
+from supabase_client import load_env
+
+
+BOT_TOKENS = {
+    "arbiter": "100001:fake-arbiter",
+    "drdrag": "100002:fake-drdrag",
+    "analytic": "100003:fake-analytic",
+}
+# Тексты, на которые бот точно реагирует (ответ или удаление), чтобы
+# у каждого сообщения было чем измерить задержку.
+BOT_TEXTS = {
+    "arbiter": ["BPC-157", "эпиталон", "семакс", "GHK-Cu", "купить здесь дешево"],
+    "drdrag": ["дозировка BPC-157", "сколько мкг семакса", "расчет на 80 кг"],
+    "analytic": SYNTHETIC_TEXTS,
+}
+RESPONSE_METHODS = {"sendMessage", "deleteMessage", "deleteMessages", "editMessageText"}
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return round(ordered[index] * 1000, 2)
+
+
+def _start_gateway() -> None:
+    """Все три бота в polling-режиме против поддельного API, в фоновом потоке."""
+    import bot_gateway
+
+    thread = threading.Thread(
+        target=lambda: asyncio.run(bot_gateway.run("polling")), name="gateway", daemon=True
+    )
+    thread.start()
+
+
+def run_load(
+    fake: FakeTelegram,
+    bots: list[str],
+    rate: float,
+    duration: float,
+    timeout: float,
+) -> dict:
+    """
+    Подаёт rate сообщений/с в течение duration секунд (каждое — в свой чат,
+    чтобы однозначно сопоставить ответ) и ждёт ответы до timeout секунд.
+    Задержка — от постановки апдейта в очередь до первого ответа бота в чат.
+    """
+    pending: dict[int, tuple[str, float]] = {}
+    latencies: dict[str, list[float]] = {name: [] for name in bots}
+    sent = {name: 0 for name in bots}
+    total = int(rate * duration)
+    started = time.perf_counter()
+    seen_calls = 0
+
+    def collect() -> None:
+        nonlocal seen_calls
+        calls = fake.calls_since(seen_calls)
+        seen_calls += len(calls)
+        for call in calls:
+            if call["method"] not in RESPONSE_METHODS:
+                continue
+            try:
+                chat_id = int(call["params"].get("chat_id", 0))
+            except (TypeError, ValueError):
+                continue
+            entry = pending.pop(chat_id, None)
+            if entry is not None:
+                name, injected_at = entry
+                latencies[name].append(call["at"] - injected_at)
+
+    for index in range(total):
+        target = started + index / rate
+        while time.perf_counter() < target:
+            collect()
+            time.sleep(min(0.002, max(target - time.perf_counter(), 0)))
+        name = bots[index % len(bots)]
+        chat_id = -(10**9 + index)
+        message = fake.make_message(chat_id, 1000 + index % 97, random.choice(BOT_TEXTS[name]))
+        pending[chat_id] = (name, time.perf_counter())
+        fake.inject(BOT_TOKENS[name], {"message": message})
+        sent[name] += 1
+    send_seconds = time.perf_counter() - started
+
+    deadline = time.perf_counter() + timeout
+    while pending and time.perf_counter() < deadline:
+        collect()
+        time.sleep(0.01)
+    collect()
+    wall = time.perf_counter() - started
+
+    snapshot = metrics.REGISTRY.snapshot()
+    handler_errors = snapshot["counters"].get("handler_errors_total", {})
+    report: dict = {
+        "target_rate": rate,
+        "sent": sum(sent.values()),
+        "send_seconds": round(send_seconds, 2),
+        "wall_seconds": round(wall, 2),
+        "bots": {},
+    }
+    for name in bots:
+        replied = len(latencies[name])
+        label = f'{{bot="{name}"}}'
+        errors = handler_errors.get(label, 0)
+        report["bots"][name] = {
+            "sent": sent[name],
+            "replied": replied,
+            "timeouts": sent[name] - replied,
+            "errors": int(errors),
+            "error_rate": round(errors / sent[name], 4) if sent[name] else 0.0,
+            "no_reply_rate": round((sent[name] - replied) / sent[name], 4) if sent[name] else 0.0,
+            "throughput_per_sec": round(replied / wall, 1) if wall else None,
+            "latency_ms": {
+                "p50": percentile(latencies[name], 0.5),
+                "p90": percentile(latencies[name], 0.9),
+                "p99": percentile(latencies[name], 0.99),
+                "max": percentile(latencies[name], 1.0),
+            },
+        }
+    report["telegram_calls"] = len(fake.calls)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the bots against a local fake Bot API.")
+    parser.add_argument("--bots", default="arbiter,drdrag,analytic")
+    parser.add_argument("--rate", type=float, default=20.0, help="Messages per second (all bots)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Wait for replies after load")
+    parser.add_argument("--out", default="", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    load_env()
+    bots = [name.strip() for name in args.bots.split(",") if name.strip() in BOT_TOKENS]
+    fake = FakeTelegram()
+    server = start_in_thread(fake)
+    host, port = server.server_address[:2]
+
+    # Боты этого процесса ходят только в поддельный API и отвечают в любые чаты.
+    os.environ["TELEGRAM_API_BASE"] = f"http://{host}:{port}"
+    os.environ["ARBITER_TOKEN"] = BOT_TOKENS["arbiter"] if "arbiter" in bots else ""
+    os.environ["DR_DRAG_TOKEN"] = BOT_TOKENS["drdrag"] if "drdrag" in bots else ""
+    os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKENS["analytic"] if "analytic" in bots else ""
+    os.environ.pop("TELEGRAM_DISCUSSION_CHAT_ID", None)
+    os.environ.pop("TELEGRAM_ALLOWED_CHAT_IDS", None)
+    os.environ.pop("GATEWAY_WEBHOOK_URL", None)
+    print(f"Fake Bot API: {os.environ['TELEGRAM_API_BASE']}, боты: {', '.join(bots)}")
+
+    _start_gateway()
+    time.sleep(2)
+    report = run_load(fake, bots, args.rate, args.duration, args.timeout)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+from moderation import get_engine
+
+
 STOP_WORDS = [
     "Semaglutide",
     "Tirzepatide",
@@ -15,13 +18,14 @@ SAFE_TOPICS = [
 ]
 
 
+MODERATION = get_engine()
+MODERATION.register("campaign_stop", STOP_WORDS)
+MODERATION.register("campaign_safe", SAFE_TOPICS)
+
+
 class CampaignManager:
     def check_safety(self, topic: str) -> bool:
-        topic_lower = topic.lower()
-        for word in STOP_WORDS:
-            if word.lower() in topic_lower:
-                return False
-        return True
+        return not MODERATION.contains("campaign_stop", topic)
 
 
 class BudgetStrategist:
@@ -30,12 +34,10 @@ class BudgetStrategist:
         self.stop_list = STOP_WORDS
 
     def _is_safe(self, topic: str) -> bool:
-        topic_lower = topic.lower()
-        return any(item.lower() in topic_lower for item in self.safe_list)
+        return MODERATION.contains("campaign_safe", topic)
 
     def _is_restricted(self, topic: str) -> bool:
-        topic_lower = topic.lower()
-        return any(item.lower() in topic_lower for item in self.stop_list)
+        return MODERATION.contains("campaign_stop", topic)
 
     def propose_weekly_split(self, total_budget: float, topic: str) -> tuple[float, float]:
         if self._is_safe(topic):
@@ -1,16 +1,16 @@
 import argparse
+import hashlib
 import json
 import os
+import sqlite3
+import threading
 import time
 import urllib.error
-import urllib.request
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import llm_batch
+from llm_router import HEDGE_BY_DEFAULT, LLMResponse, LLMRouter, RateLimitError, parse_preferences
 
-class RateLimitError(Exception):
-    def __init__(self, retry_after: Optional[float] = None) -> None:
-        super().__init__("Rate limit exceeded")
-        self.retry_after = retry_after
 
 try:
     from dotenv import load_dotenv
@@ -20,6 +20,11 @@ except Exception:
     pass
 
 
+JOURNAL_FILE = os.getenv(
+    "MASS_REFILL_JOURNAL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mass_refill_journal.sqlite3"),
+)
+
 DEFAULT_SYSTEM_PROMPT = (
     "Ты — научный референт BioPeptidePlus. "
     "Пиши по-русски, сухо и точно. "
@@ -33,163 +38,26 @@ def _pretty_name(file_stem: str) -> str:
     return file_stem.replace("_", " ").replace("-", " ").strip()
 
 
-def _openai_generate(prompt: str, api_key: str, model: str) -> str:
-    payload = {
-        "model": model,
-        "temperature": 0.2,
-        "messages": [
-            {"role": "system", "content": DEFAULT_SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ],
-    }
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    request = urllib.request.Request(
-        "https://api.openai.com/v1/chat/completions", data=data, method="POST"
-    )
-    request.add_header("Content-Type", "application/json")
-    request.add_header("Authorization", f"Bearer {api_key}")
-    with urllib.request.urlopen(request, timeout=90) as response:
-        body = response.read().decode("utf-8")
-    parsed = json.loads(body)
-    choices = parsed.get("choices", [])
-    if not choices:
-        return ""
-    return (choices[0].get("message") or {}).get("content", "").strip()
-
-
-def _gemini_generate(prompt: str, api_key: str, model: str) -> str:
-    payload = {
-        "contents": [{"role": "user", "parts": [{"text": DEFAULT_SYSTEM_PROMPT + "\n\n" + prompt}]}],
-        "generationConfig": {"temperature": 0.2},
-    }
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    endpoint = (
-        "https://generativelanguage.googleapis.com/v1beta/models/"
-        f"{model}:generateContent?key={api_key}"
-    )
-    request = urllib.request.Request(endpoint, data=data, method="POST")
-    request.add_header("Content-Type", "application/json")
-    try:
-        with urllib.request.urlopen(request, timeout=90) as response:
-            body = response.read().decode("utf-8")
-    except urllib.error.HTTPError as exc:
-        error_body = exc.read().decode("utf-8", errors="replace").strip()
-        if error_body:
-            print(error_body)
-        if exc.code == 429 and error_body:
-            try:
-                parsed = json.loads(error_body)
-                retry_info = parsed.get("error", {}).get("details", [])
-                retry_after = None
-                for item in retry_info:
-                    if item.get("@type") == "type.googleapis.com/google.rpc.RetryInfo":
-                        delay = item.get("retryDelay")
-                        if isinstance(delay, str) and delay.endswith("s"):
-                            retry_after = float(delay[:-1])
-                raise RateLimitError(retry_after=retry_after)
-            except (json.JSONDecodeError, ValueError):
-                raise RateLimitError() from exc
-        raise
-    parsed = json.loads(body)
-    candidates = parsed.get("candidates", [])
-    if not candidates:
-        return ""
-    content = candidates[0].get("content", {})
-    parts = content.get("parts", [])
-    if not parts:
-        return ""
-    return parts[0].get("text", "").strip()
-
-
-def _generate_text(prompt: str, provider: str, model: str) -> str:
-    if provider == "openai":
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing OPENAI_API_KEY")
-        return _openai_generate(prompt, api_key, model)
-    if provider == "gemini":
-        api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing GEMINI_API_KEY or GOOGLE_API_KEY")
-        if not api_key.startswith("AIza"):
-            print("Возможно, это не ключ Gemini")
-        return _gemini_generate(prompt, api_key, model)
-    raise RuntimeError(f"Unknown provider: {provider}")
-
-def _list_gemini_models(
-    api_key: str,
-) -> tuple[list[tuple[str, list[str]]], list[str]]:
-    endpoint = (
-        "https://generativelanguage.googleapis.com/v1beta/models"
-        f"?key={api_key}"
-    )
-    request = urllib.request.Request(endpoint, method="GET")
-    request.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(request, timeout=30) as response:
-        body = response.read().decode("utf-8")
-    parsed = json.loads(body)
-    models = parsed.get("models", [])
-    all_models: list[tuple[str, list[str]]] = []
-    generate_models: list[str] = []
-    for item in models:
-        name = item.get("name")
-        if not isinstance(name, str):
-            continue
-        clean_name = name.replace("models/", "")
-        methods = item.get("supportedGenerationMethods") or []
-        if not isinstance(methods, list):
-            methods = []
-        methods = [m for m in methods if isinstance(m, str)]
-        all_models.append((clean_name, methods))
-        if "generateContent" in methods:
-            generate_models.append(clean_name)
-    return all_models, generate_models
-
-
-def _pick_gemini_model(preferred: str, available: list[str]) -> Optional[str]:
-    candidates = [
-        preferred,
-        "gemini-flash-latest",
-        "gemini-pro-latest",
-        "gemini-2.5-flash",
-        "gemini-2.5-pro",
-        "gemini-2.0-flash",
-        "gemini-2.0-flash-001",
-        "gemini-2.0-flash-lite",
-        "gemini-2.5-flash-lite",
-        "gemini-1.5-pro",
-        "gemini-pro",
-    ]
-    for candidate in candidates:
-        if candidate in available:
-            return candidate
-    return None
-
-
-def _generate_with_retries(
-    prompt: str, provider: str, model: str, max_retries: int = 5
-) -> str:
+def _generate_with_retries(prompt: str, router: LLMRouter, max_retries: int = 5) -> LLMResponse:
     backoff_seconds = 5
     for attempt in range(1, max_retries + 1):
         try:
-            return _generate_text(prompt, provider, model)
+            return router.generate(prompt, system=DEFAULT_SYSTEM_PROMPT)
         except RateLimitError as exc:
             if attempt >= max_retries:
                 raise
             wait_for = exc.retry_after or backoff_seconds
             print(
-                f"Лимит достигнут, жду {int(wait_for)} секунд перед повтором..."
+                f"Лимит достигнут у всех провайдеров, жду {int(wait_for)} секунд перед повтором..."
             )
-            time.sleep(wait_for)
+            # Пауза общая: остальные потоки тоже ждут, а не ловят 429.
+            router.pause(wait_for)
             backoff_seconds *= 2
         except urllib.error.HTTPError as exc:
-            if exc.code != 429:
-                raise
-            if attempt >= max_retries:
+            # 4xx (неверный ключ, модель, запрос) повтором не лечится.
+            if exc.code < 500 or attempt >= max_retries:
                 raise
-            print(
-                f"Лимит достигнут, жду {backoff_seconds} секунд перед повтором..."
-            )
+            print(f"HTTP {exc.code}, жду {backoff_seconds} секунд перед повтором...")
             time.sleep(backoff_seconds)
             backoff_seconds *= 2
         except urllib.error.URLError:
@@ -200,7 +68,7 @@ def _generate_with_retries(
             )
             time.sleep(backoff_seconds)
             backoff_seconds *= 2
-    return ""
+    raise RuntimeError("LLM: попытки исчерпаны")
 
 
 def _build_prompt(peptide_name: str) -> str:
@@ -215,6 +83,166 @@ def _build_prompt(peptide_name: str) -> str:
     )
 
 
+class RefillJournal:
+    """
+    SQLite-журнал прогона: по файлу — статус (done/failed/skipped), хэш
+    записанного текста, провайдер, модель и (mtime_ns, size) файла.
+    При перезапуске файлы, чья подпись совпадает с журналом, не открываются.
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "create table if not exists refill ("
+            "file text primary key, content_hash text, status text not null, "
+            "provider text, model text, mtime_ns integer, size integer, "
+            "error text, updated_at real not null)"
+        )
+        self._db.commit()
+
+    def entries(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "select file, content_hash, status, provider, model, mtime_ns, size from refill"
+            ).fetchall()
+        return {
+            row[0]: {
+                "content_hash": row[1],
+                "status": row[2],
+                "provider": row[3],
+                "model": row[4],
+                "signature": (row[5], row[6]),
+            }
+            for row in rows
+        }
+
+    def record(
+        self,
+        file_path: str,
+        status: str,
+        provider: str = "",
+        model: str = "",
+        content_hash: str = "",
+        error: str = "",
+    ) -> None:
+        try:
+            stat = os.stat(file_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = (None, None)
+        with self._lock:
+            self._db.execute(
+                "insert or replace into refill (file, content_hash, status, provider, model, "
+                "mtime_ns, size, error, updated_at) values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    os.path.basename(file_path),
+                    content_hash,
+                    status,
+                    provider,
+                    model,
+                    signature[0],
+                    signature[1],
+                    error,
+                    time.time(),
+                ),
+            )
+            self._db.commit()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._db.execute("delete from refill")
+            self._db.commit()
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _atomic_write(file_path: str, text: str) -> None:
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, file_path)
+
+
+def _file_signature(file_path: str) -> tuple[int, int]:
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _needs_refill(file_path: str) -> bool:
+    try:
+        with open(file_path, "r", encoding="utf-8") as existing:
+            existing_text = existing.read()
+    except Exception:
+        return True
+    return len(existing_text) <= 500 or "Данные в источнике отсутствуют" in existing_text
+
+
+def _refill_file(file_path: str, router: LLMRouter, journal: RefillJournal) -> str:
+    filename = os.path.basename(file_path)
+    peptide_name = _pretty_name(os.path.splitext(filename)[0])
+    prompt = _build_prompt(peptide_name)
+    try:
+        response = _generate_with_retries(prompt, router)
+    except (urllib.error.HTTPError, urllib.error.URLError, RuntimeError, RateLimitError) as exc:
+        print(f"[ERROR] {filename}: {exc}")
+        journal.record(file_path, "failed", error=str(exc))
+        return "failed"
+
+    content = response.text.strip() + "\n"
+    _atomic_write(file_path, content)
+    journal.record(
+        file_path, "done", response.provider, response.model, content_hash=_content_hash(content)
+    )
+    print(f"[OK] {filename} updated ({response.provider}/{response.model}, {response.seconds:.1f}s)")
+    return "done"
+
+
+def _refill_batch(
+    todo: list[str], model: str, backend: str, poll_interval: float, journal: RefillJournal
+) -> None:
+    """Все файлы одним батчем OpenAI; результат раскладывается по файлам и журналу."""
+    paths = {os.path.basename(path): path for path in todo}
+    requests = [
+        llm_batch.chat_request(
+            filename,
+            _build_prompt(_pretty_name(os.path.splitext(filename)[0])),
+            model,
+            DEFAULT_SYSTEM_PROMPT,
+        )
+        for filename in paths
+    ]
+    started = time.monotonic()
+    texts, errors = llm_batch.run_batch(
+        "mass_refill", requests, llm_batch.BACKENDS[backend](), poll_interval
+    )
+    provider = f"{backend}-batch"
+    for filename, text in texts.items():
+        file_path = paths.get(filename)
+        if file_path is None:
+            continue
+        content = text.strip() + "\n"
+        _atomic_write(file_path, content)
+        journal.record(file_path, "done", provider, model, content_hash=_content_hash(content))
+    for filename, error in errors.items():
+        if filename in paths:
+            print(f"[ERROR] {filename}: {error}")
+            journal.record(paths[filename], "failed", provider, model, error=error)
+    elapsed = time.monotonic() - started
+    print(
+        f"Батч: {len(texts)} обновлено, {len(errors)} с ошибкой за {_format_eta(elapsed)} "
+        f"({len(texts) / elapsed * 60 if elapsed else 0:.1f} файлов/мин)"
+    )
+
+
+def _format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Mass refill peptide knowledge base using LLM."
@@ -228,7 +256,17 @@ def main() -> None:
         "--provider",
         choices=["openai", "gemini"],
         default="openai",
-        help="LLM provider to use",
+        help="Preferred LLM provider",
+    )
+    parser.add_argument(
+        "--fallback",
+        default="openai,gemini",
+        help="Fallback providers as provider[:model], comma-separated",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Start a fallback provider while the preferred one is still slow (or LLM_HEDGE=1)",
     )
     parser.add_argument(
         "--model",
@@ -239,39 +277,46 @@ def main() -> None:
         "--delay",
         type=float,
         default=1.0,
-        help="Delay between requests in seconds",
+        help="Delay between requests in seconds (used when --rpm is not set)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Concurrent LLM requests",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help="Requests per minute per provider, shared by all workers",
+    )
+    parser.add_argument(
+        "--journal",
+        default=JOURNAL_FILE,
+        help="SQLite progress journal (resume point)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the journal and re-check every file",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="?",
+        const="openai",
+        choices=sorted(llm_batch.BACKENDS),
+        default=None,
+        help="Generate through the OpenAI Batch API (or 'local' stand-in) instead of live calls",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between batch status checks",
     )
     args = parser.parse_args()
 
-    if args.provider == "gemini":
-        api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise SystemExit("Missing GEMINI_API_KEY or GOOGLE_API_KEY")
-        if not api_key.startswith("AIza"):
-            print("Возможно, это не ключ Gemini")
-        try:
-            all_models, generate_models = _list_gemini_models(api_key)
-            if all_models:
-                print("Доступные модели Gemini:")
-                for name, methods in all_models:
-                    suffix = f" ({', '.join(methods)})" if methods else ""
-                    print(f"- {name}{suffix}")
-        except urllib.error.HTTPError as exc:
-            error_body = exc.read().decode("utf-8", errors="replace").strip()
-            if error_body:
-                print(error_body)
-            raise SystemExit("Не удалось получить список моделей Gemini") from exc
-
-        preferred = args.model
-        if preferred == "gpt-4o":
-            preferred = "gemini-1.5-flash"
-        picked = _pick_gemini_model(preferred, generate_models)
-        if not picked:
-            raise SystemExit("Нет доступных моделей Gemini для generateContent")
-        if picked != args.model:
-            print(f"Gemini: использую модель {picked}.")
-        args.model = picked
-
     if not os.path.isdir(args.db_dir):
         raise SystemExit(f"research_db not found: {args.db_dir}")
 
@@ -285,36 +330,81 @@ def main() -> None:
         print("No .txt files found in research_db.")
         return
 
+    journal = RefillJournal(args.journal)
+    if args.restart:
+        journal.reset()
+    journaled = journal.entries()
+
+    todo: list[str] = []
     for filename in files:
         file_path = os.path.join(args.db_dir, filename)
-        stem = os.path.splitext(filename)[0]
-        peptide_name = _pretty_name(stem)
-        try:
-            with open(file_path, "r", encoding="utf-8") as existing:
-                existing_text = existing.read()
-            if (
-                len(existing_text) > 500
-                and "Данные в источнике отсутствуют" not in existing_text
-            ):
-                print(f"Пропускаю {filename}, файл уже заполнен.")
-                continue
-        except Exception:
-            pass
-        prompt = _build_prompt(peptide_name)
-        try:
-            text = _generate_with_retries(prompt, args.provider, args.model)
-        except (urllib.error.HTTPError, urllib.error.URLError, RuntimeError) as exc:
-            print(f"[ERROR] {filename}: {exc}")
+        entry = journaled.get(filename)
+        # Файл не менялся с прошлой записи в журнал — решение уже принято.
+        if entry and entry["status"] in {"done", "skipped"}:
+            try:
+                if entry["signature"] == _file_signature(file_path):
+                    continue
+            except OSError:
+                pass
+        if not _needs_refill(file_path):
+            print(f"Пропускаю {filename}, файл уже заполнен.")
+            journal.record(file_path, "skipped")
             continue
+        todo.append(file_path)
 
-        if not text.strip():
-            print(f"[WARN] {filename}: empty response, skipping")
-            continue
+    print(f"К заполнению: {len(todo)} из {len(files)} файлов, потоков: {args.workers}")
+    if not todo:
+        return
+
+    if args.batch:
+        if args.provider != "openai":
+            raise SystemExit("--batch поддерживается только для OpenAI")
+        _refill_batch(todo, args.model, args.batch, args.poll_interval, journal)
+        return
 
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(text.strip() + "\n")
-        print(f"[OK] {filename} updated")
-        time.sleep(args.delay)
+    model = args.model
+    if args.provider == "gemini" and model == "gpt-4o":
+        model = "gemini-1.5-flash"
+    preferences = [(args.provider, model)] + [
+        item for item in parse_preferences(args.fallback) if item[0] != args.provider
+    ]
+    rpm = args.rpm if args.rpm is not None else (60.0 / args.delay if args.delay > 0 else 0.0)
+    hedge = args.hedge or HEDGE_BY_DEFAULT
+    router = LLMRouter(
+        preferences,
+        hedge=hedge,
+        rates={provider: rpm / 60.0 for provider, _ in preferences},
+        burst=max(1, args.workers),
+        # С хеджированием у каждого воркера бывает два запроса сразу.
+        workers=max(1, args.workers) * (2 if hedge else 1),
+    )
+    if not router.candidates():
+        raise SystemExit("Нет ключей ни для одного провайдера (OPENAI_API_KEY / GEMINI_API_KEY)")
+    print("Провайдеры: " + ", ".join(f"{p}/{m}" for p, m in router.candidates()))
+
+    started = time.monotonic()
+    counts = {"done": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(_refill_file, path, router, journal)
+            for path in todo
+        ]
+        for finished, future in enumerate(as_completed(futures), start=1):
+            counts[future.result()] += 1
+            elapsed = time.monotonic() - started
+            per_minute = finished / elapsed * 60 if elapsed else 0.0
+            eta = (len(todo) - finished) * elapsed / finished
+            print(
+                f"[PROGRESS] {finished}/{len(todo)} "
+                f"(ok {counts['done']}, ошибок {counts['failed']}), "
+                f"{per_minute:.1f} файлов/мин, ETA {_format_eta(eta)}"
+            )
+
+    print(
+        f"Готово: {counts['done']} обновлено, {counts['failed']} с ошибкой "
+        f"за {_format_eta(time.monotonic() - started)}"
+    )
+    print(f"Провайдеры: {json.dumps(router.report(), ensure_ascii=False)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# Границы бакетов гистограмм задержки, секунды.
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+DUMP_FILE = os.getenv("METRICS_DUMP_FILE", "")
+DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "60"))
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Кумулятивные бакеты как у Prometheus плюс сумма и число наблюдений."""
+
+    __slots__ = ("buckets", "counts", "total", "count", "max")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float | None:
+        """Оценка квантиля линейной интерполяцией внутри бакета."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, count in enumerate(self.counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if count and seen + count >= target:
+                return min(lower + (upper - lower) * (target - seen) / count, self.max)
+            seen += count
+            lower = upper
+        return self.max
+
+
+class Registry:
+    """Счётчики и гистограммы с метками; одна блокировка, без фоновых потоков."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[LabelKey, float]] = {}
+        self._histograms: dict[str, dict[LabelKey, Histogram]] = {}
+        self._help: dict[str, str] = {}
+        self.started_at = time.time()
+
+    def describe(self, name: str, text: str) -> None:
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Время блока в гистограмму `name`; исключения считаются в
+        `<name без _seconds>_errors_total` (handler_seconds -> handler_errors_total),
+        тем же счётчиком, что и ошибки, пойманные внутри обработчиков.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            base = name[: -len("_seconds")] if name.endswith("_seconds") else name
+            self.inc(f"{base}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels):
+        """Декоратор для sync и async функций."""
+
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(key, 'le="%g"' % bound)
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    inf_labels = _format_labels(key, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{inf_labels} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Сводка для JSON: счётчики, а для гистограмм — count, avg, p50/p90/p99."""
+        with self._lock:
+            counters = {
+                name: {_format_labels(key) or "{}": value for key, value in series.items()}
+                for name, series in self._counters.items()
+            }
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = {}
+                for key, histogram in series.items():
+                    histograms[name][_format_labels(key) or "{}"] = {
+                        "count": histogram.count,
+                        "avg": round(histogram.total / histogram.count, 6) if histogram.count else None,
+                        "p50": _round(histogram.quantile(0.5)),
+                        "p90": _round(histogram.quantile(0.9)),
+                        "p99": _round(histogram.quantile(0.99)),
+                        "max": _round(histogram.max),
+                    }
+        return {
+            "uptime": round(time.time() - self.started_at, 1),
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def dump_json(self, path: str | Path) -> None:
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self.snapshot(), ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+
+def _round(value: float | None) -> float | None:
+    return round(value, 6) if value is not None else None
+
+
+REGISTRY = Registry()
+REGISTRY.describe("handler_seconds", "Время обработки апдейта ботом")
+REGISTRY.describe("outbound_seconds", "Время внешних вызовов (telegram, openai, supabase)")
+REGISTRY.describe("updates_total", "Полученные апдейты по ботам")
+
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+timed = REGISTRY.timed
+
+
+def start_json_dumps(path: str = DUMP_FILE, interval: float = DUMP_INTERVAL) -> threading.Thread | None:
+    """Периодически пишет REGISTRY.snapshot() в файл (если path задан)."""
+    if not path:
+        return None
+
+    def loop() -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                REGISTRY.dump_json(path)
+            except OSError as exc:
+                print(f"[WARN] Метрики: не удалось записать {path}: {exc}")
+
+    thread = threading.Thread(target=loop, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
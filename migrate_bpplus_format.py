@@ -1,37 +1,12 @@
+import argparse
 import ast
-import json
 import os
-import urllib.request
-from typing import Optional, List, Dict
+from functools import partial
+from typing import Optional
 
 from dotenv import load_dotenv
 
-
-def _request_json(url: str, method: str, headers: dict, payload: Optional[dict] = None) -> List[Dict]:
-    data = json.dumps(payload).encode("utf-8") if payload is not None else None
-    req = urllib.request.Request(url, data=data, method=method, headers=headers)
-    try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            body = response.read().decode("utf-8")
-    except urllib.error.HTTPError as exc:
-        error_body = exc.read().decode("utf-8", errors="replace")
-        raise RuntimeError(f"HTTP {exc.code}: {error_body}") from exc
-    parsed = json.loads(body)
-    return parsed if isinstance(parsed, list) else []
-
-
-def _fetch_columns(base_url: str, headers: dict) -> List[str]:
-    endpoint = f"{base_url}/rest/v1/"
-    req = urllib.request.Request(endpoint, method="GET", headers={**headers, "Accept": "application/openapi+json"})
-    with urllib.request.urlopen(req, timeout=30) as response:
-        body = response.read().decode("utf-8")
-    data = json.loads(body)
-    definitions = data.get("definitions") or data.get("components", {}).get("schemas", {})
-    table = definitions.get("journal_posts") if isinstance(definitions, dict) else None
-    props = table.get("properties") if isinstance(table, dict) else None
-    if isinstance(props, dict):
-        return list(props.keys())
-    return []
+from migration_runner import BULK_PATCH_SQL, Migration, RestClient, run_migration
 
 
 def _to_tagged(text: str) -> str:
@@ -59,45 +34,61 @@ def _to_tagged(text: str) -> str:
     return "\n\n".join(parts).strip() or raw
 
 
+def _migrate_row(text_field: str, row: dict) -> Optional[dict]:
+    description = str(row.get(text_field) or "")
+    new_text = _to_tagged(description)
+    if not new_text or new_text == description.strip():
+        return None
+    return {text_field: new_text}
+
+
+def bpplus_migration(text_field: str) -> Migration:
+    return Migration(
+        name=f"bpplus_tagged_format:{text_field}",
+        table="journal_posts",
+        columns=[text_field],
+        transform=partial(_migrate_row, text_field),
+        # Кандидаты — только строки со словарём introduction; остальные не выкачиваются.
+        filters={text_field: "like.*introduction*"},
+    )
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate journal_posts text to the tagged BioPeptidePlus format.")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Transform processes")
+    parser.add_argument("--write-workers", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true", help="Transform without writing")
+    parser.add_argument("--force", action="store_true", help="Run again even if already applied")
+    parser.add_argument("--print-sql", action="store_true", help="Print the bulk_patch RPC DDL and exit")
+    args = parser.parse_args()
+
+    if args.print_sql:
+        print(BULK_PATCH_SQL)
+        return
     load_dotenv()
     url = os.getenv("SUPABASE_URL", "").rstrip("/")
     key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
     if not url or not key:
         raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY.")
 
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-        "Content-Type": "application/json",
-    }
-
-    columns = _fetch_columns(url, headers)
+    client = RestClient(url, key)
+    columns = client.table_columns("journal_posts")
     text_field = "description"
     for candidate in ("description", "summary", "content"):
         if candidate in columns:
             text_field = candidate
             break
 
-    fetch_url = (
-        f"{url}/rest/v1/journal_posts"
-        f"?select=id,{text_field}&order=created_at.desc&limit=2"
+    run_migration(
+        client,
+        bpplus_migration(text_field),
+        page_size=args.page_size,
+        workers=args.workers,
+        write_workers=args.write_workers,
+        dry_run=args.dry_run,
+        force=args.force,
     )
-    rows = _request_json(fetch_url, "GET", headers)
-    if not rows:
-        print("Нет записей для миграции.")
-        return
-
-    for row in rows:
-        post_id = row.get("id")
-        description = str(row.get(text_field) or "")
-        new_text = _to_tagged(description)
-        if not post_id or not new_text:
-            continue
-        patch_url = f"{url}/rest/v1/journal_posts?id=eq.{post_id}"
-        payload = {text_field: new_text}
-        _request_json(patch_url, "PATCH", headers, payload)
-        print(f"Updated post {post_id}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+from supabase_bulk import chunk_rows, is_missing_function_error, write_chunks
+
+
+STATE_FILE = Path(__file__).resolve().parent / ".migrations_state.json"
+RPC_NAME = "bulk_patch"
+
+# Выполнить один раз в SQL Editor Supabase: python migrate_bpplus_format.py --print-sql
+# Обновляет только колонки, пришедшие в items; типы — из самой таблицы.
+BULK_PATCH_SQL = """
+create or replace function public.bulk_patch(target regclass, items jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+  assignments text;
+  updated integer;
+begin
+  select string_agg(format('%I = i.%I', key, key), ', ')
+    into assignments
+    from (select distinct jsonb_object_keys(item) as key
+            from jsonb_array_elements(items) as item) keys
+   where key <> 'id';
+  if assignments is null then
+    return 0;
+  end if;
+  execute format(
+    'update %s t set %s from jsonb_populate_recordset(null::%s, $1) i where t.id = i.id',
+    target, assignments, target
+  ) using items;
+  get diagnostics updated = row_count;
+  return updated;
+end;
+$$;
+
+revoke execute on function public.bulk_patch(regclass, jsonb) from public, anon, authenticated;
+"""
+
+
+class Migration:
+    """
+    Миграция строк таблицы: transform(row) -> dict изменённых полей или None.
+    transform должен быть функцией уровня модуля (уходит в пул процессов).
+    filters — условия PostgREST (например {"content": "like.*introduction*"}),
+    чтобы не выкачивать заведомо неподходящие строки.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        columns: list[str],
+        transform: Callable[[dict], Optional[dict]],
+        filters: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.transform = transform
+        self.filters = filters or {}
+
+
+class RestClient:
+    """Минимальный клиент PostgREST Supabase на urllib."""
+
+    def __init__(self, base_url: str, key: str) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+
+    def request(self, method: str, path: str, payload=None, extra_headers: Optional[dict] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(
+            f"{self.base_url}{path}", data=data, method=method, headers={**self.headers, **(extra_headers or {})}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                body = response.read().decode("utf-8")
+        except urllib.error.HTTPError as exc:
+            error_body = exc.read().decode("utf-8", errors="replace")
+            raise RuntimeError(f"HTTP {exc.code}: {error_body}") from exc
+        return json.loads(body) if body else None
+
+    def table_columns(self, table: str) -> list[str]:
+        data = self.request("GET", "/rest/v1/", extra_headers={"Accept": "application/openapi+json"}) or {}
+        definitions = data.get("definitions") or data.get("components", {}).get("schemas", {})
+        definition = definitions.get(table) if isinstance(definitions, dict) else None
+        props = definition.get("properties") if isinstance(definition, dict) else None
+        return list(props.keys()) if isinstance(props, dict) else []
+
+    def page(self, migration: Migration, after_id, page_size: int) -> list[dict]:
+        """Keyset-страница: id > after_id по возрастанию id."""
+        params = [("select", ",".join(["id"] + [c for c in migration.columns if c != "id"]))]
+        params += list(migration.filters.items())
+        if after_id is not None:
+            params.append(("id", f"gt.{after_id}"))
+        params += [("order", "id.asc"), ("limit", str(page_size))]
+        query = urllib.parse.urlencode(params, safe="*.,()")
+        return self.request("GET", f"/rest/v1/{migration.table}?{query}") or []
+
+    def bulk_patch(self, table: str, items: list[dict]) -> int:
+        return int(self.request("POST", f"/rest/v1/rpc/{RPC_NAME}", {"target": table, "items": items}) or 0)
+
+    def patch_row(self, table: str, item: dict) -> int:
+        fields = {key: value for key, value in item.items() if key != "id"}
+        query = urllib.parse.urlencode({"id": f"eq.{item['id']}"})
+        self.request("PATCH", f"/rest/v1/{table}?{query}", fields)
+        return 1
+
+
+def load_state() -> dict:
+    try:
+        return json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: dict) -> None:
+    tmp_path = STATE_FILE.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, STATE_FILE)
+
+
+def _group_by_columns(items: list[dict]) -> list[list[dict]]:
+    # bulk_patch обновляет все пришедшие колонки: в одном вызове — одинаковый набор ключей.
+    groups: dict[tuple[str, ...], list[dict]] = {}
+    for item in items:
+        groups.setdefault(tuple(sorted(item)), []).append(item)
+    return list(groups.values())
+
+
+class _Writer:
+    def __init__(self, client: RestClient, table: str, workers: int, chunk_size: int) -> None:
+        self.client = client
+        self.table = table
+        self.chunk_size = chunk_size
+        self.use_rpc = True
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def write(self, items: list[dict]) -> int:
+        written = 0
+        if self.use_rpc:
+            chunks = [
+                chunk
+                for group in _group_by_columns(items)
+                for chunk in chunk_rows(group, max_rows=self.chunk_size)
+            ]
+            written, pending, error = write_chunks(
+                self._pool,
+                lambda chunk: self.client.bulk_patch(self.table, chunk),
+                chunks,
+                label=f"RPC {RPC_NAME}",
+                give_up=is_missing_function_error,
+            )
+            if error is None:
+                return written
+            if not is_missing_function_error(error):
+                raise error
+            print(f"[WARN] RPC {RPC_NAME} недоступна ({error}); перехожу на PATCH по строкам.")
+            self.use_rpc = False
+            items = [item for chunk in pending for item in chunk]
+        return written + sum(self._pool.map(lambda item: self.client.patch_row(self.table, item), items))
+
+    def close(self) -> None:
+        self._pool.shutdown()
+
+
+def _apply(transform: Callable[[dict], Optional[dict]], row: dict) -> Optional[dict]:
+    changes = transform(row)
+    if not changes:
+        return None
+    return {"id": row["id"], **changes}
+
+
+def run_migration(
+    client: RestClient,
+    migration: Migration,
+    page_size: int = 1000,
+    workers: int = 4,
+    write_workers: int = 4,
+    chunk_size: int = 500,
+    dry_run: bool = False,
+    force: bool = False,
+) -> dict:
+    """
+    Прогоняет миграцию по всей таблице: keyset-страницы по id, transform
+    в пуле процессов, запись пачками через RPC bulk_patch. Прогресс (last_id)
+    сохраняется после каждой страницы; завершённая миграция отмечается
+    применённой, и повторный запуск ничего не делает (кроме force=True).
+    """
+    state = load_state()
+    entry = state.get(migration.name) or {}
+    if entry.get("applied_at") and not force:
+        print(f"Миграция {migration.name} уже применена ({entry.get('changed', 0)} строк).")
+        return {"rows": 0, "changed": 0, "skipped": True}
+    if force or entry.get("applied_at"):
+        entry = {}
+    entry.setdefault("last_id", None)
+    entry.setdefault("rows", 0)
+    entry.setdefault("changed", 0)
+    if entry["last_id"] is not None:
+        print(f"{migration.name}: продолжаю после id={entry['last_id']}.")
+
+    writer = _Writer(client, migration.table, write_workers, chunk_size)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    fetcher = ThreadPoolExecutor(max_workers=1)
+    started = time.monotonic()
+    rows = changed = 0
+    try:
+        next_page = fetcher.submit(client.page, migration, entry["last_id"], page_size)
+        while True:
+            page = next_page.result()
+            if not page:
+                break
+            last_id = page[-1]["id"]
+            next_page = fetcher.submit(client.page, migration, last_id, page_size)
+
+            if pool is not None:
+                chunksize = max(1, len(page) // (workers * 4))
+                results = pool.map(_apply, [migration.transform] * len(page), page, chunksize=chunksize)
+            else:
+                results = (_apply(migration.transform, row) for row in page)
+            items = [item for item in results if item]
+            if items and not dry_run:
+                writer.write(items)
+
+            rows += len(page)
+            changed += len(items)
+            entry.update(last_id=last_id, rows=entry["rows"] + len(page), changed=entry["changed"] + len(items))
+            if not dry_run:
+                state[migration.name] = entry
+                save_state(state)
+            elapsed = time.monotonic() - started
+            print(
+                f"[MIGRATE] {migration.name}: {rows} строк, изменено {changed}, "
+                f"{rows / elapsed:.1f} rows/sec"
+            )
+    finally:
+        fetcher.shutdown(wait=False)
+        writer.close()
+        if pool is not None:
+            pool.shutdown()
+
+    seconds = time.monotonic() - started
+    if not dry_run:
+        entry["applied_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        state[migration.name] = entry
+        save_state(state)
+    stats = {
+        "rows": rows,
+        "changed": changed,
+        "seconds": round(seconds, 2),
+        "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else float(rows),
+    }
+    print(
+        f"{migration.name}: {rows} строк, изменено {changed}, "
+        f"{stats['rows_per_sec']} rows/sec за {stats['seconds']} с."
+    )
+    return stats
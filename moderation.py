@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from pathlib import Path
+from typing import Iterable
+
+
+LISTS_FILE = Path(
+    os.getenv(
+        "MODERATION_LISTS_FILE",
+        str(Path(__file__).resolve().parent / "moderation_lists.json"),
+    )
+)
+RELOAD_INTERVAL = 2.0
+
+URL_REGEX = re.compile(r"(https?://|www\.)\S+", re.IGNORECASE)
+MENTION_REGEX = re.compile(r"@\w+", re.IGNORECASE)
+
+# Латиница и цифры, похожие на кириллицу, сводятся к одному «скелету».
+# Фразы и сообщения нормализуются одинаково, поэтому английские фразы
+# тоже продолжают совпадать.
+_CONFUSABLES = str.maketrans(
+    {
+        "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+        "o": "о", "p": "р", "t": "т", "x": "х", "y": "у", "u": "и", "i": "и",
+        "0": "о", "1": "и", "3": "з", "4": "ч", "6": "б", "@": "а", "ё": "е",
+    }
+)
+_NON_WORD_RE = re.compile(r"[^\w]+|_")
+_REPEAT_RE = re.compile(r"(.)\1+")
+
+
+def normalize(text: str) -> str:
+    """
+    Приводит текст к виду для сравнения: NFKC + casefold, без невидимых
+    символов, с заменой похожих букв/leetspeak, схлопнутыми повторами
+    ("дууурак" -> "дурак") и склеенными разрядками ("в л и ч к у" -> "вличку").
+    Результат обрамлён пробелами.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Cf")
+    text = text.translate(_CONFUSABLES)
+    text = _NON_WORD_RE.sub(" ", text)
+    text = _REPEAT_RE.sub(r"\1", text)
+
+    tokens: list[str] = []
+    letters: list[str] = []
+    for token in text.split():
+        if len(token) == 1:
+            letters.append(token)
+            continue
+        if letters:
+            tokens.append("".join(letters))
+            letters = []
+        tokens.append(token)
+    if letters:
+        tokens.append("".join(letters))
+    return " " + " ".join(tokens) + " "
+
+
+class PhraseMatcher:
+    """Автомат Ахо—Корасик по нормализованным фразам: один проход по тексту."""
+
+    def __init__(self, phrases: Iterable[str]) -> None:
+        self.phrases = [phrase for phrase in phrases if phrase and phrase.strip()]
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[str]] = [[]]
+        for phrase in self.phrases:
+            core = normalize(phrase).strip()
+            # Вариант без пробелов ловит "в л и ч к у" для фразы "в личку".
+            for variant in {core, core.replace(" ", "")}:
+                if variant:
+                    self._add(variant, phrase)
+        self._build()
+
+    def _add(self, pattern: str, phrase: str) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if phrase not in self._out[state]:
+            self._out[state].append(phrase)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt].extend(
+                    item for item in self._out[self._fail[nxt]] if item not in self._out[nxt]
+                )
+
+    def find(self, text: str, first_only: bool = False) -> list[str]:
+        found: list[str] = []
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in normalize(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for phrase in out[state]:
+                    if phrase not in found:
+                        found.append(phrase)
+                if first_only:
+                    break
+        return found
+
+    def search(self, text: str) -> bool:
+        return bool(self.find(text, first_only=True))
+
+
+class ModerationEngine:
+    """
+    Именованные списки фраз с горячей перезагрузкой из LISTS_FILE (JSON
+    вида {"banned": [...], ...}). Модули регистрируют свои списки по
+    умолчанию; список из файла с тем же именем их заменяет.
+    """
+
+    def __init__(self, path: Path = LISTS_FILE) -> None:
+        self.path = Path(path)
+        self._defaults: dict[str, list[str]] = {}
+        self._file_lists: dict[str, list[str]] = {}
+        self._matchers: dict[str, PhraseMatcher] = {}
+        self._file_mtime: int | None = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, name: str, phrases: Iterable[str]) -> None:
+        with self._lock:
+            self._defaults[name] = list(phrases)
+            self._matchers.pop(name, None)
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._file_mtime:
+            return
+        lists: dict[str, list[str]] = {}
+        if mtime is not None:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as exc:
+                print(f"[WARN] Модерация: не удалось прочитать {self.path}: {exc}")
+                return
+            if isinstance(data, dict):
+                lists = {
+                    str(key): [str(item) for item in value]
+                    for key, value in data.items()
+                    if isinstance(value, list)
+                }
+        self._file_mtime = mtime
+        self._file_lists = lists
+        self._matchers.clear()
+        print(f"Модерация: списки загружены ({', '.join(sorted(lists)) or 'по умолчанию'})")
+
+    def matcher(self, name: str) -> PhraseMatcher:
+        with self._lock:
+            self._maybe_reload()
+            matcher = self._matchers.get(name)
+            if matcher is None:
+                phrases = self._file_lists.get(name, self._defaults.get(name, []))
+                matcher = PhraseMatcher(phrases)
+                self._matchers[name] = matcher
+            return matcher
+
+    def find(self, name: str, text: str) -> list[str]:
+        return self.matcher(name).find(text)
+
+    def contains(self, name: str, text: str) -> bool:
+        return self.matcher(name).search(text)
+
+    def is_violation(self, text: str, list_name: str = "banned") -> bool:
+        """Ссылки, @упоминания или фраза из списка list_name."""
+        if URL_REGEX.search(text) or MENTION_REGEX.search(text):
+            return True
+        return self.contains(list_name, text)
+
+
+_ENGINE: ModerationEngine | None = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine() -> ModerationEngine:
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = ModerationEngine()
+        return _ENGINE
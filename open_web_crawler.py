@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import html
+import json
+import os
+import re
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+
+STATE_FILE = Path(__file__).resolve().parent / ".open_web_state.json"
+MAX_SEEN_PER_FEED = 1000
+# Записи, ещё не сохранённые вызывающим кодом (не совпали с запросами,
+# не влезли в max_results или запись в базу не удалась).
+MAX_PENDING = 500
+USER_AGENT = "Mozilla/5.0 (compatible; BioPeptidePlusScout/1.0)"
+
+# Фиды и sitemap для сайтов из scout_agent.OPEN_WEB_SITES.
+# Для сайтов без фида используется sitemap (берутся только новые <loc>).
+SITE_FEEDS = {
+    "forum.longevity.technology": ["https://forum.longevity.technology/latest.rss"],
+    "lifespan.io": ["https://www.lifespan.io/feed/"],
+    "longevity.technology": ["https://longevity.technology/feed/"],
+    "selfhacked.com": ["https://selfhacked.com/feed/"],
+    "selfdecode.com": ["https://selfdecode.com/blog/feed/"],
+    "reddit.com/r/Biohackers": ["https://www.reddit.com/r/Biohackers/.rss"],
+    "reddit.com/r/Peptides": ["https://www.reddit.com/r/Peptides/.rss"],
+    "examine.com": ["https://examine.com/sitemap.xml"],
+    "med.stanford.edu": ["https://med.stanford.edu/news/all-news.rss"],
+    "hms.harvard.edu": ["https://hms.harvard.edu/news/rss"],
+    "news.mit.edu": ["https://news.mit.edu/rss/feed"],
+    "nature.com": ["https://www.nature.com/nature.rss"],
+    "cell.com": ["https://www.cell.com/cell/current.rss"],
+}
+
+_ATOM_NS = "{http://www.w3.org/2005/Atom}"
+_SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+_TAG_RE = re.compile(r"(?is)<.*?>")
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+# Коды пептидов пишут по-разному: BPC-157, BPC 157, bpc157, TB-500 -> bpc157, tb500.
+# Через пробел склеиваются только заглавные коды, чтобы "in 2024" остался двумя словами.
+_CODE_RE = re.compile(r"\b([A-Za-zА-Яа-яЁё]{1,4})-?(\d+)\b|\b([A-ZА-ЯЁ]{2,4}) (\d+)\b")
+
+
+def load_state(path: Path = STATE_FILE) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: dict, path: Path = STATE_FILE) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def conditional_get(url: str, feed_state: dict, timeout: int = 20) -> tuple[str | None, dict]:
+    """
+    GET с If-None-Match / If-Modified-Since.
+    Возвращает (None, {}) при 304, иначе (тело, новые валидаторы ETag/Last-Modified).
+    """
+    request = urllib.request.Request(url, method="GET")
+    request.add_header("User-Agent", USER_AGENT)
+    if feed_state.get("etag"):
+        request.add_header("If-None-Match", feed_state["etag"])
+    if feed_state.get("last_modified"):
+        request.add_header("If-Modified-Since", feed_state["last_modified"])
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read().decode("utf-8", errors="replace")
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+    except urllib.error.HTTPError as exc:
+        if exc.code == 304:
+            return None, {}
+        raise
+    return body, {key: value for key, value in validators.items() if value}
+
+
+def _clean(text: str) -> str:
+    text = html.unescape(_TAG_RE.sub(" ", text or ""))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _title_from_url(url: str) -> str:
+    slug = url.rstrip("/").rsplit("/", 1)[-1]
+    slug = re.sub(r"\.\w+$", "", slug)
+    return slug.replace("-", " ").replace("_", " ").strip()
+
+
+def parse_feed(xml_text: str) -> list[dict[str, str]]:
+    """
+    Разбирает RSS 2.0, Atom или sitemap.xml в список
+    {"id", "title", "url", "summary", "published", "source"}
+    (published — дата как в фиде, source — <source> элемента RSS).
+    """
+    root = ET.fromstring(xml_text)
+    entries: list[dict[str, str]] = []
+
+    if root.tag == "rss" or root.find("channel") is not None:
+        for item in root.iter("item"):
+            link = (item.findtext("link") or "").strip()
+            guid = (item.findtext("guid") or "").strip() or link
+            entries.append(
+                {
+                    "id": guid,
+                    "title": _clean(item.findtext("title") or ""),
+                    "url": link,
+                    "summary": _clean(item.findtext("description") or ""),
+                    "published": (item.findtext("pubDate") or "").strip(),
+                    "source": (item.findtext("source") or "").strip(),
+                }
+            )
+    elif root.tag == f"{_ATOM_NS}feed":
+        for entry in root.iter(f"{_ATOM_NS}entry"):
+            link = ""
+            for node in entry.findall(f"{_ATOM_NS}link"):
+                if node.get("rel", "alternate") == "alternate":
+                    link = node.get("href", "").strip()
+                    break
+            summary = entry.findtext(f"{_ATOM_NS}summary") or entry.findtext(
+                f"{_ATOM_NS}content"
+            )
+            entries.append(
+                {
+                    "id": (entry.findtext(f"{_ATOM_NS}id") or "").strip() or link,
+                    "title": _clean(entry.findtext(f"{_ATOM_NS}title") or ""),
+                    "url": link,
+                    "summary": _clean(summary or ""),
+                    "published": (
+                        entry.findtext(f"{_ATOM_NS}published")
+                        or entry.findtext(f"{_ATOM_NS}updated")
+                        or ""
+                    ).strip(),
+                    "source": "",
+                }
+            )
+    elif root.tag == f"{_SITEMAP_NS}urlset":
+        for node in root.iter(f"{_SITEMAP_NS}url"):
+            loc = (node.findtext(f"{_SITEMAP_NS}loc") or "").strip()
+            lastmod = (node.findtext(f"{_SITEMAP_NS}lastmod") or "").strip()
+            entries.append(
+                {
+                    "id": f"{loc}#{lastmod}" if lastmod else loc,
+                    "title": _title_from_url(loc),
+                    "url": loc,
+                    "summary": "",
+                    "published": lastmod,
+                    "source": "",
+                }
+            )
+    return [entry for entry in entries if entry["url"] and entry["id"]]
+
+
+def _terms(text: str) -> set[str]:
+    # Грубый стемминг по префиксу: peptides/peptide, longevity/longevous.
+    # Дефисы делят слова (anti-aging -> anti, aging), коды склеиваются (_CODE_RE).
+    normalized = _CODE_RE.sub(lambda m: "".join(part for part in m.groups() if part), text).lower()
+    return {
+        word[:6]
+        for word in _WORD_RE.findall(normalized)
+        if len(word) >= 3 or any(ch.isdigit() for ch in word)
+    }
+
+
+def matches_query(entry: dict[str, str], query: str) -> bool:
+    """Все значимые слова запроса (>= 3 символов) должны встречаться в записи."""
+    query_terms = _terms(query)
+    if not query_terms:
+        return False
+    haystack = f"{entry.get('title', '')} {entry.get('summary', '')} {entry.get('url', '')}"
+    entry_terms = _terms(haystack.replace("/", " "))
+    return query_terms.issubset(entry_terms)
+
+
+def fetch_new_entries(
+    sites: list[str], state: dict
+) -> tuple[list[dict[str, str]], dict[str, int]]:
+    """
+    Обходит фиды сайтов и возвращает только ещё не виденные записи.
+    Вторым значением — счётчики запросов: fetched / not_modified / errors.
+    """
+    new_entries: list[dict[str, str]] = []
+    counters = {"fetched": 0, "not_modified": 0, "errors": 0}
+    feeds_state = state.setdefault("feeds", {})
+
+    for site in sites:
+        for feed_url in SITE_FEEDS.get(site, [f"https://{site}/sitemap.xml"]):
+            feed_state = feeds_state.setdefault(feed_url, {})
+            try:
+                body, validators = conditional_get(feed_url, feed_state)
+            except Exception as exc:
+                counters["errors"] += 1
+                print(f"[WARN] {feed_url}: {exc}")
+                continue
+            if body is None:
+                counters["not_modified"] += 1
+                continue
+            counters["fetched"] += 1
+            try:
+                entries = parse_feed(body)
+            except ET.ParseError as exc:
+                counters["errors"] += 1
+                print(f"[WARN] {feed_url}: не удалось разобрать XML ({exc})")
+                continue
+
+            # Валидаторы сохраняем только после успешного разбора,
+            # иначе следующий запуск получит 304 и пропустит записи.
+            feed_state.update(validators)
+            previous = feed_state.get("seen", [])
+            previous_set = set(previous)
+            current_ids: list[str] = []
+            for entry in entries:
+                current_ids.append(entry["id"])
+                if entry["id"] not in previous_set:
+                    previous_set.add(entry["id"])
+                    new_entries.append(entry)
+            current_set = set(current_ids)
+            merged = current_ids + [item for item in previous if item not in current_set]
+            feed_state["seen"] = merged[: max(MAX_SEEN_PER_FEED, len(current_ids))]
+
+    return new_entries, counters
+
+
+def crawl_open_web(
+    sites: list[str], queries: list[str], max_results: int = 10
+) -> list[dict[str, str]]:
+    """
+    Инкрементальный обход OPEN_WEB_SITES вместо Custom Search.
+    Новые записи сопоставляются с запросами локально; состояние
+    (ETag/Last-Modified и виденные id) хранится в STATE_FILE.
+    Все полученные записи остаются в очереди pending, пока вызывающий
+    код не подтвердит сохранение через mark_stored(urls): при сбое записи
+    или переполнении max_results они снова попадут в следующий обход,
+    хотя фид уже ответит 304.
+    """
+    state = load_state()
+    entries, counters = fetch_new_entries(sites, state)
+    candidates: dict[str, dict[str, str]] = {}
+    for entry in state.get("pending", []) + entries:
+        candidates[entry["id"]] = entry
+    state["pending"] = list(candidates.values())[-MAX_PENDING:]
+    save_state(state)
+
+    results: list[dict[str, str]] = []
+    taken: set[str] = set()
+    for query in queries:
+        matched = [
+            entry
+            for entry in state["pending"]
+            if entry["url"] not in taken and matches_query(entry, query)
+        ]
+        for entry in matched[:max_results]:
+            taken.add(entry["url"])
+            results.append(
+                {"title": entry["title"], "url": entry["url"], "summary": entry["summary"]}
+            )
+    print(
+        f"Open web: {counters['fetched']} фидов обновлено, "
+        f"{counters['not_modified']} без изменений (304), "
+        f"{counters['errors']} ошибок; новых записей {len(entries)}, "
+        f"в очереди {len(state['pending'])}, совпадений {len(results)}."
+    )
+    return results
+
+
+def mark_stored(urls, path: Path = STATE_FILE) -> int:
+    """Убирает из очереди pending записи, которые вызывающий код сохранил."""
+    stored = set(urls)
+    state = load_state(path)
+    pending = state.get("pending", [])
+    state["pending"] = [entry for entry in pending if entry["url"] not in stored]
+    removed = len(pending) - len(state["pending"])
+    if removed:
+        save_state(state, path)
+    return removed
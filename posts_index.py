@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+INDEX_FILE = Path(
+    os.getenv(
+        "POSTS_INDEX_FILE",
+        str(Path(__file__).resolve().parent / ".posts_index.sqlite3"),
+    )
+)
+# Ссылки DALL·E временные (около часа): кэш ассетов живёт меньше.
+ASSET_TTL = float(os.getenv("IMAGE_ASSET_TTL", str(50 * 60)))
+
+# Статусы картинки поста:
+#   unknown   — пост найден в research_db, о картинке ничего не известно;
+#   missing   — пост опубликован без картинки;
+#   generated — картинка сгенерирована, но ещё не отправлена в Lovable;
+#   ok        — картинка у поста есть;
+#   failed    — генерация или PATCH не удались (см. error).
+# unknown — обычно старые посты, у которых картинка в Lovable уже есть,
+# поэтому по умолчанию не чинятся: только явно (fix_images --status unknown).
+REPAIR_STATUSES = ("missing", "generated", "failed")
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def _parse_post_id(text: str) -> str:
+    post_id = ""
+    for line in text.splitlines():
+        if line.startswith("POST_ID:"):
+            post_id = line.split(":", 1)[1].strip()
+    return post_id
+
+
+class PostsIndex:
+    """
+    SQLite-индекс опубликованных постов: post_id -> тема, файл research_db,
+    статус картинки. Пополняется research_auto_ai при публикации и
+    инкрементальной синхронизацией research_db (перечитываются только
+    файлы с новым mtime). Там же кэш ассетов: хэш промпта -> image_url.
+    """
+
+    def __init__(self, path: Path | str = INDEX_FILE) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(
+            """
+            create table if not exists posts (
+                post_id text primary key,
+                topic text not null,
+                file text,
+                image_status text not null,
+                image_url text,
+                error text,
+                file_mtime real,
+                updated_at real not null
+            );
+            create table if not exists files (
+                file text primary key,
+                mtime_ns integer not null
+            );
+            create table if not exists assets (
+                prompt_hash text primary key,
+                prompt text not null,
+                image_url text not null,
+                created_at real not null
+            );
+            """
+        )
+        self._db.commit()
+
+    # --- посты --------------------------------------------------------------
+
+    def record_post(
+        self,
+        post_id: str,
+        topic: str,
+        file: str = "",
+        image_url: Optional[str] = None,
+    ) -> None:
+        status = "ok" if image_url else "missing"
+        with self._lock:
+            self._db.execute(
+                "insert into posts (post_id, topic, file, image_status, image_url, file_mtime, updated_at) "
+                "values (?, ?, ?, ?, ?, ?, ?) "
+                "on conflict(post_id) do update set topic = excluded.topic, file = excluded.file, "
+                "image_status = excluded.image_status, image_url = excluded.image_url, "
+                "updated_at = excluded.updated_at",
+                (post_id, topic, file, status, image_url, time.time(), time.time()),
+            )
+            self._db.commit()
+
+    def set_status(
+        self,
+        post_id: str,
+        status: str,
+        image_url: Optional[str] = None,
+        error: str = "",
+    ) -> None:
+        with self._lock:
+            self._db.execute(
+                "update posts set image_status = ?, image_url = coalesce(?, image_url), "
+                "error = ?, updated_at = ? where post_id = ?",
+                (status, image_url, error, time.time(), post_id),
+            )
+            self._db.commit()
+
+    def pending(
+        self,
+        statuses: tuple[str, ...] = REPAIR_STATUSES,
+        limit: int = 0,
+        post_ids: tuple[str, ...] = (),
+    ) -> list[dict]:
+        """Посты с нужными статусами (и из post_ids, если заданы), свежие (по файлу) первыми."""
+        marks = ",".join("?" for _ in statuses)
+        sql = f"select post_id, topic, file, image_status, image_url from posts where image_status in ({marks})"
+        params: list = list(statuses)
+        if post_ids:
+            sql += f" and post_id in ({','.join('?' for _ in post_ids)})"
+            params += list(post_ids)
+        sql += " order by file_mtime desc"
+        if limit:
+            sql += " limit ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [
+            {"post_id": row[0], "topic": row[1], "file": row[2], "image_status": row[3], "image_url": row[4]}
+            for row in rows
+        ]
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "select image_status, count(*) from posts group by image_status"
+            ).fetchall()
+        return dict(rows)
+
+    # --- синхронизация с research_db ---------------------------------------
+
+    def sync_research_db(self, db_dir: str, topic_of) -> int:
+        """
+        Добавляет посты из POST_ID: в файлах research_db. Файлы, чей mtime
+        не изменился с прошлой синхронизации, не читаются. Возвращает
+        число новых постов. topic_of(path) -> тема поста.
+        """
+        with self._lock:
+            known = dict(self._db.execute("select file, mtime_ns from files").fetchall())
+            before = self._db.execute("select count(*) from posts").fetchone()[0]
+        for name in os.listdir(db_dir):
+            path = os.path.join(db_dir, name)
+            if not name.endswith(".txt") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            if known.get(name) == stat.st_mtime_ns:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    post_id = _parse_post_id(f.read())
+            except (OSError, UnicodeDecodeError):
+                continue
+            with self._lock:
+                if post_id:
+                    self._db.execute(
+                        "insert into posts (post_id, topic, file, image_status, file_mtime, updated_at) "
+                        "values (?, ?, ?, 'unknown', ?, ?) "
+                        "on conflict(post_id) do update set file_mtime = excluded.file_mtime",
+                        (post_id, topic_of(path), name, stat.st_mtime, time.time()),
+                    )
+                self._db.execute(
+                    "insert or replace into files (file, mtime_ns) values (?, ?)",
+                    (name, stat.st_mtime_ns),
+                )
+                self._db.commit()
+        with self._lock:
+            return self._db.execute("select count(*) from posts").fetchone()[0] - before
+
+    # --- кэш ассетов --------------------------------------------------------
+
+    def cached_asset(self, prompt: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "select image_url, created_at from assets where prompt_hash = ?",
+                (prompt_hash(prompt),),
+            ).fetchone()
+        if row and time.time() - row[1] < ASSET_TTL:
+            return row[0]
+        return None
+
+    def store_asset(self, prompt: str, image_url: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "insert or replace into assets (prompt_hash, prompt, image_url, created_at) "
+                "values (?, ?, ?, ?)",
+                (prompt_hash(prompt), prompt, image_url, time.time()),
+            )
+            self._db.commit()
+
+
+_INDEX: Optional[PostsIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_posts_index() -> PostsIndex:
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = PostsIndex()
+        return _INDEX
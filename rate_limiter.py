@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket на поток запросов к одному провайдеру: `rate` запросов
+    в секунду с запасом `burst`. Общий для всех потоков процесса; после
+    429 pause() придерживает всех, а не только получивший ошибку поток.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Ждёт свободный слот; возвращает, сколько секунд пришлось ждать."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self._tokens = min(
+                        self.burst, self._tokens + (now - self._updated) * self.rate
+                    )
+                else:
+                    self._tokens = float(self.burst)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = max(
+                    self._paused_until - now,
+                    (1 - self._tokens) / self.rate if self.rate > 0 else 0.0,
+                )
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+_LIMITERS: dict[str, RateLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(name: str, rate: float, burst: int = 1) -> RateLimiter:
+    """Один лимитер на имя (провайдера) на процесс; первые rate/burst фиксируются."""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None:
+            limiter = RateLimiter(rate, burst)
+            _LIMITERS[name] = limiter
+        return limiter
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable
+
+
+class FileRenderCache:
+    """
+    LRU-кэш результатов render(path, text), привязанный к (mtime_ns, size) файла.
+    Если файл переписан (research_auto_ai, mass_refill и т.п.), ключ меняется
+    и запись пересобирается при следующем обращении — даже если файл
+    переписал другой процесс.
+    """
+
+    def __init__(self, render: Callable[[str, str], str], maxsize: int = 256) -> None:
+        self._render = render
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[tuple[int, int], str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _signature(path: str) -> tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, path: str) -> str:
+        signature = self._signature(path)
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        with open(path, "r", encoding="utf-8") as f:
+            rendered = self._render(path, f.read())
+
+        with self._lock:
+            self._entries[path] = (signature, rendered)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return rendered
+
+    def warm(self, paths: Iterable[str]) -> int:
+        """Предзагружает файлы; счётчики hit/miss после прогрева сбрасываются."""
+        warmed = 0
+        for path in paths:
+            try:
+                self.get(path)
+                warmed += 1
+            except (OSError, UnicodeDecodeError) as exc:
+                print(f"[WARN] Кэш: не удалось прогреть {path}: {exc}")
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+        return warmed
+
+    def invalidate(self, path: str | None = None) -> None:
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
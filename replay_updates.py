@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import biopeptide_analytic
+import comment_handler
+import dr_drag_bot
+import metrics
+from supabase_client import load_env
+
+
+SYNTHETIC_TEXTS = [
+    "BPC-157 дозировка",
+    "что известно про эпиталон?",
+    "семакс и селанк",
+    "GHK-Cu для кожи",
+    "сколько мкг тирзепатида",
+    "рапамицин продлевает жизнь?",
+    "привет всем",
+    "купить здесь дешево",
+]
+
+
+class _SentMessage(SimpleNamespace):
+    pass
+
+
+class ReplayBot:
+    """Bot API без сети: запоминает вызовы, возвращает правдоподобные ответы."""
+
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, dict]] = []
+        self._next_id = 10_000_000
+
+    def _sent(self, method: str, **kwargs) -> _SentMessage:
+        self.calls.append((method, kwargs))
+        self._next_id += 1
+        return _SentMessage(message_id=self._next_id, **kwargs)
+
+    async def send_message(self, **kwargs):
+        return self._sent("sendMessage", **kwargs)
+
+    async def edit_message_text(self, **kwargs):
+        return self._sent("editMessageText", **kwargs)
+
+    async def delete_message(self, **kwargs):
+        self.calls.append(("deleteMessage", kwargs))
+        return True
+
+    async def delete_messages(self, **kwargs):
+        self.calls.append(("deleteMessages", kwargs))
+        return True
+
+    async def get_chat_administrators(self, chat_id):
+        self.calls.append(("getChatAdministrators", {"chat_id": chat_id}))
+        return []
+
+
+def _ptb_update(data: dict, bot: ReplayBot):
+    """Минимальный Update/Message в духе python-telegram-bot для обработчиков."""
+    raw = data.get("message") or data.get("edited_message") or {}
+    chat_id = (raw.get("chat") or {}).get("id", 0)
+    sender = raw.get("from") or {}
+
+    async def reply_text(text, **kwargs):
+        return bot._sent("sendMessage", chat_id=chat_id, text=text, **kwargs)
+
+    message = SimpleNamespace(
+        text=raw.get("text"),
+        chat_id=chat_id,
+        message_id=raw.get("message_id", 0),
+        date=datetime.fromtimestamp(raw.get("date", time.time()), tz=timezone.utc),
+        from_user=SimpleNamespace(id=sender.get("id", 0), username=sender.get("username")),
+        reply_text=reply_text,
+    )
+    return SimpleNamespace(message=message, effective_message=message, chat_member=None)
+
+
+def synthetic_updates(count: int, chats: int = 3, users: int = 50) -> list[dict]:
+    updates = []
+    for index in range(count):
+        updates.append(
+            {
+                "bot": random.choice(["arbiter", "drdrag", "analytic"]),
+                "update": {
+                    "update_id": index + 1,
+                    "message": {
+                        "message_id": index + 1,
+                        "date": int(time.time()),
+                        "chat": {"id": -1000 - index % chats, "type": "supergroup"},
+                        "from": {"id": index % users, "username": f"user{index % users}"},
+                        "text": random.choice(SYNTHETIC_TEXTS),
+                    },
+                },
+            }
+        )
+    return updates
+
+
+def load_updates(path: str, bot: str) -> list[dict]:
+    """JSONL из GATEWAY_RECORD_FILE ({"bot", "update"}) или сырые апдейты (с --bot)."""
+    updates = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "update" not in item:
+                item = {"bot": bot, "update": item}
+            updates.append(item)
+    return updates
+
+
+async def replay(items: list[dict], rate: float, concurrency: int) -> dict:
+    """
+    Прогоняет апдейты через обработчики трёх ботов с заданной частотой
+    (rate=0 — без пауз). Исходящие вызовы Telegram перехватываются;
+    Supabase и OpenAI вызываются по-настоящему, если настроены.
+    """
+    bot = ReplayBot()
+    context = SimpleNamespace(bot=bot)
+    sent: list[tuple[str, dict]] = []
+
+    def capture(token: str, method: str, payload: dict) -> dict:
+        sent.append((method, payload))
+        return {"ok": True, "result": {}}
+
+    biopeptide_analytic._telegram_request = capture
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def run_one(item: dict) -> None:
+        nonlocal errors
+        name, data = item["bot"], item["update"]
+        metrics.inc("updates_total", bot=name)
+        async with semaphore:
+            try:
+                if name == "arbiter":
+                    await comment_handler._handle_update(_ptb_update(data, bot), context)
+                elif name == "drdrag":
+                    await dr_drag_bot.drag_logic(_ptb_update(data, bot), context)
+                else:
+                    await asyncio.to_thread(
+                        biopeptide_analytic._handle_update, "replay", data, None
+                    )
+            except Exception as exc:
+                errors += 1
+                print(f"[REPLAY] {name}: {exc}")
+
+    started = time.perf_counter()
+    tasks = []
+    for index, item in enumerate(items):
+        if rate > 0:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(run_one(item)))
+    await asyncio.gather(*tasks)
+    seconds = time.perf_counter() - started
+
+    return {
+        "updates": len(items),
+        "seconds": round(seconds, 3),
+        "updates_per_sec": round(len(items) / seconds, 1) if seconds else None,
+        "errors": errors,
+        "telegram_calls": len(bot.calls) + len(sent),
+        "metrics": metrics.REGISTRY.snapshot(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic updates through bot handlers.")
+    parser.add_argument("--file", default="", help="JSONL with recorded updates")
+    parser.add_argument("--bot", default="arbiter", choices=["arbiter", "drdrag", "analytic"],
+                        help="Handler for raw updates without a 'bot' field")
+    parser.add_argument("--synthetic", type=int, default=200, help="Synthetic updates if no --file")
+    parser.add_argument("--only", default="", help="Comma-separated bots to keep")
+    parser.add_argument("--rate", type=float, default=0.0, help="Updates per second (0 = max)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--out", default="", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    load_env()
+    items = load_updates(args.file, args.bot) if args.file else synthetic_updates(args.synthetic)
+    if args.only:
+        keep = {name.strip() for name in args.only.split(",")}
+        items = [item for item in items if item["bot"] in keep]
+    comment_handler.warm_caches()
+    report = asyncio.run(replay(items, args.rate, args.concurrency))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
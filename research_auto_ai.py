@@ -4,7 +4,8 @@ import os
 import re
 import time
 import random
-from typing import Optional
+from itertools import islice
+from typing import Callable, Optional
 import xml.etree.ElementTree as ET
 from datetime import datetime
 from urllib import request
@@ -12,6 +13,9 @@ from urllib import parse
 from urllib.error import HTTPError
 from dotenv import load_dotenv
 
+import llm_batch
+import llm_stream
+from posts_index import get_posts_index
 from telegram_publisher import send_message, send_photo
 
 load_dotenv()
@@ -70,6 +74,8 @@ def _format_entry(peptide_name: str, data: dict) -> str:
 JOURNAL_ENDPOINT = "https://fmtbdjyaqgszzzzcrhdk.supabase.co/functions/v1/journal-bot"
 TEXT_MODEL = os.getenv("NEWS_MODEL", "gpt-4o-mini")
 DAILY_LIMIT = int(os.getenv("DAILY_LIMIT", "2"))
+# Стриминг ответа с ранним отказом (should_publish/study_year).
+STREAM_GENERATION = os.getenv("RESEARCH_STREAM", "1").strip().lower() not in ("0", "false", "no")
 KNOWLEDGE_BASE_FILE = "knowledge_base.txt"
 DEFAULT_KEYWORDS = [
     "AOD9604",
@@ -470,8 +476,8 @@ def _append_recent_topic(topic: str) -> None:
         pass
 
 
-def _build_image_prompt(image_scenario: str) -> str:
-    theme = random.choice(IMAGE_THEMES)
+def _build_image_prompt(image_scenario: str, theme: Optional[str] = None) -> str:
+    theme = theme or random.choice(IMAGE_THEMES)
     base = image_scenario.strip()
     if len(base) > 300:
         base = base[:300]
@@ -521,7 +527,10 @@ def _generate_image_url(prompt: str) -> Optional[str]:
     return None
 
 
-def _openai_generate(prompt: str, model: str) -> str:
+def _openai_generate(
+    prompt: str, model: str, check: Optional[Callable[[dict], Optional[str]]] = None
+) -> str:
+    """check — ранняя проверка полей ответа: со стримингом генерация прерывается при отказе."""
     payload = {
         "model": model,
         "temperature": 0.2,
@@ -530,6 +539,8 @@ def _openai_generate(prompt: str, model: str) -> str:
             {"role": "user", "content": prompt},
         ],
     }
+    if check is not None and STREAM_GENERATION:
+        return llm_stream.stream_chat(payload, os.getenv("OPENAI_API_KEY", ""), check, timeout=90)
     data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
     req = request.Request(
         "https://api.openai.com/v1/chat/completions", data=data, method="POST"
@@ -780,6 +791,32 @@ def _hard_filter(parsed: dict, filename: str) -> tuple[bool, str]:
     return True, ""
 
 
+def _early_check(source_metadata: dict) -> Callable[[dict], Optional[str]]:
+    """
+    Проверки, которые решаются по первым полям ответа (should_publish,
+    study_year) — те же правила, что в _generate_article_versions
+    и _hard_filter после постобработки.
+    Возвращает check(fields) -> причина отказа или None.
+    """
+    source_year = source_metadata.get("year", "").strip()
+    year_injected = bool(source_year and (source_metadata.get("journal") or source_metadata.get("doi")))
+
+    def check(fields: dict) -> Optional[str]:
+        if "should_publish" in fields and not bool(fields["should_publish"]):
+            if "skip_reason" not in fields:
+                return None  # причина короткая — дождаться её для лога
+            return f"should_publish=false: {str(fields['skip_reason']).strip() or 'No study found.'}"
+        if "study_year" in fields:
+            study_year = str(fields["study_year"]).strip()
+            if not study_year and year_injected:
+                study_year = source_year
+            if not re.fullmatch(r"(19|20)\d{2}", study_year):
+                return "Rejected: Invalid year"
+        return None
+
+    return check
+
+
 def _strip_html(text: str) -> str:
     cleaned = re.sub(r"(?is)<(script|style).*?>.*?</\1>", " ", text)
     cleaned = re.sub(r"(?is)<.*?>", " ", cleaned)
@@ -1090,22 +1127,21 @@ def _seed_research_db(db_path: str) -> None:
             f.write(snippets)
 
 
-def _generate_article_versions(
-    source_text: str, peptide_name: str, filename: str, include_knowledge_base: bool = True
-) -> Optional[tuple[str, str, str, str]]:
+def _build_article_prompt(
+    source_text: str, peptide_name: str, include_knowledge_base: bool = True
+) -> str:
     source_text = source_text.strip()
     short_source = len(source_text) < 200
     keyword_only = short_source and len(source_text.split()) <= 3
-    source_metadata = _extract_source_metadata(source_text)
     knowledge_base = _load_knowledge_base() if include_knowledge_base else ""
     user_message = (
         "Проанализируй следующий текст и сделай из него Pro и Lite версии:\n\n"
         f"{source_text}"
     )
     prompt = (
-        "Верни строго JSON с полями: title, content_pro, content_lite, "
-        "image_scenario, should_publish, skip_reason, "
-        "specific_study_name, study_year, study_citation, study_sample_size.\n"
+        "Верни строго JSON с полями ровно в таком порядке: should_publish, skip_reason, "
+        "specific_study_name, study_year, study_citation, study_sample_size, "
+        "title, content_pro, content_lite, image_scenario.\n"
         "title: максимально кликабельный и хайповый заголовок, "
         "обязательно с эмодзи 🧬, 🚀, 🧠.\n"
         "content_pro: строго академический и сухой стиль, без оценочных суждений. "
@@ -1185,7 +1221,29 @@ def _generate_article_versions(
             "Если нет проверяемых ссылок, явно укажи: "
             "'Ссылки: данные в источнике отсутствуют'."
         )
-    raw = _openai_generate(prompt, TEXT_MODEL)
+    return prompt
+
+
+def _generate_article_versions(
+    source_text: str,
+    peptide_name: str,
+    filename: str,
+    include_knowledge_base: bool = True,
+    raw: Optional[str] = None,
+) -> Optional[tuple[str, str, str, str]]:
+    """raw — готовый ответ модели (из батча); без него делается живой вызов."""
+    source_text = source_text.strip()
+    source_metadata = _extract_source_metadata(source_text)
+    if raw is None:
+        prompt = _build_article_prompt(source_text, peptide_name, include_knowledge_base)
+        try:
+            raw = _openai_generate(prompt, TEXT_MODEL, check=_early_check(source_metadata))
+        except llm_stream.GenerationAborted as exc:
+            print(
+                f"\033[31mSKIPPED [{peptide_name}]: {exc.reason} "
+                f"(генерация прервана через {exc.seconds:.1f} с, {len(exc.text)} символов)\033[0m"
+            )
+            return None
     debug_files = {"auto_bpc-157.txt", "auto_epitalon.txt"}
     if filename in debug_files:
         print(f"=== RAW OUTPUT [{filename}] ===")
@@ -1271,13 +1329,71 @@ def _send_telegram_update(image_url: Optional[str], text: str) -> None:
     send_message(token, chat_id, text, article_url=None)
 
 
+def _regen_candidates(db_path: str, entries: list[str], resume_after: str, recent_topic_keys: set[str]):
+    """Файлы research_db для --regen-db: (filename, path, тема, исходный текст)."""
+    for filename in sorted(entries):
+        if resume_after and filename.lower() <= resume_after:
+            continue
+        if "{" in filename or "}" in filename:
+            print(f"Skipping invalid filename: {filename}")
+            continue
+        file_path = os.path.join(db_path, filename)
+        raw_name = os.path.splitext(filename)[0]
+        topic_name = raw_name
+        if topic_name.startswith("auto_"):
+            topic_name = topic_name[len("auto_"):]
+        peptide_name = _pretty_name(topic_name)
+        if _topic_key(peptide_name) in recent_topic_keys:
+            print(f"Skipping recent topic: {peptide_name}")
+            continue
+        with open(file_path, "r", encoding="utf-8") as f:
+            source_text = f.read().strip()
+        if not source_text:
+            print(f"Skipping empty file: {filename}")
+            continue
+        yield filename, file_path, peptide_name, source_text
+
+
+def _generate_batch(candidates: list[tuple[str, str, str, str]], backend: str, poll_interval: float) -> dict[str, str]:
+    """Все генерации --regen-db одним батчем; ответы по имени файла."""
+    requests = [
+        llm_batch.chat_request(
+            filename, _build_article_prompt(source_text, peptide_name), TEXT_MODEL, SYSTEM_PROMPT
+        )
+        for filename, _, peptide_name, source_text in candidates
+    ]
+    texts, errors = llm_batch.run_batch(
+        "research_regen", requests, llm_batch.BACKENDS[backend](), poll_interval
+    )
+    for filename, error in errors.items():
+        print(f"Batch error for {filename}: {error}")
+    return texts
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Auto research generator")
     parser.add_argument("peptide_name", nargs="*")
     parser.add_argument("--regen-db", action="store_true")
     parser.add_argument("--resume-after", default="")
     parser.add_argument("--topic", default="", help="Direct search query for research")
+    parser.add_argument(
+        "--batch",
+        nargs="?",
+        const="openai",
+        choices=sorted(llm_batch.BACKENDS),
+        default=None,
+        help="With --regen-db: generate through the OpenAI Batch API (or 'local' stand-in)",
+    )
+    parser.add_argument("--poll-interval", type=float, default=60.0)
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Wait for full completions instead of streaming with early rejection",
+    )
     args = parser.parse_args()
+    if args.no_stream:
+        global STREAM_GENERATION
+        STREAM_GENERATION = False
     if args.topic:
         args.regen_db = True
 
@@ -1381,33 +1497,30 @@ def main() -> int:
         if not entries:
             print("No research_db entries found.")
             return 1
-        resume_after = args.resume_after.strip().lower()
+        candidates = _regen_candidates(
+            db_path, entries, args.resume_after.strip().lower(), recent_topic_keys
+        )
+        batch_texts: Optional[dict[str, str]] = None
+        if args.batch:
+            # В batch уходят только те, что войдут в дневной лимит: остальные
+            # ответы цикл бы не использовал, а следующий запуск отправил бы заново.
+            candidates = list(islice(candidates, DAILY_LIMIT) if DAILY_LIMIT else candidates)
+            batch_texts = _generate_batch(candidates, args.batch, args.poll_interval)
         processed = 0
-        for filename in sorted(entries):
-            if resume_after and filename.lower() <= resume_after:
-                continue
+        for filename, file_path, peptide_name, source_text in candidates:
             if DAILY_LIMIT and processed >= DAILY_LIMIT:
                 print(f"Daily limit reached: {DAILY_LIMIT}")
                 break
-            if "{" in filename or "}" in filename:
-                print(f"Skipping invalid filename: {filename}")
-                continue
-            file_path = os.path.join(db_path, filename)
-            raw_name = os.path.splitext(filename)[0]
-            topic_name = raw_name
-            if topic_name.startswith("auto_"):
-                topic_name = topic_name[len("auto_"):]
-            peptide_name = _pretty_name(topic_name)
-            if _topic_key(peptide_name) in recent_topic_keys:
-                print(f"Skipping recent topic: {peptide_name}")
-                continue
-            with open(file_path, "r", encoding="utf-8") as f:
-                source_text = f.read().strip()
-            if not source_text:
-                print(f"Skipping empty file: {filename}")
-                continue
+            raw = None
+            if batch_texts is not None:
+                raw = batch_texts.get(filename)
+                if raw is None:
+                    print(f"Skipping {filename}: no batch result.")
+                    continue
             try:
-                generated = _generate_article_versions(source_text, peptide_name, filename)
+                generated = _generate_article_versions(
+                    source_text, peptide_name, filename, raw=raw
+                )
                 if not generated:
                     if filename.startswith("auto_"):
                         try:
@@ -1457,6 +1570,7 @@ def main() -> int:
                 _append_recent_topic(peptide_name)
                 post_id = (response.get("post", {}) or {}).get("id") if isinstance(response, dict) else None
                 if post_id:
+                    get_posts_index().record_post(post_id, peptide_name, filename, image_url)
                     try:
                         with open(file_path, "a", encoding="utf-8") as f:
                             f.write(f"\nPOST_ID: {post_id}\n")
@@ -1471,6 +1585,8 @@ def main() -> int:
                 continue
             processed += 1
             print(f"{filename}: {response}")
+        if llm_stream.STATS.aborted or llm_stream.STATS.completed:
+            print(llm_stream.STATS.report())
         return 0
 
     peptide_name = " ".join(args.peptide_name).strip()
@@ -1540,6 +1656,7 @@ def main() -> int:
     _append_recent_topic(peptide_name)
     post_id = (response.get("post", {}) or {}).get("id") if isinstance(response, dict) else None
     if post_id:
+        get_posts_index().record_post(post_id, peptide_name, os.path.basename(file_path), image_url)
         try:
             with open(file_path, "a", encoding="utf-8") as f:
                 f.write(f"\nPOST_ID: {post_id}\n")
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import difflib
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+
+REFRESH_INTERVAL = float(os.getenv("RESEARCH_INDEX_REFRESH", "2.0"))
+FUZZY_CUTOFF = 0.75
+
+# Русские и разговорные названия -> ключ в индексе (как в именах файлов).
+ALIASES = {
+    "тирзепатид": "tirzepatide",
+    "мунджаро": "tirzepatide",
+    "семаглутид": "semaglutide",
+    "оземпик": "semaglutide",
+    "семакс": "semax",
+    "селанк": "selank",
+    "эпиталон": "epitalon",
+    "epithalon": "epitalon",
+    "бпк157": "bpc157",
+    "бпц157": "bpc157",
+    "врс157": "bpc157",
+    "тб500": "tb500",
+    "гхк": "ghk",
+    "гхккю": "ghkcu",
+    "ghkcu": "ghkcu",
+    "мотсц": "motsc",
+    "мотс": "motsc",
+    "рапамицин": "rapamycin",
+    "сиролимус": "rapamycin",
+    "фисетин": "fisetin",
+    "уролитин": "urolithin",
+    "дигекса": "dihexa",
+    "церебролизин": "cerebrolysin",
+    "метиленовый": "methylene",
+    "метиленовая": "methylene",
+    "энкломифен": "enclomiphene",
+    "тесофензин": "tesofensine",
+    "дазатиниб": "dasatinib",
+    "кверцетин": "quercetin",
+    "нмн": "nmn",
+}
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+
+STOP_WORDS = {
+    "протокол", "инфо", "справка", "что", "как", "это", "про", "для", "или",
+    "так", "где", "кто", "мне", "все", "его", "она", "они", "есть", "нет",
+    "the", "and", "for", "with", "what", "about", "info", "auto",
+}
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+_HYPHEN_RE = re.compile(r"[0-9a-zа-яё]+(?:-[0-9a-zа-яё]+)+")
+_ALNUM_PAIR_RE = re.compile(r"\b([a-zа-яё]{2,})[\s-]?(\d{1,4})\b")
+
+
+def transliterate(word: str) -> str:
+    return "".join(_TRANSLIT.get(ch, ch) for ch in word)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Слова в нижнем регистре плюс склеенные формы: "BPC-157" и "BPC 157"
+    дают также "bpc157", "GHK-Cu" — "ghkcu".
+    """
+    lowered = text.lower().replace("_", " ")
+    tokens = _WORD_RE.findall(lowered)
+    tokens.extend(match.replace("-", "") for match in _HYPHEN_RE.findall(lowered))
+    tokens.extend(a + b for a, b in _ALNUM_PAIR_RE.findall(lowered))
+    return tokens
+
+
+class ResearchIndex:
+    """
+    Инвертированный индекс по research_db/*.txt.
+    Переиндексация инкрементальная: раз в REFRESH_INTERVAL секунд
+    сравнивается снимок (mtime, size) файлов каталога.
+    """
+
+    def __init__(self, db_dir: str) -> None:
+        self.db_dir = db_dir
+        self._lock = threading.Lock()
+        self._snapshot: dict[str, tuple[int, int]] = {}
+        self._doc_terms: dict[str, Counter] = {}
+        self._name_terms: dict[str, set[str]] = {}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._name_vocab: list[str] = []
+        self._last_refresh = 0.0
+        self.refresh(force=True)
+
+    @property
+    def files(self) -> list[str]:
+        return sorted(self._doc_terms)
+
+    def _remove(self, file_name: str) -> None:
+        for term in self._doc_terms.pop(file_name, Counter()):
+            docs = self._postings.get(term)
+            if docs is not None:
+                docs.pop(file_name, None)
+                if not docs:
+                    del self._postings[term]
+        self._name_terms.pop(file_name, None)
+
+    def _add(self, file_name: str) -> None:
+        path = os.path.join(self.db_dir, file_name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as exc:
+            print(f"[WARN] Индекс: не удалось прочитать {file_name}: {exc}")
+            return
+        name_terms = {
+            term
+            for term in tokenize(os.path.splitext(file_name)[0])
+            if term not in STOP_WORDS
+        }
+        terms = Counter(tokenize(text))
+        terms.update(name_terms)
+        self._doc_terms[file_name] = terms
+        self._name_terms[file_name] = name_terms
+        for term, count in terms.items():
+            self._postings.setdefault(term, {})[file_name] = count
+
+    def refresh(self, force: bool = False) -> bool:
+        """Переиндексирует изменённые/новые/удалённые файлы. True, если были изменения."""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < REFRESH_INTERVAL:
+            return False
+        with self._lock:
+            self._last_refresh = now
+            current: dict[str, tuple[int, int]] = {}
+            try:
+                with os.scandir(self.db_dir) as entries:
+                    for entry in entries:
+                        if entry.name.lower().endswith(".txt") and entry.is_file():
+                            stat = entry.stat()
+                            current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                current = {}
+
+            changed = False
+            for file_name in set(self._snapshot) - set(current):
+                self._remove(file_name)
+                changed = True
+            for file_name, signature in current.items():
+                if self._snapshot.get(file_name) != signature:
+                    self._remove(file_name)
+                    self._add(file_name)
+                    changed = True
+            self._snapshot = current
+            if changed:
+                vocab = set(ALIASES.values())
+                for names in self._name_terms.values():
+                    vocab.update(names)
+                self._name_vocab = sorted(term for term in vocab if not term.isdigit())
+            return changed
+
+    def _resolve(self, term: str) -> str | None:
+        if term in ALIASES:
+            term = ALIASES[term]
+        if term in self._postings:
+            return term
+        latin = transliterate(term)
+        if latin in self._postings:
+            return latin
+        if len(term) < 4 or term.isdigit():
+            return None
+        close = difflib.get_close_matches(latin, self._name_vocab, n=1, cutoff=FUZZY_CUTOFF)
+        if close and close[0] in self._postings:
+            return close[0]
+        return None
+
+    def _query_terms(self, query: str) -> list[str]:
+        raw = [term for term in tokenize(query) if term not in STOP_WORDS]
+        resolved: list[str] = []
+        consumed: set[str] = set()
+        # Сначала склеенные формы ("bpc157"), затем оставшиеся части.
+        for term in sorted(raw, key=len, reverse=True):
+            if term in consumed or (len(term) < 3 and not term.isdigit()):
+                continue
+            target = self._resolve(term)
+            if target is None:
+                continue
+            if target not in resolved:
+                resolved.append(target)
+            consumed.update(tokenize(target))
+            consumed.update(_WORD_RE.findall(term))
+            for a, b in _ALNUM_PAIR_RE.findall(term):
+                consumed.update((a, b))
+        return [term for term in resolved if not term.isdigit() or len(resolved) == 1]
+
+    def search(self, query: str, limit: int = 3) -> list[tuple[str, float]]:
+        """
+        Возвращает [(имя_файла, score)]. Документ должен содержать все
+        распознанные термины запроса; совпадение с именем файла даёт бонус.
+        """
+        self.refresh()
+        with self._lock:
+            return self._search_locked(query, limit)
+
+    def _search_locked(self, query: str, limit: int) -> list[tuple[str, float]]:
+        terms = self._query_terms(query)
+        if not terms:
+            return []
+        total = max(len(self._doc_terms), 1)
+        doc_freq = {term: len(self._postings[term]) for term in terms}
+        all_names = set().union(*self._name_terms.values()) if self._name_terms else set()
+        # Хотя бы один термин должен различать документы: входить в имя файла
+        # или встречаться не больше чем в половине базы.
+        if not any(term in all_names or doc_freq[term] <= total / 2 for term in terms):
+            return []
+        idf = {term: math.log(1 + total / doc_freq[term]) for term in terms}
+
+        candidates = set(self._postings.get(terms[0], {}))
+        for term in terms[1:]:
+            candidates &= set(self._postings.get(term, {}))
+        if not candidates:
+            candidates = {
+                name for name, names in self._name_terms.items() if names & set(terms)
+            }
+
+        scored = []
+        for file_name in candidates:
+            counts = self._doc_terms.get(file_name, Counter())
+            names = self._name_terms.get(file_name, set())
+            score = 0.0
+            for term in terms:
+                score += (1 + math.log(1 + counts.get(term, 0))) * idf[term]
+                if term in names:
+                    score += 10.0
+            scored.append((file_name, round(score, 3)))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    def best_match(self, query: str) -> str | None:
+        hits = self.search(query, limit=1)
+        return hits[0][0] if hits else None
+
+
+_INDEXES: dict[str, ResearchIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_index(db_dir: str) -> ResearchIndex:
+    """Общий индекс на процесс для каталога db_dir (строится при первом вызове)."""
+    key = os.path.abspath(db_dir)
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        if index is None:
+            index = ResearchIndex(key)
+            _INDEXES[key] = index
+    return index
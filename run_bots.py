@@ -1,6 +1,4 @@
 import os
-import subprocess
-import sys
 
 from dotenv import load_dotenv
 
@@ -20,20 +18,12 @@ os.environ["NEWS_ARTICLES_TEXT_RU_FIELD"] = "title"
 
 
 def main() -> int:
-    print("Starting bots in separate processes.")
-    processes = []
-    for script in ("comment_handler.py", "dr_drag_bot.py"):
-        if not os.path.exists(script):
-            print(f"Missing {script}")
-            continue
-        processes.append(subprocess.Popen([sys.executable, script]))
-
-    if not processes:
-        return 1
-
-    for process in processes:
-        process.wait()
-    return 0
+    # Все боты (Арбитр, Dr. Drag, аналитик) в одном процессе: вебхуки,
+    # если задан GATEWAY_WEBHOOK_URL, иначе polling.
+    import bot_gateway
+
+    print("Starting bot gateway.")
+    return bot_gateway.main()
 
 
 if __name__ == "__main__":
@@ -10,6 +10,9 @@ import urllib.request
 import xml.etree.ElementTree as ET
 from typing import Iterable
 
+from open_web_crawler import crawl_open_web, mark_stored
+from section_parser import SCOUT_SCHEMA, parse_sections
+from supabase_bulk import bulk_upsert_with_fallback
 from supabase_client import get_supabase_client, load_env
 
 
@@ -75,7 +78,14 @@ def _openai_format_bpplus(text: str) -> str:
     choices = parsed.get("choices", [])
     if not choices:
         return text
-    return (choices[0].get("message") or {}).get("content", "").strip() or text
+    formatted = (choices[0].get("message") or {}).get("content", "").strip()
+    if not formatted:
+        return text
+    check = parse_sections(formatted, SCOUT_SCHEMA)
+    if not check.ok:
+        print(f"[WARN] BP+ формат не соблюдён ({'; '.join(check.errors)}); оставляю перевод.")
+        return text
+    return formatted
 
 def _fetch_json(url: str, timeout: int = 20) -> dict:
     with urllib.request.urlopen(url, timeout=timeout) as response:
@@ -423,38 +433,24 @@ def save_articles_to_supabase(articles: list[dict[str, str]]) -> int:
             ("content", "text_ru"),
         ]
 
-    last_error: Exception | None = None
-    for text_en_field, text_ru_field in field_candidates:
-        payload = []
-        for item in articles:
-            record = {
-                "title": item["title"],
-                "url": item["url"],
-                text_en_field: item["text_en"],
-                text_ru_field: item["text_ru"],
-            }
-            payload.append(record)
-
-        try:
-            response = (
-                supabase.table("news_articles")
-                .upsert(payload, on_conflict="url")
-                .execute()
-            )
-        except Exception as exc:  # pragma: no cover - API error fallback
-            last_error = exc
-            continue
-
-        if getattr(response, "error", None):
-            last_error = RuntimeError(str(response.error))
-            continue
-
-        inserted = response.data or []
-        return len(inserted)
-
-    if last_error:
-        raise last_error
-    return 0
+    def _build_record(item: dict[str, str], fields: tuple[str, ...]) -> dict:
+        text_en_field, text_ru_field = fields
+        return {
+            "title": item["title"],
+            "url": item["url"],
+            text_en_field: item["text_en"],
+            text_ru_field: item["text_ru"],
+        }
+
+    stats = bulk_upsert_with_fallback(
+        supabase,
+        "news_articles",
+        articles,
+        build_row=_build_record,
+        candidates=field_candidates,
+        on_conflict="url",
+    )
+    return stats["rows"]
 
 
 def run_search(
@@ -463,6 +459,7 @@ def run_search(
     use_google: bool,
     use_open_web: bool,
     max_results: int,
+    open_web_mode: str = "crawl",
 ) -> int:
     load_env()
     ensure_translation_columns()
@@ -475,7 +472,8 @@ def run_search(
 
     api_key = os.getenv("GOOGLE_API_KEY")
     cse_id = os.getenv("GOOGLE_CSE_ID")
-    if use_google or use_open_web:
+    use_open_web_cse = use_open_web and open_web_mode == "cse"
+    if use_google or use_open_web_cse:
         if not api_key or not cse_id:
             raise RuntimeError(
                 "Missing GOOGLE_API_KEY or GOOGLE_CSE_ID in .env for Google Search API."
@@ -490,17 +488,26 @@ def run_search(
             )
             time.sleep(0.2)
 
-    if use_open_web:
+    crawled: list[dict[str, str]] = []
+    if use_open_web_cse:
         for query in queries:
             articles.extend(
                 fetch_open_web_articles(
                     query, api_key=api_key, cse_id=cse_id, max_results=max_results
                 )
             )
+    elif use_open_web:
+        crawled = crawl_open_web(OPEN_WEB_SITES, queries, max_results=max_results)
+        articles.extend(crawled)
 
     unique = dedupe_articles(articles)
     translated = prepare_translated_articles(unique)
-    return save_articles_to_supabase(translated)
+    saved = save_articles_to_supabase(translated)
+    if crawled:
+        # Только после успешной записи: иначе записи останутся в очереди краулера.
+        stored_urls = {item["url"] for item in translated}
+        mark_stored(item["url"] for item in crawled if item["url"] in stored_urls)
+    return saved
 
 
 def parse_args() -> argparse.Namespace:
@@ -519,6 +526,12 @@ def parse_args() -> argparse.Namespace:
         default=10,
         help="Max results per query per source.",
     )
+    parser.add_argument(
+        "--open-web-mode",
+        choices=["crawl", "cse"],
+        default=os.getenv("OPEN_WEB_MODE", "crawl"),
+        help="Open web discovery: incremental RSS/sitemap crawl or Google CSE per site.",
+    )
     parser.add_argument(
         "--query",
         action="append",
@@ -544,6 +557,7 @@ def main() -> None:
         use_google=use_google,
         use_open_web=use_open_web,
         max_results=args.max_results,
+        open_web_mode=args.open_web_mode,
     )
     print(f"Saved {inserted} articles to news_articles.")
     print("Эфир, информация по всему миру собрана и переведена")
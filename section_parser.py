@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+class SectionSchema:
+    """
+    Формат ответа LLM с секциями-маркерами.
+    header — регулярка строки-заголовка с группами name (маркер) и rest
+    (текст на той же строке); sections — маркер -> ключ результата.
+    inline — секции из одной строки (текст после маркера или первая
+    непустая строка под ним); остальные тянутся до следующего маркера.
+    lists — ключ -> регулярка-разделитель пунктов списка.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        header: str,
+        sections: dict[str, str],
+        required: tuple[str, ...] = (),
+        inline: tuple[str, ...] = (),
+        lists: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.name = name
+        self.header = re.compile(header)
+        self.sections = sections
+        self.required = required
+        self.inline = frozenset(inline)
+        self.lists = {key: re.compile(pattern) for key, pattern in (lists or {}).items()}
+
+
+@dataclass
+class ParsedSections:
+    schema: str
+    sections: dict[str, str] = field(default_factory=dict)
+    items: dict[str, list[str]] = field(default_factory=dict)
+    # Текст до первого маркера и свободный текст после однострочных секций.
+    preamble: str = ""
+    body: str = ""
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def get(self, key: str, default: str = "") -> str:
+        return self.sections.get(key) or default
+
+
+# journalist_agent: ### TITLE: ... / ### BENEFITS: 🔸 ... 🔸 ...
+JOURNALIST_SCHEMA = SectionSchema(
+    "journalist",
+    header=r"^###\s*(?P<name>[A-Z]+):\s*(?P<rest>.*)$",
+    sections={
+        "TITLE": "title",
+        "QUOTE": "quote",
+        "ESSENCE": "essence",
+        "BENEFITS": "benefits",
+        "RECOMMENDATION": "recommendation",
+    },
+    required=("title", "quote", "essence", "benefits", "recommendation"),
+    inline=("title", "quote", "essence", "recommendation"),
+    lists={"benefits": r"🔸"},
+)
+
+# agency_poster: ===POST=== ... ===SCIENCE=== ...
+AGENCY_SCHEMA = SectionSchema(
+    "agency",
+    header=r"^\s*===(?P<name>[A-Z]+)===\s*(?P<rest>.*)$",
+    sections={"POST": "post", "SCIENCE": "science"},
+    required=("post", "science"),
+)
+
+# scout_agent: вступление, > цитата, [СУТЬ], [ПОЛЬЗА] со списком "- ", [РЕКОМЕНДАЦИЯ]
+SCOUT_SCHEMA = SectionSchema(
+    "scout",
+    header=r"^\s*\[(?P<name>[А-ЯЁA-Z]+)\]\s*(?P<rest>.*)$",
+    sections={"СУТЬ": "essence", "ПОЛЬЗА": "benefits", "РЕКОМЕНДАЦИЯ": "recommendation"},
+    required=("essence", "benefits", "recommendation"),
+    lists={"benefits": r"(?m)^\s*[-•*]\s+"},
+)
+
+
+def parse_sections(text: str, schema: SectionSchema) -> ParsedSections:
+    """
+    Разбирает текст за один проход по строкам: каждая строка один раз
+    сверяется с регуляркой заголовка. Повтор секции, пустая или
+    отсутствующая обязательная секция, пустой список — в errors
+    (для повторов остаётся первое вхождение).
+    """
+    result = ParsedSections(schema=schema.name)
+    blocks: dict[str, list[str]] = {}
+    preamble: list[str] = []
+    body: list[str] = []
+    current: Optional[list[str]] = preamble
+    awaiting: Optional[str] = None  # однострочная секция без текста на строке маркера
+
+    for line in (text or "").splitlines():
+        match = schema.header.match(line)
+        key = schema.sections.get(match.group("name")) if match else None
+        if key is not None:
+            rest = match.group("rest").strip()
+            if key in blocks:
+                result.errors.append(f"повтор секции {match.group('name')}")
+                current, awaiting = None, None
+                continue
+            blocks[key] = [rest] if rest else []
+            if key in schema.inline:
+                awaiting = None if rest else key
+                current = body
+            else:
+                awaiting = None
+                current = blocks[key]
+            continue
+        if awaiting is not None:
+            if line.strip():
+                blocks[awaiting].append(line.strip())
+                awaiting = None
+            continue
+        if current is not None:
+            current.append(line)
+
+    for key, lines in blocks.items():
+        value = "\n".join(lines).strip()
+        result.sections[key] = value
+        pattern = schema.lists.get(key)
+        if pattern is not None:
+            items = [item.strip(" -\n\t\r") for item in pattern.split(value)]
+            result.items[key] = [item for item in items if item]
+    result.preamble = "\n".join(preamble).strip()
+    result.body = "\n".join(body).strip()
+
+    markers = {key: marker for marker, key in schema.sections.items()}
+    for key in schema.required:
+        if key not in blocks:
+            result.errors.append(f"нет секции {markers[key]}")
+        elif not result.sections[key]:
+            result.errors.append(f"пустая секция {markers[key]}")
+        elif key in schema.lists and not result.items.get(key):
+            result.errors.append(f"нет пунктов в {markers[key]}")
+    return result
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Iterable, Sequence
+
+
+DEFAULT_CHUNK_ROWS = int(os.getenv("SUPABASE_BULK_CHUNK_ROWS", "500"))
+DEFAULT_CHUNK_BYTES = int(os.getenv("SUPABASE_BULK_CHUNK_BYTES", str(1_000_000)))
+DEFAULT_WORKERS = int(os.getenv("SUPABASE_BULK_WORKERS", "4"))
+DEFAULT_RETRIES = 3
+COLUMN_CACHE_FILE = Path(__file__).resolve().parent / ".supabase_columns.json"
+# Ошибки, по которым ясно, что не подходит набор колонок, а не сеть/сервер:
+# нет колонки (42703, PGRST204 — кэш схемы PostgREST), нет ограничения для on_conflict (42P10).
+COLUMN_ERROR_CODES = ("42703", "42P10", "PGRST204")
+# Нет RPC-функции (PGRST202 — нет в кэше схемы, 42883 — нет в базе): повтор не поможет.
+FUNCTION_ERROR_CODES = ("PGRST202", "42883")
+
+
+def chunk_rows(
+    rows: Sequence[dict],
+    max_rows: int = DEFAULT_CHUNK_ROWS,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> list[list[dict]]:
+    """
+    Делит payload на чанки, ограниченные по числу строк и по размеру JSON.
+    Строка, которая сама больше max_bytes, уходит отдельным чанком.
+    """
+    chunks: list[list[dict]] = []
+    current: list[dict] = []
+    current_bytes = 2
+    for row in rows:
+        row_bytes = len(json.dumps(row, ensure_ascii=False).encode("utf-8")) + 1
+        if current and (
+            len(current) >= max_rows or current_bytes + row_bytes > max_bytes
+        ):
+            chunks.append(current)
+            current = []
+            current_bytes = 2
+        current.append(row)
+        current_bytes += row_bytes
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _project_key() -> str:
+    return (os.getenv("SUPABASE_URL") or "default").rstrip("/")
+
+
+def _read_column_cache() -> dict:
+    try:
+        return json.loads(COLUMN_CACHE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def load_column_choice(table: str) -> list[str] | None:
+    """Возвращает запомненный набор колонок для таблицы текущего проекта."""
+    cached = _read_column_cache().get(_project_key(), {}).get(table)
+    if isinstance(cached, list) and all(isinstance(item, str) for item in cached):
+        return cached
+    return None
+
+
+def save_column_choice(table: str, columns: Sequence[str]) -> None:
+    cache = _read_column_cache()
+    cache.setdefault(_project_key(), {})[table] = list(columns)
+    tmp_path = COLUMN_CACHE_FILE.with_suffix(".tmp")
+    try:
+        tmp_path.write_text(json.dumps(cache, indent=2), encoding="utf-8")
+        os.replace(tmp_path, COLUMN_CACHE_FILE)
+    except OSError as exc:
+        print(f"[WARN] Не удалось сохранить кэш колонок: {exc}")
+
+
+def _upsert_chunk(supabase, table: str, chunk: list[dict], on_conflict: str) -> int:
+    response = supabase.table(table).upsert(chunk, on_conflict=on_conflict).execute()
+    if getattr(response, "error", None):
+        raise RuntimeError(str(response.error))
+    return len(response.data or [])
+
+
+def _is_column_error(exc: Exception) -> bool:
+    code = str(getattr(exc, "code", "") or "")
+    if code in COLUMN_ERROR_CODES:
+        return True
+    text = str(exc)
+    return any(item in text for item in COLUMN_ERROR_CODES)
+
+
+def is_missing_function_error(exc: Exception) -> bool:
+    """Ошибка вызова RPC из-за отсутствия функции (а не сети/сервера)."""
+    code = str(getattr(exc, "code", "") or "")
+    if code in FUNCTION_ERROR_CODES:
+        return True
+    text = str(exc)
+    return text.startswith("HTTP 404") or any(item in text for item in FUNCTION_ERROR_CODES)
+
+
+def write_chunks(
+    pool,
+    write_chunk: Callable[[list[dict]], int],
+    chunks: Sequence[list[dict]],
+    retries: int = DEFAULT_RETRIES,
+    label: str = "",
+    give_up: Callable[[Exception], bool] | None = None,
+) -> tuple[int, list[list[dict]], Exception | None]:
+    """
+    Пишет чанки через pool; повторно (с экспоненциальной паузой) отправляются
+    только упавшие. give_up(exc) — ошибка, которую повтор не исправит: попытки
+    прекращаются сразу. Возвращает (записано строк, неотправленные чанки,
+    последняя ошибка или None).
+    """
+    pending = list(chunks)
+    written = 0
+    last_error: Exception | None = None
+    for attempt in range(1, retries + 1):
+        if not pending:
+            break
+        failed: list[list[dict]] = []
+        hopeless = False
+        futures = {pool.submit(write_chunk, chunk): chunk for chunk in pending}
+        for future in as_completed(futures):
+            try:
+                written += future.result()
+            except Exception as exc:
+                last_error = exc
+                failed.append(futures[future])
+                hopeless = hopeless or (give_up is not None and give_up(exc))
+        pending = failed
+        if hopeless:
+            break
+        if pending and attempt < retries:
+            wait_for = 2 ** attempt
+            print(
+                f"[WARN] {label}: {len(pending)} чанк(ов) не записано, "
+                f"повтор через {wait_for} с..."
+            )
+            time.sleep(wait_for)
+    return written, pending, last_error if pending else None
+
+
+def _print_stats(table: str, stats: dict) -> None:
+    print(
+        f"[BULK] {table}: {stats['rows']} строк, {stats['chunks']} чанков, "
+        f"{stats['rows_per_sec']} rows/sec"
+    )
+
+
+def bulk_upsert(
+    supabase,
+    table: str,
+    rows: Sequence[dict],
+    on_conflict: str,
+    max_rows: int = DEFAULT_CHUNK_ROWS,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    report: bool = True,
+) -> dict:
+    """
+    Upsert строк чанками с ограниченным параллелизмом.
+    Повторно отправляются только упавшие чанки (с экспоненциальной паузой).
+    Возвращает статистику: rows, chunks, failed_chunks, seconds, rows_per_sec.
+    Если после всех попыток остались упавшие чанки — поднимает последнюю ошибку.
+    """
+    started = time.monotonic()
+    chunks = chunk_rows(rows, max_rows=max_rows, max_bytes=max_bytes)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        written, pending, last_error = write_chunks(
+            pool,
+            lambda chunk: _upsert_chunk(supabase, table, chunk, on_conflict),
+            chunks,
+            retries=retries,
+            label=table,
+        )
+
+    seconds = time.monotonic() - started
+    stats = {
+        "rows": written,
+        "chunks": len(chunks),
+        "failed_chunks": len(pending),
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(written / seconds, 1) if seconds > 0 else float(written),
+    }
+    if report:
+        _print_stats(table, stats)
+    if last_error is not None:
+        raise last_error
+    return stats
+
+
+def bulk_upsert_with_fallback(
+    supabase,
+    table: str,
+    items: Sequence[dict],
+    build_row: Callable[[dict, tuple[str, ...]], dict],
+    candidates: Iterable[Sequence[str]],
+    on_conflict: str,
+    **kwargs,
+) -> dict:
+    """
+    Как bulk_upsert, но с подбором набора колонок (например, пары en/ru).
+    Кандидаты проверяются на первом чанке; сработавший набор запоминается
+    для проекта, и остальной payload отправляется только с ним. К следующему
+    кандидату переходим только на ошибке колонки/ограничения; прочие
+    ошибки (сеть, 5xx) поднимаются как есть.
+    """
+    report = kwargs.pop("report", True)
+    started = time.monotonic()
+    ordered = [tuple(item) for item in candidates]
+    cached = load_column_choice(table)
+    if cached and tuple(cached) in ordered:
+        ordered.remove(tuple(cached))
+        ordered.insert(0, tuple(cached))
+
+    max_rows = kwargs.get("max_rows", DEFAULT_CHUNK_ROWS)
+    max_bytes = kwargs.get("max_bytes", DEFAULT_CHUNK_BYTES)
+    last_error: Exception | None = None
+    for columns in ordered:
+        rows = [build_row(item, columns) for item in items]
+        if not rows:
+            return bulk_upsert(supabase, table, rows, on_conflict, report=report, **kwargs)
+        probe = chunk_rows(rows, max_rows=max_rows, max_bytes=max_bytes)[0]
+        try:
+            probe_written = _upsert_chunk(supabase, table, probe, on_conflict)
+        except Exception as exc:
+            if not _is_column_error(exc):
+                raise
+            last_error = exc
+            continue
+        if list(columns) != cached:
+            save_column_choice(table, columns)
+        stats = bulk_upsert(
+            supabase, table, rows[len(probe):], on_conflict, report=False, **kwargs
+        )
+        stats["rows"] += probe_written
+        stats["chunks"] += 1
+        seconds = time.monotonic() - started
+        stats["seconds"] = round(seconds, 3)
+        stats["rows_per_sec"] = (
+            round(stats["rows"] / seconds, 1) if seconds > 0 else float(stats["rows"])
+        )
+        if report:
+            _print_stats(table, stats)
+        return stats
+
+    if last_error:
+        raise last_error
+    raise RuntimeError(f"No column candidates for {table}")
@@ -0,0 +1,486 @@
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+from supabase_client import get_supabase_client, load_env
+
+
+INDEX_DIR = Path(
+    os.getenv("VECTOR_INDEX_DIR", str(Path(__file__).resolve().parent / ".vector_index"))
+)
+EMBEDDINGS_TABLE = "embeddings"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+PAGE_SIZE = 500
+ID_CHUNK = 100
+# Курсор синхронизации: updated_at сдвигается триггером при upsert чанка.
+SYNC_COLUMN = "updated_at"
+MIN_TRAIN_ROWS = 256
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("numpy not installed. Run: pip install numpy")
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _parse_vector(value) -> list[float] | None:
+    # pgvector приходит из PostgREST строкой "[0.1,0.2,...]".
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if isinstance(value, list) and value:
+        return [float(item) for item in value]
+    return None
+
+
+class LocalVectorIndex:
+    """
+    IVF-индекс по таблице embeddings (её наполняет embedding_pipeline.py) на диске:
+    vectors.f32 — нормированная float32-матрица (читается через memmap),
+    rows.jsonl — метаданные строк, ivf.npz — центроиды и назначения,
+    meta.json — размерность, число строк и отметка синхронизации.
+    Поиск: nprobe ближайших центроидов, затем точный скор кандидатов.
+    При малом числе строк — полный перебор.
+    """
+
+    def __init__(self, index_dir: Path = INDEX_DIR) -> None:
+        _require_numpy()
+        self.index_dir = Path(index_dir)
+        self.meta: dict = {}
+        self.rows: list[dict] = []
+        self.vectors = None
+        self.centroids = None
+        self.assignments = None
+        self._lists: list = []
+        self._meta_mtime: int | None = None
+        self.load()
+
+    @property
+    def count(self) -> int:
+        return int(self.meta.get("count", 0))
+
+    def _path(self, name: str) -> Path:
+        return self.index_dir / name
+
+    def load(self) -> None:
+        meta_path = self._path("meta.json")
+        try:
+            self._meta_mtime = meta_path.stat().st_mtime_ns
+            self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self._meta_mtime = None
+            self.meta = {"count": 0, "dim": 0, "synced_at": None, "trained_count": 0}
+        count, dim = self.count, int(self.meta.get("dim", 0))
+
+        self.rows = []
+        if count:
+            with open(self._path("rows.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    if len(self.rows) >= count:
+                        break
+                    self.rows.append(json.loads(line))
+            self.vectors = np.memmap(
+                self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(count, dim)
+            )
+        else:
+            self.vectors = None
+
+        self.centroids = None
+        self.assignments = None
+        self._lists = []
+        ivf_path = self._path("ivf.npz")
+        if count and ivf_path.exists():
+            data = np.load(ivf_path)
+            self.centroids = data["centroids"]
+            self.assignments = data["assignments"]
+            self._rebuild_lists()
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = self._path("meta.json").stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._meta_mtime:
+            return False
+        self.load()
+        return True
+
+    def _rebuild_lists(self) -> None:
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(
+            self.assignments[order], np.arange(len(self.centroids) + 1)
+        )
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def _write_meta(self) -> None:
+        tmp_path = self._path("meta.json.tmp")
+        tmp_path.write_text(json.dumps(self.meta, indent=2), encoding="utf-8")
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _assign(self, matrix):
+        result = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), 4096):
+            block = np.asarray(matrix[start:start + 4096])
+            result[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return result
+
+    def add(self, rows: list[dict], vectors: list[list[float]]) -> int:
+        """
+        Дописывает новые строки, а строки с уже известным id перезаписывает
+        на месте (вектор, метаданные, кластер). Возвращает число изменённых строк.
+        """
+        latest: dict = {}
+        for row, vec in zip(rows, vectors):
+            latest[row.get("id")] = (row, vec)
+        if not latest:
+            return 0
+        positions = {row.get("id"): position for position, row in enumerate(self.rows)}
+        fresh = [item for key, item in latest.items() if key not in positions]
+        updates = [(positions[key], item) for key, item in latest.items() if key in positions]
+        matrix = _normalize_rows(np.asarray([vec for _, vec in latest.values()], dtype=np.float32))
+        dim = int(self.meta.get("dim") or matrix.shape[1])
+        if matrix.shape[1] != dim:
+            raise ValueError(f"Embedding dim {matrix.shape[1]} != index dim {dim}")
+        by_id = dict(zip(latest, matrix))
+        fresh_matrix = np.asarray([by_id[row.get("id")] for row, _ in fresh], dtype=np.float32).reshape(-1, dim)
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        count = self.count
+        # Обрезаем хвосты от прерванной записи: валидно только то, что в meta.json.
+        with open(self._path("vectors.f32"), "ab") as f:
+            f.truncate(count * dim * 4)
+            f.write(fresh_matrix.tobytes())
+        if updates:
+            with open(self._path("vectors.f32"), "r+b") as f:
+                for position, (row, _) in updates:
+                    f.seek(position * dim * 4)
+                    f.write(by_id[row.get("id")].astype(np.float32).tobytes())
+                    self.rows[position] = row
+        self.rows.extend(row for row, _ in fresh)
+        with open(self._path("rows.jsonl"), "w", encoding="utf-8") as f:
+            for row in self.rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+        self.meta.update({"count": count + len(fresh), "dim": dim})
+        self.vectors = np.memmap(
+            self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(self.count, dim)
+        )
+
+        trained = int(self.meta.get("trained_count", 0))
+        if self.count >= MIN_TRAIN_ROWS and (self.centroids is None or self.count >= 2 * trained):
+            self.train()
+        elif self.centroids is not None:
+            if updates:
+                moved = np.asarray([position for position, _ in updates])
+                self.assignments[moved] = self._assign(self.vectors[moved])
+            self.assignments = np.concatenate([self.assignments, self._assign(fresh_matrix)])
+            np.savez(self._path("ivf.npz"), centroids=self.centroids, assignments=self.assignments)
+            self._rebuild_lists()
+        self._write_meta()
+        return len(fresh) + len(updates)
+
+    def remove(self, ids) -> int:
+        """Удаляет строки с данными id: матрица переписывается блоками без удалённых."""
+        drop = set(ids)
+        keep = [position for position, row in enumerate(self.rows) if row.get("id") not in drop]
+        removed = self.count - len(keep)
+        if not removed:
+            return 0
+        dim = int(self.meta.get("dim", 0))
+        keep_array = np.asarray(keep, dtype=np.int64)
+        tmp_vectors = self._path("vectors.f32.tmp")
+        with open(tmp_vectors, "wb") as f:
+            for start in range(0, len(keep_array), 4096):
+                f.write(np.asarray(self.vectors[keep_array[start:start + 4096]], dtype=np.float32).tobytes())
+        tmp_rows = self._path("rows.jsonl.tmp")
+        with open(tmp_rows, "w", encoding="utf-8") as f:
+            for position in keep:
+                f.write(json.dumps(self.rows[position], ensure_ascii=False) + "\n")
+        self.vectors = None
+        os.replace(tmp_vectors, self._path("vectors.f32"))
+        os.replace(tmp_rows, self._path("rows.jsonl"))
+        if self.centroids is not None and keep:
+            self.assignments = self.assignments[keep_array]
+            np.savez(self._path("ivf.npz"), centroids=self.centroids, assignments=self.assignments)
+        elif self._path("ivf.npz").exists():
+            self._path("ivf.npz").unlink()
+        self.meta["count"] = len(keep)
+        self._write_meta()
+        self.load()
+        return removed
+
+    def train(self) -> None:
+        """k-means (сферический) по выборке, k ≈ sqrt(N)."""
+        count = self.count
+        k = max(1, int(math.sqrt(count)))
+        rng = np.random.default_rng(42)
+        sample_ids = rng.choice(count, size=min(count, KMEANS_SAMPLE), replace=False)
+        sample = np.asarray(self.vectors[np.sort(sample_ids)])
+        centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(k):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+            centroids = _normalize_rows(centroids)
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = self._assign(self.vectors)
+        np.savez(self._path("ivf.npz"), centroids=self.centroids, assignments=self.assignments)
+        self._rebuild_lists()
+        self.meta["trained_count"] = count
+
+    def search(
+        self, vector: list[float], k: int = 3, nprobe: int = DEFAULT_NPROBE
+    ) -> list[tuple[dict, float]]:
+        if not self.count:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if self.centroids is None:
+            candidates = np.arange(self.count)
+        else:
+            probes = np.argsort(-(self.centroids @ query))[:nprobe]
+            candidates = np.concatenate([self._lists[i] for i in probes])
+            if not len(candidates):
+                return []
+        scores = np.asarray(self.vectors[np.sort(candidates)]) @ query
+        ordered = np.sort(candidates)
+        top = np.argsort(-scores)[:k]
+        return [(self.rows[int(ordered[i])], float(scores[i])) for i in top]
+
+
+_ROW_COLUMNS = "id,source,source_id,title,url,content,created_at,updated_at,embedding"
+
+
+def _fetch_rows_since(since: str | None) -> list[dict]:
+    supabase = get_supabase_client()
+    rows: list[dict] = []
+    offset = 0
+    while True:
+        query = (
+            supabase.table(EMBEDDINGS_TABLE)
+            .select(_ROW_COLUMNS)
+            .eq("model", EMBEDDING_MODEL)
+            .order(SYNC_COLUMN)
+            .order("id")
+        )
+        if since:
+            query = query.gte(SYNC_COLUMN, since)
+        response = query.range(offset, offset + PAGE_SIZE - 1).execute()
+        if getattr(response, "error", None):
+            raise RuntimeError(str(response.error))
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+
+def _fetch_rows_by_ids(ids: list) -> list[dict]:
+    supabase = get_supabase_client()
+    rows: list[dict] = []
+    for start in range(0, len(ids), ID_CHUNK):
+        response = (
+            supabase.table(EMBEDDINGS_TABLE)
+            .select(_ROW_COLUMNS)
+            .in_("id", ids[start:start + ID_CHUNK])
+            .execute()
+        )
+        if getattr(response, "error", None):
+            raise RuntimeError(str(response.error))
+        rows.extend(response.data or [])
+    return rows
+
+
+def _remote_count() -> int | None:
+    response = (
+        get_supabase_client()
+        .table(EMBEDDINGS_TABLE)
+        .select("id", count="exact")
+        .eq("model", EMBEDDING_MODEL)
+        .limit(1)
+        .execute()
+    )
+    return getattr(response, "count", None)
+
+
+def _fetch_remote_ids() -> set:
+    supabase = get_supabase_client()
+    ids: set = set()
+    offset = 0
+    while True:
+        response = (
+            supabase.table(EMBEDDINGS_TABLE)
+            .select("id")
+            .eq("model", EMBEDDING_MODEL)
+            .order("id")
+            .range(offset, offset + PAGE_SIZE - 1)
+            .execute()
+        )
+        if getattr(response, "error", None):
+            raise RuntimeError(str(response.error))
+        page = response.data or []
+        ids.update(item.get("id") for item in page)
+        if len(page) < PAGE_SIZE:
+            return ids
+        offset += PAGE_SIZE
+
+
+def _to_index_rows(raw_rows: list[dict]) -> tuple[list[dict], list[list[float]]]:
+    rows: list[dict] = []
+    vectors: list[list[float]] = []
+    for item in raw_rows:
+        vector = _parse_vector(item.get("embedding"))
+        if vector is None:
+            continue
+        rows.append(
+            {
+                "id": item.get("id"),
+                "source": item.get("source"),
+                "source_id": item.get("source_id"),
+                "title": item.get("title"),
+                "url": item.get("url"),
+                "summary": str(item.get("content") or "")[:2000],
+                "created_at": item.get("created_at"),
+            }
+        )
+        vectors.append(vector)
+    return rows, vectors
+
+
+def refresh_from_supabase(index: LocalVectorIndex, full: bool = False) -> int:
+    """
+    Подтягивает новые и перезаписанные строки embeddings (по updated_at)
+    в индекс. Затем сверяет число строк с таблицей: при расхождении
+    сравниваются id — удалённые (embedding_pipeline._delete_stale)
+    убираются из индекса, пропущенные догружаются.
+    """
+    if full:
+        for name in ("meta.json", "rows.jsonl", "vectors.f32", "ivf.npz"):
+            try:
+                index._path(name).unlink()
+            except OSError:
+                pass
+        index.load()
+    if index.meta.get("sync_column") != SYNC_COLUMN:
+        # Отметка от старого курсора (created_at) не годится: один раз читаем всё.
+        index.meta.update(synced_at=None, sync_column=SYNC_COLUMN)
+    started = time.monotonic()
+    raw_rows = _fetch_rows_since(index.meta.get("synced_at"))
+    rows, vectors = _to_index_rows(raw_rows)
+    changed = index.add(rows, vectors) if rows else 0
+    if raw_rows:
+        index.meta["synced_at"] = max(str(item.get(SYNC_COLUMN) or "") for item in raw_rows) or None
+
+    removed = 0
+    remote_count = _remote_count()
+    if remote_count is None or remote_count != index.count:
+        remote_ids = _fetch_remote_ids()
+        local_ids = {row.get("id") for row in index.rows}
+        removed = index.remove(local_ids - remote_ids)
+        missing = sorted(remote_ids - local_ids, key=str)
+        if missing:
+            rows, vectors = _to_index_rows(_fetch_rows_by_ids(missing))
+            changed += index.add(rows, vectors) if rows else 0
+    index._write_meta()
+    print(
+        f"Vector index: изменено {changed}, удалено {removed} (всего {index.count}) "
+        f"за {time.monotonic() - started:.1f} с"
+    )
+    return changed + removed
+
+
+_INDEX: LocalVectorIndex | None = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_local_index() -> LocalVectorIndex | None:
+    """Индекс для бота или None, если numpy не установлен или индекс пуст."""
+    global _INDEX
+    if np is None:
+        return None
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = LocalVectorIndex()
+        else:
+            _INDEX.reload_if_changed()
+        return _INDEX if _INDEX.count else None
+
+
+def benchmark(queries: list[str], k: int = 3, nprobe: int = DEFAULT_NPROBE) -> dict:
+    """Recall@k локального индекса относительно RPC match_documents и задержки."""
+    import biopeptide_analytic as analytic
+
+    index = LocalVectorIndex()
+    recalls: list[float] = []
+    rpc_ms: list[float] = []
+    local_ms: list[float] = []
+    for query in queries:
+        embedding = analytic._openai_embed(query)
+        started = time.perf_counter()
+        rpc_hits = analytic._vector_search(query, limit=k)
+        rpc_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        local_hits = index.search(embedding, k=k, nprobe=nprobe)
+        local_ms.append((time.perf_counter() - started) * 1000)
+        expected = {hit.get("id") for hit in rpc_hits}
+        if expected:
+            found = {row.get("id") for row, _ in local_hits}
+            recalls.append(len(expected & found) / len(expected))
+    result = {
+        "queries": len(queries),
+        f"recall@{k}": round(sum(recalls) / len(recalls), 4) if recalls else None,
+        "rpc_ms_avg": round(sum(rpc_ms) / len(rpc_ms), 2) if rpc_ms else None,
+        "local_ms_avg": round(sum(local_ms) / len(local_ms), 3) if local_ms else None,
+    }
+    print(json.dumps(result, ensure_ascii=False))
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local ANN index over the embeddings table.")
+    parser.add_argument("command", choices=["refresh", "rebuild", "bench"])
+    parser.add_argument("--queries", default="", help="File with one benchmark query per line")
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    args = parser.parse_args()
+    load_env()
+    _require_numpy()
+
+    if args.command in {"refresh", "rebuild"}:
+        refresh_from_supabase(LocalVectorIndex(), full=args.command == "rebuild")
+        return
+
+    queries = ["BPC-157 дозировка", "эпиталон теломеры", "rapamycin longevity"]
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    benchmark(queries, k=args.k, nprobe=args.nprobe)
+
+
+if __name__ == "__main__":
+    main()